@@ -3,44 +3,342 @@ import asyncio
 import logging
 import sys
 import json
+import bisect
+import csv
 import datetime
-from threading import Thread
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from aiogram.client.default import DefaultBotProperties
+import functools
+import heapq
+import html
+import http.server
+import io
+import itertools
+import multiprocessing
+import queue
+import re
+import secrets
+import signal
+import socket
+import sqlite3
+import string
+import struct
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ========== РАННИЙ СТАРТ ==========
+class StartupProfiler:
+    """Тайминги фаз запуска при STARTUP_PROFILE=1: от первой строки app.py до первого апдейта.
+
+    Время отдельных импортов подробнее показывает python -X importtime app.py
+    """
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.done = False
+
+    def mark(self, phase):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        print(f'⏱ {phase}: +{(now - self._last) * 1000:.0f} мс (с начала {(now - self.started) * 1000:.0f} мс)')
+        self._last = now
+
+    async def first_update(self, handler, event, data):
+        """Outer middleware апдейтов: отмечает первый обработанный апдейт"""
+        try:
+            return await handler(event, data)
+        finally:
+            if not self.done:
+                self.done = True
+                self.mark('первый апдейт обработан')
 
 
-# ========== HTTP СЕРВЕР ДЛЯ HEALTH CHECK ==========
-class HealthHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path in ['/', '/health', '/ping']:
-            self.send_response(200)
-            self.send_header('Content-type', 'text/plain')
+class EarlyHealthServer:
+    """Порт, открытый до тяжелых импортов.
+
+    Импорт aiogram на холодном старте занимает секунды, а Render ждет
+    открытого порта. Пока приложение грузится, любой GET отвечает 503
+    {"status": "starting"}; затем тот же сокет без закрытия отдается aiohttp.
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = b'{"status": "starting"}'
+            self.send_response(503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            self.wfile.write(b'OK')
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    def __init__(self, port):
+        self.socket = socket.create_server(('0.0.0.0', port))
+        self._server = http.server.HTTPServer(self.socket.getsockname(), self.Handler, bind_and_activate=False)
+        self._server.socket = self.socket
+        threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={'poll_interval': 0.05},
+            name='early-health',
+            daemon=True
+        ).start()
+
+    def handover(self):
+        """Останавливает временный сервер и возвращает слушающий сокет"""
+        self._server.shutdown()
+        return self.socket
+
+
+class Warmup:
+    """Загрузка данных в фоновом потоке: процесс стартует, пока читаются файлы"""
+
+    def __init__(self, name, load, background=True):
+        self._done = threading.Event()
+        self._error = None
+        if background:
+            threading.Thread(target=self._run, args=(load,), name=name, daemon=True).start()
         else:
-            self.send_response(404)
-            self.end_headers()
+            load()
+            self._done.set()
 
-    def log_message(self, format, *args):
-        pass
+    def _run(self, load):
+        try:
+            load()
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._done.set()
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    async def wait(self):
+        if not self._done.is_set():
+            await asyncio.to_thread(self._done.wait)
+        if self._error is not None:
+            raise self._error
+
+
+startup = StartupProfiler(os.getenv('STARTUP_PROFILE') == '1')
+startup.mark('стандартная библиотека')
+# Только при запуске python app.py: бенчмаркам и процессам-шардам порт не нужен
+early_health = EarlyHealthServer(int(os.environ.get('PORT', 10000))) if __name__ == '__main__' else None
+startup.mark('порт открыт')
+
+from aiohttp import ClientError, ClientTimeout, FormData, web
+
+startup.mark('импорт aiohttp')
+
+
+# ========== МЕТРИКИ ==========
+class Metrics:
+    """Минимальный реестр метрик в текстовом формате Prometheus.
+
+    Счетчики, гистограммы и gauge хранятся по имени и набору меток
+    (кортеж пар). Запись потокобезопасна: в гистограммы пишет и поток-писатель БД.
+    """
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._values = {}
+
+    def describe(self, name, kind, help_text, buckets=None):
+        self._meta[name] = (kind, help_text, tuple(buckets or self.DEFAULT_BUCKETS))
+        self._values.setdefault(name, {})
 
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            series = self._values[name]
+            series[labels] = series.get(labels, 0) + value
 
-def run_http_server():
-    """Запуск HTTP сервера в отдельном потоке"""
-    port = int(os.environ.get('PORT', 10000))
-    server = HTTPServer(('0.0.0.0', port), HealthHandler)
-    print(f'✅ HTTP сервер запущен на порту {port}')
-    print(f'🌐 Health check: http://0.0.0.0:{port}/health')
-    server.serve_forever()
+    def set(self, name, value, labels=()):
+        self._values[name][labels] = value
+
+    def observe(self, name, value, labels=()):
+        buckets = self._meta[name][2]
+        with self._lock:
+            series = self._values[name]
+            state = series.get(labels)
+            if state is None:
+                state = series[labels] = [[0] * len(buckets), 0.0, 0]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = tuple(labels) + tuple(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{str(value)}"' for key, value in pairs) + '}'
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in self._meta.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in self._values[name].items():
+                    if kind != 'histogram':
+                        lines.append(f'{name}{self._labels(labels)} {value}')
+                        continue
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {cumulative}')
+                    lines.append(f'{name}_bucket{self._labels(labels, [("le", "+Inf")])} {count}')
+                    lines.append(f'{name}_sum{self._labels(labels)} {total}')
+                    lines.append(f'{name}_count{self._labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.describe('bot_handler_duration_seconds', 'histogram', 'Время работы обработчика')
+metrics.describe('bot_handler_errors_total', 'counter', 'Исключения в обработчиках')
+metrics.describe('bot_fsm_transitions_total', 'counter', 'Переходы формы заявки между состояниями')
+metrics.describe('bot_storage_commit_seconds', 'histogram', 'Ожидание записи в журнал (до fsync)')
+metrics.describe('bot_storage_fsync_seconds', 'histogram', 'Запись и fsync одной пачки журнала')
+metrics.describe('bot_storage_batch_records', 'histogram', 'Записей в одной пачке журнала',
+                 buckets=(1, 2, 5, 10, 25, 50, 100, 250, 1000))
+metrics.describe('bot_storage_write_backlog', 'gauge', 'Записей в очереди потока-писателя')
+metrics.describe('bot_telegram_requests_total', 'counter', 'Запросы к Bot API')
+metrics.describe('bot_telegram_errors_total', 'counter', 'Ошибки запросов к Bot API')
+metrics.describe('bot_telegram_request_seconds', 'histogram', 'Время запроса к Bot API')
+metrics.describe('bot_notifier_queue_size', 'gauge', 'Уведомлений в очереди отправки')
+metrics.describe('bot_event_loop_lag_seconds', 'gauge', 'Задержка event loop')
+metrics.describe('bot_throttled_total', 'counter', 'Апдейты, отброшенные антифлудом')
+metrics.describe('bot_polling_restarts_total', 'counter', 'Перезапуски упавшего polling')
+metrics.describe('bot_pipeline_pending', 'gauge', 'Принятые и еще не обработанные апдейты')
+metrics.describe('bot_pipeline_in_flight', 'gauge', 'Апдейты в обработке прямо сейчас')
+metrics.describe('bot_pipeline_chats', 'gauge', 'Чаты с необработанными апдейтами')
+metrics.describe('bot_pipeline_backpressure_seconds', 'counter', 'Ожидание места в конвейере апдейтов')
+metrics.describe('bot_scheduler_timers', 'gauge', 'Таймеры, ожидающие срабатывания')
+metrics.describe('bot_scheduler_fired_total', 'counter', 'Сработавшие таймеры')
+
+
+class LoopLagMonitor:
+    """Раз в INTERVAL секунд проверяет, насколько позже срока просыпается event loop"""
+
+    INTERVAL = 0.5
+
+    def __init__(self):
+        self.lag = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.INTERVAL)
+            self.lag = max(0.0, time.perf_counter() - started - self.INTERVAL)
+
+
+loop_lag = LoopLagMonitor()
+
+
+# ========== HTTP СЕРВЕР (health check и webhook) ==========
+# Пороги готовности для /health
+MAX_LOOP_LAG = 1.0
+MAX_WRITE_BACKLOG = 1000
+
+
+def collect_gauges():
+    metrics.set('bot_event_loop_lag_seconds', loop_lag.lag)
+    metrics.set('bot_storage_write_backlog', db.write_backlog())
+    metrics.set('bot_notifier_queue_size', notifier.queue_size())
+    status = pipeline.status()
+    metrics.set('bot_pipeline_pending', status['pending'])
+    metrics.set('bot_pipeline_in_flight', status['in_flight'])
+    metrics.set('bot_pipeline_chats', status['chats'])
+    metrics.set('bot_scheduler_timers', len(scheduler))
+
+
+async def handle_health(request):
+    """Проверка готовности: event loop не подвисает и запись на диск успевает"""
+    collect_gauges()
+    backlog = db.write_backlog()
+    if not (db.warmup.ready and funnel.warmup.ready):
+        return web.json_response({'status': 'starting'}, status=503)
+    ready = loop_lag.lag < MAX_LOOP_LAG and backlog < MAX_WRITE_BACKLOG
+    return web.json_response(
+        {
+            'status': 'ok' if ready else 'degraded',
+            'event_loop_lag': round(loop_lag.lag, 4),
+            'storage_write_backlog': backlog,
+            'notifier_queue': notifier.queue_size(),
+            'updates_pending': pipeline.pending,
+            'updates_in_flight': pipeline.in_flight
+        },
+        status=200 if ready else 503
+    )
+
+
+async def handle_metrics(request):
+    collect_gauges()
+    return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_http_site(runner):
+    """Сайт aiohttp на порту Config.PORT: забирает сокет раннего health check, если он открыт"""
+    if early_health is not None:
+        site = web.SockSite(runner, early_health.handover())
+    else:
+        site = web.TCPSite(runner, '0.0.0.0', Config.PORT)
+    await site.start()
+    startup.mark('HTTP-сервер aiohttp')
+
+
+def create_web_app(export=True):
+    """aiohttp-приложение: health check, метрики, а в режиме webhook еще и апдейты Telegram"""
+    app = web.Application()
+    for path in ('/', '/health', '/ping'):
+        app.router.add_get(path, handle_health)
+    app.router.add_get('/metrics', handle_metrics)
+    if export:
+        app.router.add_get('/export', handle_export)
+    return app
 
 
 # ========== TELEGRAM БОТ ==========
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command, StateFilter
+from aiogram import BaseMiddleware, Bot, Dispatcher, types, F
+from aiogram.client.default import DefaultBotProperties
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters import Command, CommandObject, Filter, StateFilter
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
 from aiogram.enums import ParseMode
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError
+)
+from aiogram.types import InputFile
+
+startup.mark('импорт aiogram')
 
 # Получаем токен из переменных окружения
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
@@ -48,25 +346,533 @@ if not BOT_TOKEN:
     print("❌ BOT_TOKEN не найден! Добавьте в Environment Variables на Render")
     sys.exit(1)
 
+# ========== КОНФИГУРАЦИЯ ==========
+class Config:
+    # НЕ ВСТАВЛЯЙТЕ ТОКЕН СЮДА! Используйте переменные окружения в Render
+    BOT_TOKEN = BOT_TOKEN  # Используем переменную, полученную из os.environ
+    ADMIN_IDS = [123456789]  # Замените на ваш Telegram ID
+    MANAGER_USERNAME = "@ваш_менеджер"  # Замените на реальный username менеджера
+
+    # Режим получения апдейтов: polling или webhook
+    BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+    PORT = int(os.environ.get('PORT', 10000))
+    # Render сам выставляет RENDER_EXTERNAL_URL для web-сервиса
+    WEBHOOK_BASE_URL = os.environ.get('WEBHOOK_URL') or os.environ.get('RENDER_EXTERNAL_URL', '')
+    WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+    # Секрет, который Telegram присылает в X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+    # Хранилище состояний формы: sqlite, redis или memory
+    FSM_STORAGE = os.environ.get('FSM_STORAGE', 'sqlite')
+    FSM_SQLITE_FILE = os.environ.get('FSM_SQLITE_FILE', 'fsm.sqlite3')
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    # Через сколько секунд брошенная форма забывается
+    FSM_STATE_TTL = int(os.environ.get('FSM_STATE_TTL', 24 * 60 * 60))
+
+    # Токен для GET /export; без него HTTP-выгрузка выключена (в шардированном режиме ее нет)
+    EXPORT_TOKEN = os.environ.get('EXPORT_TOKEN', '')
+
+    # Свой сервер Bot API (telegram-bot-api или заглушка в бенчмарках)
+    BOT_API_URL = os.environ.get('BOT_API_URL', '')
+
+    # Пул соединений к Bot API
+    HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 100))  # всего соединений
+    HTTP_POOL_PER_HOST = int(os.environ.get('HTTP_POOL_PER_HOST', 0))  # 0 — без отдельного лимита
+    HTTP_KEEPALIVE = float(os.environ.get('HTTP_KEEPALIVE', 60))  # простой соединения до закрытия, с
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+    # Весь запрос; к getUpdates aiogram сам прибавляет таймаут long polling
+    HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 60))
+    # Сколько уведомлений отправляется параллельно по соединениям пула
+    NOTIFIER_WORKERS = max(1, int(os.environ.get('NOTIFIER_WORKERS', 4)))
+
+    # Напоминания админам о невзятой заявке: через сколько минут после ее создания
+    LEAD_SLA_MINUTES = sorted(int(m) for m in os.environ.get('LEAD_SLA_MINUTES', '30,120,480').split(',') if m.strip())
+    # Через сколько минут без ответа напомнить о незаконченной форме (0 — не напоминать)
+    FORM_REMINDER_MINUTES = int(os.environ.get('FORM_REMINDER_MINUTES', 60))
+
+    # Конвейер апдейтов: сколько апдейтов разных чатов обрабатывается одновременно
+    # и сколько принятых апдейтов может ждать обработки
+    UPDATE_CONCURRENCY = max(1, int(os.environ.get('UPDATE_CONCURRENCY', 64)))
+    UPDATE_MAX_PENDING = max(1, int(os.environ.get('UPDATE_MAX_PENDING', 1000)))
+    # Апдейтов за один getUpdates (Bot API отдает не больше 100) и long polling, с
+    POLLING_LIMIT = min(100, max(1, int(os.environ.get('POLLING_LIMIT', 100))))
+    POLLING_TIMEOUT = int(os.environ.get('POLLING_TIMEOUT', 30))
+
+    # Шардированный режим: WORKER_SHARDS > 1 процессов-воркеров, апдейты
+    # распределяются по chat_id. SHARD_INDEX выставляется самим ботом в воркерах.
+    WORKER_SHARDS = max(1, int(os.environ.get('WORKER_SHARDS', 1)))
+    SHARD_INDEX = int(os.environ['SHARD_INDEX']) if 'SHARD_INDEX' in os.environ else None
+
+
+def shard_filename(filename):
+    """Имя файла данных для текущего шарда: leads.json -> leads.shard2.json"""
+    if Config.SHARD_INDEX is None:
+        return filename
+    base, ext = os.path.splitext(filename)
+    return f'{base}.shard{Config.SHARD_INDEX}{ext}'
+
+
+def shard_label():
+    """Подпись ответа админу из шарда: « (шард 1 из 4)»; в обычном режиме пустая"""
+    if Config.SHARD_INDEX is None:
+        return ''
+    return f' (шард {Config.SHARD_INDEX} из {Config.WORKER_SHARDS})'
+
+
+# ========== ХРАНИЛИЩЕ СОСТОЯНИЙ FSM ==========
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite (WAL) с кэшем отложенной записи.
+
+    Чтение и запись идут через кэш в памяти; измененные ключи раз в
+    FLUSH_INTERVAL секунд одной транзакцией сбрасываются на диск в отдельном
+    потоке. Кэш ограничен MAX_CACHED ключами (LRU), а формы, которые не
+    трогали дольше ttl секунд, считаются брошенными и удаляются.
+    """
+
+    FLUSH_INTERVAL = 1.0
+    MAX_CACHED = 10000
+
+    def __init__(self, filename='fsm.sqlite3', ttl=None):
+        self.filename = filename
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        # ключ -> [state, data, updated_at]
+        self._cache = OrderedDict()
+        self._dirty = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm-sqlite')
+        self._conn = None
+        self._flush_task = None
+
+    # ---------- работа с SQLite (только в потоке executor) ----------
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.filename, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS fsm ('
+                'key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+            )
+        return self._conn
+
+    def _select(self, key):
+        row = self._db().execute('SELECT state, data, updated_at FROM fsm WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return [row[0], json.loads(row[1]), row[2]]
+
+    def _write(self, upserts, deletes, expire_before):
+        conn = self._db()
+        with conn:
+            conn.executemany(
+                'INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET state = excluded.state, '
+                'data = excluded.data, updated_at = excluded.updated_at',
+                upserts
+            )
+            conn.executemany('DELETE FROM fsm WHERE key = ?', deletes)
+            if expire_before is not None:
+                conn.execute('DELETE FROM fsm WHERE updated_at < ?', (expire_before,))
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # ---------- кэш ----------
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry[2] > self.ttl
+
+    async def _entry(self, key):
+        k = self.key_builder.build(key)
+        entry = self._cache.get(k)
+        if entry is not None:
+            self._cache.move_to_end(k)
+        else:
+            entry = self._dirty.get(k)
+            if entry is None:
+                entry = await self._run(self._select, k) or [None, {}, time.time()]
+            self._cache[k] = entry
+            while len(self._cache) > self.MAX_CACHED:
+                # Измененные записи остаются в _dirty до сброса на диск
+                self._cache.popitem(last=False)
+
+        if self._expired(entry):
+            entry[0], entry[1], entry[2] = None, {}, time.time()
+            self._dirty[k] = entry
+        return k, entry
+
+    def _touch(self, k, entry):
+        entry[2] = time.time()
+        self._dirty[k] = entry
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except sqlite3.Error as e:
+                print(f'❌ Ошибка записи FSM-хранилища: {e}')
+
+    async def flush(self, expire=True):
+        dirty, self._dirty = self._dirty, {}
+        upserts = []
+        deletes = []
+        for k, (state, data, updated_at) in dirty.items():
+            if state is None and not data:
+                deletes.append((k,))
+            else:
+                upserts.append((k, state, json.dumps(data, ensure_ascii=False, default=str), updated_at))
+        expire_before = time.time() - self.ttl if expire and self.ttl is not None else None
+        if upserts or deletes or expire_before is not None:
+            await self._run(self._write, upserts, deletes, expire_before)
+
+    # ---------- интерфейс BaseStorage ----------
+    async def set_state(self, key, state=None):
+        k, entry = await self._entry(key)
+        entry[0] = state.state if isinstance(state, State) else state
+        self._touch(k, entry)
+
+    async def get_state(self, key):
+        _, entry = await self._entry(key)
+        return entry[0]
+
+    async def set_data(self, key, data):
+        k, entry = await self._entry(key)
+        entry[1] = data.copy()
+        self._touch(k, entry)
+
+    async def get_data(self, key):
+        _, entry = await self._entry(key)
+        return entry[1].copy()
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        if self._conn is not None:
+            # Соединение откроется заново при следующем обращении
+            await self._run(self._conn.close)
+            self._conn = None
+
+
+def create_fsm_storage():
+    if Config.FSM_STORAGE == 'memory':
+        return MemoryStorage()
+    if Config.FSM_STORAGE == 'redis':
+        # redis — необязательная зависимость, нужна только для этого режима
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError:
+            print("❌ Для FSM_STORAGE=redis установите пакет redis: pip install redis")
+            sys.exit(1)
+        return RedisStorage.from_url(
+            Config.REDIS_URL,
+            state_ttl=Config.FSM_STATE_TTL,
+            data_ttl=Config.FSM_STATE_TTL
+        )
+    return SQLiteStorage(shard_filename(Config.FSM_SQLITE_FILE), ttl=Config.FSM_STATE_TTL)
+
+
+# ========== HTTP-СЕССИЯ BOT API ==========
+class BotSession(AiohttpSession):
+    """Сессия Bot API с настраиваемым пулом и готовым JSON для статичных клавиатур.
+
+    Пул: pool_size соединений всего и per_host на хост, простаивающее
+    keep-alive соединение живет keepalive секунд. Таймаут на установку
+    соединения отделен от таймаута всего запроса — иначе недоступный
+    api.telegram.org держал бы каждую отправку до минуты.
+
+    Обычно aiogram на каждый запрос заново превращает reply_markup в словарь и
+    JSON. Для клавиатур, зарегистрированных через preserialize, строка
+    payload считается один раз и дальше подставляется как есть.
+    """
+
+    def __init__(self, pool_size=100, per_host=0, keepalive=60.0, connect_timeout=10.0, **kwargs):
+        super().__init__(limit=pool_size, **kwargs)
+        self._connector_init.update(limit_per_host=per_host, keepalive_timeout=keepalive)
+        self.connect_timeout = connect_timeout
+        # id(разметки) -> (разметка, JSON); ссылка на разметку не дает id переиспользоваться
+        self._markup_payloads = {}
+
+    async def make_request(self, bot, method, timeout=None):
+        # То же, что AiohttpSession.make_request, но с отдельным таймаутом соединения
+        session = await self.create_session()
+        url = self.api.api_url(token=bot.token, method=method.__api_method__)
+        form = self.build_form_data(bot=bot, method=method)
+        client_timeout = ClientTimeout(
+            total=self.timeout if timeout is None else timeout,
+            sock_connect=self.connect_timeout
+        )
+        try:
+            async with session.post(url, data=form, timeout=client_timeout) as resp:
+                raw_result = await resp.text()
+        except asyncio.TimeoutError:
+            raise TelegramNetworkError(method=method, message="Request timeout error")
+        except ClientError as e:
+            raise TelegramNetworkError(method=method, message=f"{type(e).__name__}: {e}")
+        response = self.check_response(bot=bot, method=method, status_code=resp.status, content=raw_result)
+        return response.result
+
+    def preserialize(self, bot, markups):
+        for markup in markups:
+            payload = self.prepare_value(markup, bot=bot, files={})
+            self._markup_payloads[id(markup)] = (markup, payload)
+
+    def markup_payload(self, markup):
+        cached = self._markup_payloads.get(id(markup))
+        if cached is not None and cached[0] is markup:
+            return cached[1]
+        return None
+
+    def build_form_data(self, bot, method):
+        markup = getattr(method, 'reply_markup', None)
+        payload = self.markup_payload(markup) if markup is not None else None
+        if payload is None:
+            return super().build_form_data(bot, method)
+
+        form = FormData(quote_fields=False)
+        files = {}
+        for key, value in method.model_dump(warnings=False, exclude={'reply_markup'}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field('reply_markup', payload)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
+
+
 # Инициализация бота с новым синтаксисом для aiogram 3.7.0+
 bot = Bot(
     token=BOT_TOKEN,
+    session=BotSession(
+        api=TelegramAPIServer.from_base(Config.BOT_API_URL) if Config.BOT_API_URL else PRODUCTION,
+        pool_size=Config.HTTP_POOL_SIZE,
+        per_host=Config.HTTP_POOL_PER_HOST,
+        keepalive=Config.HTTP_KEEPALIVE,
+        connect_timeout=Config.HTTP_CONNECT_TIMEOUT,
+        timeout=Config.HTTP_TIMEOUT
+    ),
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
-storage = MemoryStorage()
+storage = create_fsm_storage()
 dp = Dispatcher(storage=storage)
+startup.mark('Bot и Dispatcher')
 
 
-# ========== КОНФИГУРАЦИЯ ==========
-class Config:
-    # НЕ ВСТАВЛЯЙТЕ ТОКЕН СЮДА! Используйте переменные окружения в Render
-    BOT_TOKEN = BOT_TOKEN  # Используем переменную, полученную из os.environ
-    ADMIN_IDS = [123456789]  # Замените на ваш Telegram ID
-    MANAGER_USERNAME = "@ваш_менеджер"  # Замените на реальный username менеджера
+# ========== ИНСТРУМЕНТАЦИЯ ==========
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время и ошибки каждого обработчика, плюс переходы формы между состояниями"""
+
+    async def __call__(self, handler, event, data):
+        # Для таблиц маршрутизации меряем настоящий обработчик, а не dispatch
+        handler_object = data.get('table_handler') or data['handler']
+        labels = (('handler', handler_object.callback.__name__),)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.inc('bot_handler_errors_total', labels)
+            raise
+        finally:
+            metrics.observe('bot_handler_duration_seconds', time.perf_counter() - started, labels)
+            state = data.get('state')
+            if state is not None:
+                new_state = await state.get_state()
+                old_state = data.get('raw_state')
+                if new_state != old_state:
+                    metrics.inc('bot_fsm_transitions_total', (('from', old_state or 'none'), ('to', new_state or 'none')))
+
+
+async def telegram_api_metrics(make_request, bot, method):
+    """Middleware сессии: частота, время и ошибки запросов к Bot API"""
+    labels = (('method', type(method).__name__),)
+    metrics.inc('bot_telegram_requests_total', labels)
+    started = time.perf_counter()
+    try:
+        return await make_request(bot, method)
+    except Exception as e:
+        metrics.inc('bot_telegram_errors_total', labels + (('error', type(e).__name__),))
+        raise
+    finally:
+        metrics.observe('bot_telegram_request_seconds', time.perf_counter() - started, labels)
+
+
+if startup.enabled:
+    dp.update.outer_middleware(startup.first_update)
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+bot.session.middleware(telegram_api_metrics)
+
+
+# ========== ЗАЩИТА ОТ ФЛУДА ==========
+THROTTLE_COMMAND, THROTTLE_CALLBACK, THROTTLE_INPUT = range(3)
+THROTTLE_KINDS = ('command', 'callback', 'input')
+
+
+class FloodState:
+    """Токен-бакеты одного пользователя: по одному на команды, кнопки и ввод"""
+
+    __slots__ = ('tokens', 'updated', 'warned')
+
+    def __init__(self, limits, now):
+        self.tokens = [burst for rate, burst in limits]
+        self.updated = [now] * len(limits)
+        self.warned = False
+
+    def take(self, kind, rate, burst, now):
+        tokens = self.tokens[kind] + (now - self.updated[kind]) * rate
+        self.updated[kind] = now
+        if tokens > burst:
+            tokens = burst
+        if tokens < 1:
+            self.tokens[kind] = tokens
+            return False
+        self.tokens[kind] = tokens - 1
+        return True
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Антифлуд: лишние апдейты отбрасываются до фильтров, FSM и обработчиков"""
+
+    # (апдейтов в секунду, запас) для команд, кнопок и ввода в форму
+    LIMITS = ((1.0, 5), (3.0, 10), (2.0, 8))
+    MAX_USERS = 50000
+
+    def __init__(self, exempt=()):
+        self.exempt = frozenset(exempt)
+        self.floods = 0
+        self._users = OrderedDict()  # user_id -> FloodState, в порядке последней активности
+
+    def allow(self, user_id, kind, now):
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = FloodState(self.LIMITS, now)
+            if len(self._users) > self.MAX_USERS:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        rate, burst = self.LIMITS[kind]
+        if state.take(kind, rate, burst, now):
+            state.warned = False
+            return None
+        return state
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is None or user.id in self.exempt:
+            return await handler(event, data)
+        # type() вместо isinstance: проверка через метакласс pydantic стоит ~1 мкс
+        if type(event) is types.CallbackQuery:
+            kind = THROTTLE_CALLBACK
+        elif event.text and event.text[0] == '/':
+            kind = THROTTLE_COMMAND
+        else:
+            kind = THROTTLE_INPUT
+        state = self.allow(user.id, kind, time.monotonic())
+        if state is None:
+            return await handler(event, data)
+
+        metrics.inc('bot_throttled_total', (('kind', THROTTLE_KINDS[kind]),))
+        if state.warned:
+            return None
+        # Предупреждаем один раз за серию, дальше молча отбрасываем
+        state.warned = True
+        self.floods += 1
+        print(f"🚫 Флуд от пользователя {user.id} ({THROTTLE_KINDS[kind]})")
+        try:
+            # У Message и CallbackQuery одинаковый answer(text)
+            await event.answer(texts_for(user).THROTTLED)
+        except TelegramAPIError:
+            pass
+        return None
+
+
+throttling = ThrottlingMiddleware(exempt=Config.ADMIN_IDS)
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
 
 
 # ========== СООБЩЕНИЯ ==========
+def escape_html(value):
+    """html.escape для текста сообщения; строки без спецсимволов возвращаются как есть"""
+    value = str(value)
+    if '&' in value or '<' in value or '>' in value:
+        return html.escape(value, quote=False)
+    return value
+
+
+def template_fields(text):
+    return [field for _, field, _, _ in string.Formatter().parse(text) if field]
+
+
+class Template:
+    """Текст с полями {name}, скомпилированный при загрузке.
+
+    Текст превращается в функцию вида 'Имя: ' + _escape(name) + ..., так что
+    на каждом вызове нет разбора строки. Значения экранируются для HTML:
+    имя или описание бизнеса от пользователя не ломают разметку и не
+    добавляют свою.
+    """
+
+    __slots__ = ('text', 'fields', 'render')
+
+    def __init__(self, text):
+        self.text = text
+        parts = list(string.Formatter().parse(text))
+        self.fields = frozenset(template_fields(text))
+        for _, field, spec, conversion in parts:
+            if field is not None and (not field.isidentifier() or spec or conversion):
+                raise ValueError(f'Неподдерживаемое поле шаблона: {{{field}}}')
+        body = ' + '.join(
+            repr(literal) + (f' + _escape({field})' if field else '')
+            for literal, field, _, _ in parts
+        )
+        arguments = ', '.join(sorted(self.fields))
+        namespace = {'_escape': escape_html}
+        exec(f"def render({'*, ' + arguments if arguments else ''}):\n    return {body or repr('')}\n", namespace)
+        # render(**поля) -> готовый HTML
+        self.render = namespace['render']
+
+
+class _KeepFields(dict):
+    """format_map, который оставляет неизвестные поля на месте"""
+
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+
+class Texts:
+    """Тексты одного языка, подготовленные при загрузке.
+
+    Константы (username менеджера) подставляются сразу, поэтому почти все
+    ответы — готовые строки без работы на каждый запрос. Тексты, где остались
+    поля, становятся Template. Чего нет в переводе, берется из Messages.
+    """
+
+    def __init__(self, catalogue, constants):
+        constants = _KeepFields({key: html.escape(value, quote=False) for key, value in constants.items()})
+        for name in dir(catalogue):
+            if not name.isupper():
+                continue
+            value = getattr(catalogue, name)
+            if isinstance(value, str):
+                value = value.format_map(constants)
+                if template_fields(value):
+                    value = Template(value)
+            setattr(self, name, value)
+
+    def label(self, value):
+        """Перевод значения из справочника (услуга, бюджет), сохраненного по-русски"""
+        return self.LABELS.get(value, value)
+
+
 class Messages:
+    LANGUAGE = 'ru'
+
     WELCOME_MESSAGE = """<b>🚀 Добро пожаловать в сервис продвижения малого бизнеса!</b>
 
 Мы помогаем предпринимателям:
@@ -169,293 +975,2703 @@ Telegram менеджера: {manager_username}
 • Результат: 60+ заказов в день с бота
 """
 
+    MANAGER_CONTACT = """📞 <b>Связь с менеджером</b>
 
-# ========== КЛАВИАТУРЫ ==========
-class Keyboards:
-    @staticmethod
-    def get_main_menu():
-        return types.ReplyKeyboardMarkup(
-            keyboard=[
-                [
-                    types.KeyboardButton(text="🏢 О компании"),
-                    types.KeyboardButton(text="📦 Услуги")
-                ],
-                [
-                    types.KeyboardButton(text="💰 Рассчитать стоимость"),
-                    types.KeyboardButton(text="📊 Наши кейсы")
-                ],
-                [
-                    types.KeyboardButton(text="❓ FAQ"),
-                    types.KeyboardButton(text="📞 Контакты")
-                ],
-                [
-                    types.KeyboardButton(text="👨‍💼 Связаться с менеджером"),
-                    types.KeyboardButton(text="📝 Оставить заявку")
-                ]
-            ],
-            resize_keyboard=True
-        )
+Напишите напрямую: {manager_username}
 
-    @staticmethod
-    def get_services_keyboard():
-        return types.InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    types.InlineKeyboardButton(text="SMM", callback_data="service_smm"),
-                    types.InlineKeyboardButton(text="Маркетплейсы", callback_data="service_marketplaces")
-                ],
-                [
-                    types.InlineKeyboardButton(text="Реклама", callback_data="service_ads"),
-                    types.InlineKeyboardButton(text="Комплекс", callback_data="service_complex")
-                ],
-                [
-                    types.InlineKeyboardButton(text="Telegram боты", callback_data="service_bot")
-                ]
-            ]
-        )
+<i>Ответим в течение 15 минут в рабочее время</i>"""
+
+    CALCULATOR = """🧮 <b>Калькулятор стоимости</b>
+
+Примерные цены:
+• SMM ведение: 15-30 тыс. ₽/мес
+• Маркетплейсы: 12-25 тыс. ₽/мес
+• Настройка рекламы: 12-20 тыс. ₽/мес
+• Комплекс: от 35 тыс. ₽/мес
+
+Для точного расчета оставьте заявку, и наш менеджер сделает персональное предложение."""
+
+    MAIN_MENU = "Главное меню:"
+    THROTTLED = "⏳ Слишком много запросов, подождите несколько секунд."
+
+    # ---------- форма заявки ----------
+    FORM_NAME = "📋 <b>Заполните заявку</b>\n\nВведите ваше имя и фамилию:"
+    FORM_PHONE = "📱 <b>Контактные данные</b>\n\nОтправьте номер телефона или нажмите кнопку ниже:"
+    FORM_SERVICE = "🎯 <b>Выберите услугу:</b>"
+    FORM_BUSINESS = """🏢 <b>Опишите ваш бизнес:</b>
+
+Например: 'Интернет-магазин одежды', 'Кофейня', 'Услуги ремонта' и т.д."""
+    FORM_BUDGET = "💰 <b>Примерный бюджет на продвижение:</b>"
+    FORM_CONTACT = """📞 <b>Как с вами удобнее связаться?</b>
+
+Напишите предпочтительный способ связи:
+• Telegram
+• WhatsApp
+• Телефонный звонок
+• Email"""
+
+    LEAD_ACCEPTED = """✅ <b>Заявка #{id} принята!</b>
+
+<b>Ваши данные:</b>
+Имя: {name}
+Телефон: {phone}
+Услуга: {service}
+Бизнес: {business}
+Бюджет: {budget}
+Связь: {contact}
+
+Менеджер свяжется с вами в течение часа в рабочее время."""
+
+    LEAD_TAKEN_CLIENT = """👋 <b>Вашей заявкой занялся менеджер!</b>
+
+Скоро он с вами свяжется.
+Если есть срочные вопросы, пишите: {manager_username}"""
+
+    FORM_REMINDER = """⏳ <b>Вы не закончили заявку</b>
+
+Все, что вы уже ввели, сохранено — просто ответьте на последний вопрос выше, и менеджер свяжется с вами."""
+
+    # ---------- кнопки ----------
+    BTN_ABOUT = "🏢 О компании"
+    BTN_SERVICES = "📦 Услуги"
+    BTN_CALCULATOR = "💰 Рассчитать стоимость"
+    BTN_CASES = "📊 Наши кейсы"
+    BTN_FAQ = "❓ FAQ"
+    BTN_CONTACTS = "📞 Контакты"
+    BTN_MANAGER = "👨‍💼 Связаться с менеджером"
+    BTN_APPLY = "📝 Оставить заявку"
+    BTN_SEND_PHONE = "📱 Отправить номер телефона"
+    BTN_BACK = "↩️ Назад"
+    SERVICE_BUTTONS = {
+        "service_smm": "SMM",
+        "service_marketplaces": "Маркетплейсы",
+        "service_ads": "Реклама",
+        "service_complex": "Комплекс",
+        "service_bot": "Telegram боты"
+    }
+    BUDGET_BUTTONS = {
+        "budget_10_25": "10-25 тыс. ₽",
+        "budget_25_50": "25-50 тыс. ₽",
+        "budget_50_100": "50-100 тыс. ₽",
+        "budget_100_plus": "100+ тыс. ₽"
+    }
+
+    # Услуги, бюджеты и «Не указан» хранятся по-русски; переводы — в LABELS
+    NO_PHONE = "Не указан"
+    LABELS = {}
+
+    # ---------- для админов (только по-русски) ----------
+    LEAD_CARD = """🆕 <b>НОВАЯ ЗАЯВКА #{id}</b>
+
+👤 Клиент: {name}
+ID: {user_id}
+Юзернейм: @{username}
+📱 Телефон: {phone}
+🎯 Услуга: {service}
+🏢 Бизнес: {business}
+💰 Бюджет: {budget}
+📞 Способ связи: {contact}"""
+    LEAD_TAKEN_BY = "\n\n✅ <b>В работе у</b> {manager}"
+    LEAD_SLA_REMINDER = """⏰ <b>Заявку #{id} никто не взял уже {waited} мин</b>
+
+👤 {name} · 📱 {phone}
+🎯 {service} · 🏢 {business}"""
+    NEW_USER_CARD = """👤 <b>Новый пользователь:</b>
+
+ID: {user_id}
+Имя: {full_name}
+Юзернейм: @{username}
+Дата: {date}"""
+    NEW_USERS_DIGEST_LINE = "• {full_name} (@{username})"
+    SEARCH_RESULT = """<b>#{id}</b> · {status} · {date}
+👤 {name} · 📱 {phone}
+🎯 {service} · 🏢 {business}"""
+
+
+class MessagesEn(Messages):
+    LANGUAGE = 'en'
+
+    WELCOME_MESSAGE = """<b>🚀 Welcome to our small business promotion service!</b>
+
+We help entrepreneurs:
+• 📱 Run social media (SMM)
+• 🛍 Promote products on marketplaces
+• 📊 Set up advertising
+• 💰 Grow sales
+
+Choose a section below ⤵️
+"""
+
+    ABOUT_COMPANY = """<b>🏢 About us</b>
+
+We are a team of digital marketing experts with 8 years of experience.
+We work remotely across Russia.
+
+<b>Our results:</b>
+• 150+ successful projects
+• Average sales growth: +45% in 3 months
+• Advertising ROI: from 300%
+
+<b>We specialise in:</b>
+• Instagram, VK, Telegram
+• Wildberries, Ozon, Yandex Market
+• Own marketplaces
+"""
+
+    SERVICES = """<b>📦 Our services</b>
+
+<u>1. Social media marketing (SMM):</u>
+• Content strategy
+• Account management
+• Targeted advertising
+• Analytics and reports
+• <i>from 15,000₽/month</i>
+
+<u>2. Marketplaces:</u>
+• Product card setup
+• SEO optimisation
+• Review management
+• Advertising management
+• <i>from 12,000₽/month</i>
+
+<u>3. Advertising setup:</u>
+• Target audience analysis
+• Social media targeting
+• Search advertising (Yandex Direct, Google Ads)
+• Performance analysis
+• <i>from 12,000₽/month</i>
+
+<u>4. Full-service promotion:</u>
+• Full cycle: from analysis to execution
+• Monthly reports
+• Personal manager
+• <i>from 35,000₽/month</i>
+"""
+
+    FAQ = """<b>❓ FAQ</b>
+
+<b>1. How soon will I see results?</b>
+First results appear in 2-4 weeks. Significant growth takes about 3 months.
+
+<b>2. Do I need my own content?</b>
+We can work with your materials or create content from scratch.
+
+<b>3. What advertising budget do I need?</b>
+Minimum: from 10,000₽/month. Optimal: 25,000-50,000₽/month.
+
+<b>4. Do you give guarantees?</b>
+Yes, we guarantee growth of key metrics or refund your money.
+"""
+
+    CONTACTS = """<b>📞 Contacts</b>
+
+Manager on Telegram: {manager_username}
+
+<b>Working hours (Moscow time):</b>
+Mon-Fri: 9:00-18:00
+Sat: 10:00-15:00
+Sun: closed
+
+<b>We work online across Russia</b>
+"""
+
+    CASE_STUDIES = """<b>📊 Case studies</b>
+
+<u>Case 1: Cosmetics store</u>
+• Problem: low awareness on Instagram
+• Solution: content strategy + targeting
+• Result: +1200 followers in a month, 45 orders
+
+<u>Case 2: Bag maker on Wildberries</u>
+• Problem: product on page 50+ of search
+• Solution: SEO + promo campaign
+• Result: top 10 in the category, sales tripled
+
+<u>Case 3: Coffee shop with delivery</u>
+• Problem: no online sales
+• Solution: Telegram bot + advertising
+• Result: 60+ orders a day through the bot
+"""
+
+    MANAGER_CONTACT = """📞 <b>Contact a manager</b>
+
+Write directly: {manager_username}
+
+<i>We reply within 15 minutes during working hours</i>"""
+
+    CALCULATOR = """🧮 <b>Price calculator</b>
+
+Approximate prices:
+• SMM: 15-30k ₽/month
+• Marketplaces: 12-25k ₽/month
+• Advertising setup: 12-20k ₽/month
+• Full package: from 35k ₽/month
+
+Leave a request for an exact quote, and our manager will prepare a personal offer."""
+
+    MAIN_MENU = "Main menu:"
+    THROTTLED = "⏳ Too many requests, please wait a few seconds."
+
+    FORM_NAME = "📋 <b>Request form</b>\n\nEnter your first and last name:"
+    FORM_PHONE = "📱 <b>Contact details</b>\n\nSend your phone number or tap the button below:"
+    FORM_SERVICE = "🎯 <b>Choose a service:</b>"
+    FORM_BUSINESS = """🏢 <b>Describe your business:</b>
+
+For example: 'Online clothing store', 'Coffee shop', 'Repair services', etc."""
+    FORM_BUDGET = "💰 <b>Approximate promotion budget:</b>"
+    FORM_CONTACT = """📞 <b>How should we contact you?</b>
+
+Write your preferred way:
+• Telegram
+• WhatsApp
+• Phone call
+• Email"""
+
+    LEAD_ACCEPTED = """✅ <b>Request #{id} received!</b>
+
+<b>Your details:</b>
+Name: {name}
+Phone: {phone}
+Service: {service}
+Business: {business}
+Budget: {budget}
+Contact: {contact}
+
+A manager will contact you within an hour during working hours."""
+
+    LEAD_TAKEN_CLIENT = """👋 <b>A manager has taken your request!</b>
+
+They will contact you soon.
+For urgent questions, write to: {manager_username}"""
+
+    FORM_REMINDER = """⏳ <b>You haven't finished your request</b>
+
+Everything you entered is saved — just answer the last question above and a manager will contact you."""
+
+    BTN_ABOUT = "🏢 About us"
+    BTN_SERVICES = "📦 Services"
+    BTN_CALCULATOR = "💰 Estimate cost"
+    BTN_CASES = "📊 Case studies"
+    BTN_FAQ = "❓ FAQ"
+    BTN_CONTACTS = "📞 Contacts"
+    BTN_MANAGER = "👨‍💼 Contact a manager"
+    BTN_APPLY = "📝 Leave a request"
+    BTN_SEND_PHONE = "📱 Send phone number"
+    BTN_BACK = "↩️ Back"
+    SERVICE_BUTTONS = {
+        "service_smm": "SMM",
+        "service_marketplaces": "Marketplaces",
+        "service_ads": "Advertising",
+        "service_complex": "Full package",
+        "service_bot": "Telegram bots"
+    }
+    BUDGET_BUTTONS = {
+        "budget_10_25": "10-25k ₽",
+        "budget_25_50": "25-50k ₽",
+        "budget_50_100": "50-100k ₽",
+        "budget_100_plus": "100k+ ₽"
+    }
+
+    LABELS = {
+        "Продвижение в соцсетях (SMM)": "Social media marketing (SMM)",
+        "Маркетплейсы": "Marketplaces",
+        "Настройка рекламы": "Advertising setup",
+        "Комплексное продвижение": "Full-service promotion",
+        "Разработка бота": "Bot development",
+        "10-25 тыс. ₽": "10-25k ₽",
+        "25-50 тыс. ₽": "25-50k ₽",
+        "50-100 тыс. ₽": "50-100k ₽",
+        "100+ тыс. ₽": "100k+ ₽",
+        "Не указан": "Not provided"
+    }
+
+
+DEFAULT_LANGUAGE = 'ru'
+TEXTS = {
+    catalogue.LANGUAGE: Texts(catalogue, {'manager_username': Config.MANAGER_USERNAME})
+    for catalogue in (Messages, MessagesEn)
+}
+# Уведомления админам всегда по-русски
+ADMIN_TEXTS = TEXTS[DEFAULT_LANGUAGE]
+
+
+@functools.lru_cache(maxsize=64)
+def texts_for_language(code):
+    """Тексты по language_code из Telegram ('en', 'en-GB', ...); по умолчанию русский"""
+    if code:
+        code = code.lower()
+        texts = TEXTS.get(code) or TEXTS.get(code.split('-', 1)[0])
+        if texts is not None:
+            return texts
+    return TEXTS[DEFAULT_LANGUAGE]
+
+
+def texts_for(user):
+    return texts_for_language(user.language_code if user is not None else None)
+
+
+# ========== КЛАВИАТУРЫ ==========
+class Keyboards:
+    # Статичные клавиатуры собираются один раз на язык и дальше переиспользуются,
+    # клавиатуры с параметрами кэшируются в небольшом LRU
+    @staticmethod
+    @functools.cache
+    def get_main_menu(lang):
+        t = TEXTS[lang]
+        return types.ReplyKeyboardMarkup(
+            keyboard=[
+                [
+                    types.KeyboardButton(text=t.BTN_ABOUT),
+                    types.KeyboardButton(text=t.BTN_SERVICES)
+                ],
+                [
+                    types.KeyboardButton(text=t.BTN_CALCULATOR),
+                    types.KeyboardButton(text=t.BTN_CASES)
+                ],
+                [
+                    types.KeyboardButton(text=t.BTN_FAQ),
+                    types.KeyboardButton(text=t.BTN_CONTACTS)
+                ],
+                [
+                    types.KeyboardButton(text=t.BTN_MANAGER),
+                    types.KeyboardButton(text=t.BTN_APPLY)
+                ]
+            ],
+            resize_keyboard=True
+        )
+
+    @staticmethod
+    @functools.cache
+    def get_services_keyboard(lang):
+        labels = TEXTS[lang].SERVICE_BUTTONS
+        button = lambda data: types.InlineKeyboardButton(text=labels[data], callback_data=data)
+        return types.InlineKeyboardMarkup(
+            inline_keyboard=[
+                [button("service_smm"), button("service_marketplaces")],
+                [button("service_ads"), button("service_complex")],
+                [button("service_bot")]
+            ]
+        )
+
+    @staticmethod
+    @functools.cache
+    def get_contact_keyboard(lang):
+        t = TEXTS[lang]
+        return types.ReplyKeyboardMarkup(
+            keyboard=[
+                [
+                    types.KeyboardButton(text=t.BTN_SEND_PHONE, request_contact=True)
+                ],
+                [
+                    types.KeyboardButton(text=t.BTN_BACK)
+                ]
+            ],
+            resize_keyboard=True,
+            one_time_keyboard=True
+        )
+
+    @staticmethod
+    @functools.cache
+    def get_budget_keyboard(lang):
+        labels = TEXTS[lang].BUDGET_BUTTONS
+        button = lambda data: types.InlineKeyboardButton(text=labels[data], callback_data=data)
+        return types.InlineKeyboardMarkup(
+            inline_keyboard=[
+                [button("budget_10_25"), button("budget_25_50")],
+                [button("budget_50_100"), button("budget_100_plus")]
+            ]
+        )
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def get_manager_keyboard(lead_id):
+        return types.InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    types.InlineKeyboardButton(
+                        text="📥 Взять заявку в работу",
+                        callback_data=f"lead_take_{lead_id}"
+                    )
+                ]
+            ]
+        )
+
+    @staticmethod
+    def get_search_keyboard(search_id, newer_than=None, older_than=None):
+        """Листание результатов /find: курсор — id крайней заявки на странице"""
+        buttons = []
+        if newer_than is not None:
+            buttons.append(types.InlineKeyboardButton(text="⬅️ Новее", callback_data=f"find_{search_id}_n{newer_than}"))
+        if older_than is not None:
+            buttons.append(types.InlineKeyboardButton(text="Старее ➡️", callback_data=f"find_{search_id}_o{older_than}"))
+        return types.InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+    @staticmethod
+    def static_keyboards():
+        return [
+            keyboard(lang)
+            for lang in TEXTS
+            for keyboard in (
+                Keyboards.get_main_menu,
+                Keyboards.get_services_keyboard,
+                Keyboards.get_contact_keyboard,
+                Keyboards.get_budget_keyboard
+            )
+        ]
+
+
+# Собираем статичные клавиатуры и их JSON заранее
+bot.session.preserialize(bot, Keyboards.static_keyboards())
+
+
+# ========== НАДЕЖНАЯ ЗАПИСЬ НА ДИСК ==========
+def checksum(text):
+    return format(zlib.crc32(text.encode('utf-8')), '08x')
+
+
+def fsync_dir(filename):
+    """fsync каталога файла: без него rename может не пережить отключение питания"""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    except OSError:
+        # Windows не умеет открывать каталоги — там rename и так журналируется
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_synced(filename, text):
+    """text — строка или список кусков bytes (большие снимки не склеиваются в одну строку)"""
+    if isinstance(text, str):
+        text = [text.encode('utf-8')]
+    with open(filename, 'wb') as f:
+        f.writelines(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def atomic_write(filename, text):
+    """Файл целиком или никак: временный файл, fsync, rename, fsync каталога"""
+    tmp_filename = filename + '.tmp'
+    write_synced(tmp_filename, text)
+    os.replace(tmp_filename, filename)
+    fsync_dir(filename)
+
+
+def seal(data):
+    """JSON с контрольной суммой: {"crc32": "...", "data": ...} — файл остается обычным JSON"""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f'{{"crc32": "{checksum(payload)}", "data": {payload}}}'
+
+
+def seal_chunks(chunks):
+    """seal() для JSON, уже закодированного кусками bytes: результат — тоже список кусков"""
+    crc = 0
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+    return [f'{{"crc32": "{crc:08x}", "data": '.encode('utf-8'), *chunks, b'}']
+
+
+SEAL_PREFIX = '{"crc32": "'
+
+
+def unseal(text):
+    """Обратное к seal(); ValueError, если файл поврежден. Файлы без суммы читаются как есть"""
+    if not text.startswith(SEAL_PREFIX):
+        return json.loads(text)
+    start = len(SEAL_PREFIX)
+    crc = text[start:start + 8]
+    payload = text[start + len('xxxxxxxx", "data": '):-1]
+    if checksum(payload) != crc or not text.endswith('}'):
+        raise ValueError('контрольная сумма не совпадает')
+    return json.loads(payload)
+
+
+# ========== ЗАПИСИ ПОЛЬЗОВАТЕЛЕЙ И ЗАЯВОК ==========
+def to_timestamp(value):
+    """Время в секундах epoch: в памяти записи хранят int, на диске — ISO-строку"""
+    if value is None or type(value) is int:
+        return value
+    try:
+        return int(datetime.datetime.fromisoformat(str(value)).timestamp())
+    except ValueError:
+        return None
+
+
+def to_isoformat(timestamp):
+    return None if timestamp is None else datetime.datetime.fromtimestamp(timestamp).isoformat()
+
+
+def intern_value(value):
+    """Значения из короткого списка (статус, услуга, бюджет, язык) — одна строка на процесс,
+    а не копия в каждой записи"""
+    return sys.intern(value) if type(value) is str else value
+
+
+class User:
+    """Пользователь бота. В снимке и журнале — словарь: to_dict() / User.from_dict()"""
+
+    __slots__ = ('user_id', 'username', 'full_name', 'language', 'created_at', 'active')
+
+    def __init__(self, user_id, username, full_name, language=None, created_at=None, active=True):
+        self.user_id = user_id
+        self.username = username
+        self.full_name = full_name
+        self.language = intern_value(language)
+        self.created_at = to_timestamp(created_at)
+        # False — пользователь заблокировал бота
+        self.active = active
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data['user_id'], data.get('username'), data.get('full_name'),
+            data.get('language'), data.get('created_at'), data.get('active', True)
+        )
+
+    def values(self):
+        """Поля кортежем — дешевая копия записи (снимок базы берет их под блокировкой)"""
+        return (self.user_id, self.username, self.full_name, self.language, self.created_at, self.active)
+
+    @staticmethod
+    def values_to_dict(values):
+        user_id, username, full_name, language, created_at, active = values
+        data = {
+            'user_id': user_id,
+            'username': username,
+            'full_name': full_name,
+            'language': language,
+            'created_at': to_isoformat(created_at)
+        }
+        if not active:
+            data['active'] = False
+        return data
+
+    def to_dict(self):
+        return self.values_to_dict(self.values())
+
+
+class Lead:
+    """Заявка. В снимке, журнале и выгрузке — словарь: to_dict() / Lead.from_dict()"""
+
+    __slots__ = (
+        'id', 'user_id', 'service_type', 'business_type', 'budget', 'contact_preference',
+        'name', 'phone', 'status', 'created_at', 'manager_id'
+    )
+
+    def __init__(self, lead_id, user_id, service_type, business_type, budget, contact_preference,
+                 name, phone, status='new', created_at=None, manager_id=None):
+        self.id = lead_id
+        self.user_id = user_id
+        self.service_type = intern_value(service_type)
+        self.business_type = business_type
+        self.budget = intern_value(budget)
+        self.contact_preference = contact_preference
+        self.name = name
+        self.phone = phone
+        self.status = intern_value(status)
+        self.created_at = to_timestamp(created_at)
+        self.manager_id = manager_id
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data['id'], data.get('user_id'), data.get('service_type'), data.get('business_type'),
+            data.get('budget'), data.get('contact_preference'), data.get('name'), data.get('phone'),
+            data.get('status', 'new'), data.get('created_at'), data.get('manager_id')
+        )
+
+    def values(self):
+        """Поля кортежем в порядке __slots__ — см. User.values()"""
+        return (
+            self.id, self.user_id, self.service_type, self.business_type, self.budget,
+            self.contact_preference, self.name, self.phone, self.status, self.created_at, self.manager_id
+        )
+
+    @staticmethod
+    def values_to_dict(values):
+        (lead_id, user_id, service_type, business_type, budget, contact_preference,
+         name, phone, status, created_at, manager_id) = values
+        data = {
+            'id': lead_id,
+            'user_id': user_id,
+            'service_type': service_type,
+            'business_type': business_type,
+            'budget': budget,
+            'contact_preference': contact_preference,
+            'name': name,
+            'phone': phone,
+            'status': status,
+            'created_at': to_isoformat(created_at)
+        }
+        if manager_id is not None:
+            data['manager_id'] = manager_id
+        return data
+
+    def to_dict(self):
+        return self.values_to_dict(self.values())
+
+
+# ========== ПОИСК ПО ЗАЯВКАМ ==========
+SEARCH_WORD = re.compile(r'\w+')
+NON_DIGITS = re.compile(r'\D+')
+
+
+def search_words(text):
+    """Слова текста в нижнем регистре, ё = е"""
+    return SEARCH_WORD.findall(str(text or '').lower().replace('ё', 'е'))
+
+
+def normalize_phone(phone):
+    """Последние 10 цифр номера: +7 999..., 8 999... и 999... совпадают; None, если это не номер"""
+    digits = NON_DIGITS.sub('', str(phone or ''))
+    return digits[-10:] if len(digits) >= 7 else None
+
+
+@functools.lru_cache(maxsize=65536)
+def word_trigrams(word):
+    """Триграммы слова с пробелом в начале: по ним находятся слова с заданным началом"""
+    padded = ' ' + word
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def insert_id(ids, lead_id):
+    # Новые заявки приходят по возрастанию id — почти всегда это append
+    if not ids or ids[-1] < lead_id:
+        ids.append(lead_id)
+        return
+    position = bisect.bisect_left(ids, lead_id)
+    if position == len(ids) or ids[position] != lead_id:
+        ids.insert(position, lead_id)
+
+
+def contains_id(ids, lead_id):
+    position = bisect.bisect_left(ids, lead_id)
+    return position < len(ids) and ids[position] == lead_id
+
+
+def remove_id(ids, lead_id):
+    position = bisect.bisect_left(ids, lead_id)
+    if position < len(ids) and ids[position] == lead_id:
+        del ids[position]
+
+
+class LeadIndex:
+    """Вторичные индексы заявок для поиска.
+
+    Точные индексы: статус, услуга и телефон (последние 10 цифр). Текстовый —
+    триграммы слов имени и типа бизнеса: запрос «иван» находит заявки, где
+    какое-то слово начинается на «иван». Каждый индекс хранит отсортированные
+    массивы id (array('I'), 4 байта на запись), поэтому страница результатов
+    начинается с курсора через bisect и не зависит от общего числа заявок.
+
+    Индексы строятся в фоне после загрузки базы (~30 мкс на заявку), чтобы
+    не задерживать старт бота. Изменения, пришедшие во время построения,
+    копятся и применяются в конце; до build() изменения не нужны вовсе —
+    построение прочитает заявки в их итоговом виде.
+    """
+
+    MIN_WORD = 2  # у слова из одной буквы нет триграмм
+    BUILD_CHUNK = 1000  # заявок за один захват блокировки при построении
+
+    def __init__(self):
+        self.ids = array('I')
+        self.exact = {'status': {}, 'service_type': {}, 'phone': {}}
+        self.trigrams = {}
+        self.warmup = None
+        self._lock = threading.Lock()
+        self._pending = None
+
+    @property
+    def ready(self):
+        return self.warmup is not None and self.warmup.ready
+
+    def build(self, leads, background=True):
+        """Запускает построение индексов по списку заявок"""
+        self._pending = []
+        self.warmup = Warmup('search-index', functools.partial(self._build, leads), background)
+
+    def _build(self, leads):
+        for start in range(0, len(leads), self.BUILD_CHUNK):
+            with self._lock:
+                for lead in leads[start:start + self.BUILD_CHUNK]:
+                    self._add(lead)
+        with self._lock:
+            for change, args in self._pending:
+                change(*args)
+            self._pending = None
+
+    def _change(self, change, *args):
+        with self._lock:
+            if self.warmup is None:
+                return
+            if self._pending is not None:
+                self._pending.append((change, args))
+            else:
+                change(*args)
+
+    def add(self, lead):
+        self._change(self._add, lead)
+
+    def remove(self, lead):
+        self._change(self._remove, lead)
+
+    def move(self, lead_id, field, old, new):
+        """Заявка сменила значение точного поля (статус)"""
+        self._change(self._move, lead_id, field, old, new)
+
+    @staticmethod
+    def lead_words(lead):
+        return search_words(f"{lead.name or ''} {lead.business_type or ''}")
+
+    def _postings(self, lead):
+        """Все (индекс, ключ), в списках которых лежит заявка"""
+        exact = self.exact
+        postings = [(exact['status'], lead.status), (exact['service_type'], lead.service_type)]
+        phone = normalize_phone(lead.phone)
+        if phone is not None:
+            postings.append((exact['phone'], phone))
+        trigrams = set()
+        for word in self.lead_words(lead):
+            trigrams |= word_trigrams(word)
+        index = self.trigrams
+        postings += [(index, trigram) for trigram in trigrams]
+        return postings
+
+    def _add(self, lead):
+        lead_id = lead.id
+        insert_id(self.ids, lead_id)
+        for index, key in self._postings(lead):
+            ids = index.get(key)
+            if not ids:
+                index[key] = array('I', (lead_id,))
+            elif ids[-1] < lead_id:
+                ids.append(lead_id)
+            else:
+                insert_id(ids, lead_id)
+
+    def _remove(self, lead):
+        remove_id(self.ids, lead.id)
+        for index, key in self._postings(lead):
+            ids = index.get(key)
+            if ids is not None:
+                remove_id(ids, lead.id)
+                if not ids:
+                    del index[key]
+
+    def _move(self, lead_id, field, old, new):
+        index = self.exact[field]
+        ids = index.get(old)
+        if ids is not None:
+            remove_id(ids, lead_id)
+            if not ids:
+                del index[old]
+        insert_id(index.setdefault(new, array('I')), lead_id)
+
+    def candidates(self, words=(), phone=None, **fields):
+        """Самый короткий список id, где лежат все подходящие заявки, и остальные списки триграмм.
+
+        Точные поля дешевле проверить по самой заявке, а принадлежность
+        к спискам триграмм — bisect'ом: так до сверки слов (самой дорогой)
+        доходят почти только настоящие совпадения.
+        """
+        lists = [self.exact[field].get(value, ()) for field, value in fields.items() if value is not None]
+        if phone is not None:
+            lists.append(self.exact['phone'].get(phone, ()))
+        trigrams = set()
+        for word in words:
+            trigrams.update(word_trigrams(word))
+        text_lists = sorted((self.trigrams.get(trigram, ()) for trigram in trigrams), key=len)
+        smallest = min(lists + text_lists[:1], key=len) if lists or text_lists else self.ids
+        return smallest, [ids for ids in text_lists if ids is not smallest]
+
+    def memory_size(self):
+        """Примерный объем индексов в байтах"""
+        size = self.ids.buffer_info()[1] * self.ids.itemsize
+        for index in (*self.exact.values(), self.trigrams):
+            size += sys.getsizeof(index)
+            size += sum(ids.buffer_info()[1] * ids.itemsize + 64 for ids in index.values())
+        return size
+
+
+# ========== БАЗА ДАННЫХ (JSON-снимок + журнал добавлений) ==========
+class Database:
+    """Хранилище пользователей и заявок.
+
+    Все записи живут в памяти (User и Lead) в индексах по user_id и id заявки. Изменения
+    дописываются строкой в журнал (leads.log), поэтому запись стоит O(1), а не
+    перезапись всего файла. Снимок leads.json периодически пересобирается из
+    памяти (компактизация), после чего журнал обнуляется. Старый leads.json
+    без журнала просто становится первым снимком — отдельная миграция не нужна.
+
+    Диск трогает только отдельный поток-писатель: методы, меняющие данные,
+    асинхронные и ждут, пока их запись попадет на диск. Записи, пришедшие
+    одновременно, пишутся одной пачкой с одним fsync (group commit).
+
+    Каждая строка журнала и снимок несут CRC32. Компактизация не удаляет
+    предыдущее поколение: старый снимок становится leads.json.bak, старый
+    журнал — leads.log.1. Если снимок не читается, база восстанавливается
+    из .bak и обоих журналов; на любом шаге компактизации эта пара
+    описывает актуальное состояние.
+
+    Счетчики для админки (по статусам, услугам и бюджетам) пересчитываются
+    один раз при старте и дальше поддерживаются при каждом изменении. Так же
+    поддерживаются индексы поиска (LeadIndex), на которых работает search().
+    """
+
+    # Компактизация запускается, когда журнал длиннее снимка (но не раньше порога)
+    COMPACT_MIN_RECORDS = 1000
+    SNAPSHOT_CHUNK = 10000  # записей за один захват блокировки при снимке
+    # Максимум записей, ожидающих потока-писателя; дальше обработчики ждут
+    WRITE_QUEUE_SIZE = 10000
+    # Сколько кандидатов search() проверяет за один шаг
+    SEARCH_CHUNK = 256
+
+    _STOP = object()
+
+    def __init__(self, filename='leads.json', log_filename=None, id_offset=0, id_step=1, background=False):
+        self.filename = filename
+        self.log_filename = log_filename or os.path.splitext(filename)[0] + '.log'
+        self.backup_filename = filename + '.bak'
+        self.prev_log_filename = self.log_filename + '.1'
+        self.users = {}
+        # user_id в порядке регистрации: позиция в списке — курсор рассылки
+        self.user_ids = []
+        self.leads = {}
+        # В шардированном режиме шард i выдает id i+1, i+1+N, ... — id уникальны
+        # между шардами, и по id заявки видно, в каком шарде она лежит
+        self.id_step = id_step
+        self._next_lead_id = id_offset + 1
+        self.status_counts = Counter()
+        self.service_counts = Counter()
+        self.budget_counts = Counter()
+        self.index = LeadIndex()
+        self._log_records = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=self.WRITE_QUEUE_SIZE)
+        self._writer = None
+        self._log = None
+        # С background=True файлы читаются в потоке; до warmup.wait() данных еще нет,
+        # а индексы поиска (index.ready) достраиваются уже после
+        self._background = background
+        self.warmup = Warmup('db-load', self._open, background)
+
+    def _open(self):
+        self._load()
+        self._log = open(self.log_filename, 'a', encoding='utf-8')
+        self.index.build(list(self.leads.values()), self._background)
+
+    # ---------- загрузка и восстановление ----------
+    def _load(self):
+        existed = os.path.exists(self.filename)
+        migrated = existed and not os.path.exists(self.log_filename)
+        data = self._read_snapshot(self.filename)
+        logs = [self.log_filename]
+        recovered = False
+        if data is None:
+            # Снимка нет (падение посреди компактизации) или он поврежден:
+            # берем прошлое поколение и оба журнала
+            has_backup = os.path.exists(self.backup_filename)
+            recovered = has_backup or os.path.exists(self.prev_log_filename)
+            data = self._read_snapshot(self.backup_filename) if has_backup else {}
+            # Снимок, отложенный в .corrupt прошлым запуском, тоже считается: иначе
+            # повторный запуск тихо начал бы с одного журнала
+            damaged = existed or os.path.exists(self.filename + '.corrupt')
+            if data is None or (damaged and not recovered):
+                # Снимок испорчен, а восстановить его не из чего: журнал — только
+                # изменения после снимка, и бот молча работал бы без части базы
+                raise RuntimeError(
+                    f'{self.filename} поврежден, а прошлого поколения для восстановления нет; '
+                    f'поврежденные файлы отложены в *.corrupt'
+                )
+            logs = [self.prev_log_filename, self.log_filename]
+
+        for user in data.get('users', []):
+            self._index_user(User.from_dict(user))
+        for lead in data.get('leads', []):
+            self._index_lead(Lead.from_dict(lead))
+        for filename in logs:
+            self._replay_log(filename)
+        self._rebuild_stats()
+
+        if recovered:
+            self._write_snapshot()
+            print(f'♻️ {self.filename} восстановлен из прошлого снимка и журналов')
+        elif migrated and (self.users or self.leads):
+            # Первый запуск на старом leads.json: переписываем его в компактном виде,
+            # а исходный файл остается прошлым поколением до первой компактизации
+            os.replace(self.filename, self.backup_filename)
+            self._write_snapshot()
+            print(f'✅ {self.filename} переведен на журнальное хранилище')
+
+    @staticmethod
+    def _read_snapshot(filename):
+        """Содержимое снимка; None, если файла нет или он поврежден"""
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                return unseal(f.read())
+        except FileNotFoundError:
+            return None
+        except (ValueError, UnicodeDecodeError) as e:
+            print(f'❌ Снимок {filename} поврежден: {e}')
+            # Откладываем в сторону, чтобы следующая компактизация не сделала его .bak
+            os.replace(filename, filename + '.corrupt')
+            return None
+
+    def _replay_log(self, filename):
+        try:
+            f = open(filename, 'r', encoding='utf-8', errors='replace')
+        except FileNotFoundError:
+            return
+        broken = 0
+        with f:
+            for line in f:
+                record = self._parse_log_line(line)
+                if record is None:
+                    broken += 1
+                    continue
+                self._apply(record)
+                self._log_records += 1
+        if broken:
+            # Оборванная последняя строка после падения — норма; больше — повод проверить диск
+            print(f'⚠️ {filename}: пропущено поврежденных записей: {broken}')
+
+    @staticmethod
+    def _parse_log_line(line):
+        if not line.endswith('\n'):
+            return None
+        line = line[:-1]
+        if not line.startswith('{'):
+            crc, _, line = line.partition(' ')
+            if checksum(line) != crc:
+                return None
+        # Строки без суммы — журнал, записанный до появления CRC
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            return None
+
+    def _apply(self, record):
+        # Все операции идемпотентны: повторное применение записи ничего не ломает
+        op = record['op']
+        if op == 'user':
+            self._index_user(User.from_dict(record['data']))
+        elif op == 'user_active':
+            user = self.users.get(record['user_id'])
+            if user is not None:
+                user.active = record['active']
+        elif op == 'lead':
+            self._index_lead(Lead.from_dict(record['data']))
+        elif op == 'status':
+            lead = self.leads.get(record['id'])
+            if lead is not None:
+                status = intern_value(record['status'])
+                self.index.move(lead.id, 'status', lead.status, status)
+                lead.status = status
+                if record.get('manager_id'):
+                    lead.manager_id = record['manager_id']
+
+    def _index_user(self, user):
+        if user.user_id not in self.users:
+            self.user_ids.append(user.user_id)
+        self.users[user.user_id] = user
+
+    def _index_lead(self, lead):
+        old = self.leads.get(lead.id)
+        if old is not None:
+            # Повтор записи из журнала: заменяем заявку и в индексах поиска
+            self.index.remove(old)
+        self.leads[lead.id] = lead
+        self.index.add(lead)
+        if lead.id >= self._next_lead_id:
+            self._next_lead_id = lead.id + self.id_step
+
+    # ---------- счетчики ----------
+    def _rebuild_stats(self):
+        self.status_counts.clear()
+        self.service_counts.clear()
+        self.budget_counts.clear()
+        for lead in self.leads.values():
+            self._count_lead(lead)
+
+    def _count_lead(self, lead):
+        self.status_counts[lead.status] += 1
+        self.service_counts[lead.service_type] += 1
+        self.budget_counts[lead.budget] += 1
+
+    # ---------- поток-писатель ----------
+    def start(self):
+        """Запуск потока-писателя (вызывается из работающего event loop)"""
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._writer_loop, name='db-writer', daemon=True)
+            self._writer.start()
+
+    async def close(self):
+        """Дописывает все, что стоит в очереди, и останавливает поток-писатель"""
+        if self._writer is not None:
+            await asyncio.to_thread(self._queue.put, (self._STOP, None))
+            await asyncio.to_thread(self._writer.join)
+            self._writer = None
+        if self._log is not None:
+            self._log.close()
+
+    async def _commit(self, record):
+        started = time.perf_counter()
+        if self._writer is None:
+            # Писатель не запущен (скрипты, бенчмарки) — пишем сразу
+            self._write_batch([record])
+            self._maybe_compact()
+        else:
+            future = asyncio.get_running_loop().create_future()
+            try:
+                self._queue.put_nowait((record, future))
+            except queue.Full:
+                # Очередь переполнена — ждем места, не блокируя event loop
+                await asyncio.to_thread(self._queue.put, (record, future))
+            await future
+        metrics.observe('bot_storage_commit_seconds', time.perf_counter() - started, (('op', record['op']),))
+
+    def write_backlog(self):
+        return self._queue.qsize()
+
+    def _writer_loop(self):
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            records = [record for record, _ in batch if record is not self._STOP]
+            stop = len(records) != len(batch)
+            error = None
+            try:
+                self._write_batch(records)
+            except OSError as e:
+                print(f'❌ Ошибка записи журнала: {e}')
+                error = e
+
+            for _, future in batch:
+                if future is not None:
+                    future.get_loop().call_soon_threadsafe(self._resolve, future, error)
+
+            if error is None:
+                try:
+                    self._maybe_compact()
+                except OSError as e:
+                    print(f'❌ Ошибка компактизации: {e}')
+
+    @staticmethod
+    def _resolve(future, error):
+        if future.done():
+            return
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
+    def _write_batch(self, records):
+        if not records:
+            return
+        started = time.perf_counter()
+        lines = [json.dumps(record, ensure_ascii=False, default=str) for record in records]
+        self._log.write(''.join(f'{checksum(line)} {line}\n' for line in lines))
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._log_records += len(records)
+        metrics.observe('bot_storage_fsync_seconds', time.perf_counter() - started)
+        metrics.observe('bot_storage_batch_records', len(records))
+
+    def _maybe_compact(self):
+        if self._log_records >= max(self.COMPACT_MIN_RECORDS, len(self.users) + len(self.leads)):
+            self.compact()
+
+    def _snapshot_chunks(self):
+        """Снимок (как seal) списком кусков bytes по SNAPSHOT_CHUNK записей.
+
+        Под блокировкой (ее же берут add_user/add_lead на event loop) — только
+        список записей и кортежи их полей. Словари, даты ISO, JSON, CRC и
+        запись идут без нее и кусками: json.dumps и кодирование строки не
+        отпускают GIL, и один вызов на всю базу остановил бы loop целиком.
+        """
+        with self._lock:
+            records = {'users': (User, list(self.users.values())), 'leads': (Lead, list(self.leads.values()))}
+        chunks = []
+        for key, (record_type, items) in records.items():
+            chunks.append(f'{", " if chunks else "{"}"{key}": ['.encode('utf-8'))
+            for start in range(0, len(items), self.SNAPSHOT_CHUNK):
+                with self._lock:
+                    values = [item.values() for item in items[start:start + self.SNAPSHOT_CHUNK]]
+                encoded = json.dumps([record_type.values_to_dict(item) for item in values],
+                                     ensure_ascii=False, default=str)
+                chunks.append(((', ' if start else '') + encoded[1:-1]).encode('utf-8'))
+            chunks.append(b']')
+        chunks.append(b'}')
+        return seal_chunks(chunks)
+
+    def _write_snapshot(self):
+        atomic_write(self.filename, self._snapshot_chunks())
+
+    def compact(self):
+        """Пересобирает снимок из памяти и начинает новый журнал.
+
+        Порядок шагов важен: снимок или пара (.bak + leads.log.1 + leads.log)
+        в любой момент описывают актуальное состояние. Записи, которые еще
+        стоят в очереди, уже отражены в снимке и после него попадут в новый
+        журнал повторно — это безопасно, см. _apply.
+        """
+        tmp_filename = self.filename + '.tmp'
+        write_synced(tmp_filename, self._snapshot_chunks())
+        if os.path.exists(self.filename):
+            os.replace(self.filename, self.backup_filename)
+        self._log.close()
+        os.replace(self.log_filename, self.prev_log_filename)
+        os.replace(tmp_filename, self.filename)
+        fsync_dir(self.filename)
+        self._log = open(self.log_filename, 'w', encoding='utf-8')
+        self._log_records = 0
+
+    # ---------- публичный API ----------
+    async def add_user(self, user_id, username, full_name, language=None):
+        # Проверяем, есть ли уже пользователь
+        user = self.users.get(user_id)
+        if user is not None:
+            return user
+
+        # Добавляем нового пользователя
+        user = User(user_id, username, full_name, language, int(time.time()))
+        with self._lock:
+            self._index_user(user)
+        await self._commit({'op': 'user', 'data': user.to_dict()})
+        return user
+
+    async def set_user_active(self, user_id, active):
+        """active=False — пользователь заблокировал бота, рассылка его пропускает"""
+        user = self.users.get(user_id)
+        if user is None or user.active == active:
+            return
+        with self._lock:
+            user.active = active
+        await self._commit({'op': 'user_active', 'user_id': user_id, 'active': active})
+
+    def iter_users(self, start=0):
+        """Курсор по пользователям в порядке регистрации: пары (позиция, пользователь)"""
+        position = start
+        while position < len(self.user_ids):
+            yield position, self.users[self.user_ids[position]]
+            position += 1
+
+    async def add_lead(self, user_id, service_type, business_type, budget, contact_preference, name, phone):
+        with self._lock:
+            lead = Lead(
+                self._next_lead_id, user_id, service_type, business_type, budget,
+                contact_preference, name, phone, created_at=int(time.time())
+            )
+            self._index_lead(lead)
+        self._count_lead(lead)
+        await self._commit({'op': 'lead', 'data': lead.to_dict()})
+        return lead
+
+    def has_user(self, user_id):
+        return user_id in self.users
+
+    def get_lead(self, lead_id):
+        return self.leads.get(lead_id)
+
+    def iter_leads(self, status=None, service=None, since=None, until=None):
+        """Заявки по порядку id с фильтрами; since/until — даты 'YYYY-MM-DD' включительно.
+
+        Идем по диапазону id, а не по словарю: так итерация без копии списка
+        переживает новые заявки, добавленные между чанками выгрузки.
+        """
+        # Даты -> границы в секундах: [начало since, начало дня после until)
+        start = to_timestamp(since) if since is not None else None
+        end = None
+        if until is not None:
+            end = to_timestamp((datetime.date.fromisoformat(until) + datetime.timedelta(days=1)).isoformat())
+        for lead_id in range(1, self._next_lead_id):
+            lead = self.leads.get(lead_id)
+            if lead is None:
+                continue
+            if status is not None and lead.status != status:
+                continue
+            if service is not None and lead.service_type != service:
+                continue
+            created_at = lead.created_at or 0
+            if (start is not None and created_at < start) or (end is not None and created_at >= end):
+                continue
+            yield lead
+
+    def search(self, text=None, phone=None, status=None, service=None, before=None, after=None, limit=10):
+        """Страница заявок по фильтрам, от новых к старым.
+
+        text — слова, с которых начинаются слова имени или типа бизнеса
+        (хотя бы одно не короче двух букв); phone — номер в любом формате.
+        before/after — курсор: вернуть заявки старше before или ближайшие
+        новее after. Возвращает (заявки, есть_новее, есть_старее).
+        Пока индексы строятся (index.ready ложно), результаты неполные.
+        """
+        words = search_words(text)
+        # Слова из одной буквы не ищутся по триграммам, только сверяются у найденных
+        indexed = [word for word in words if len(word) >= LeadIndex.MIN_WORD]
+        if text and not indexed:
+            raise ValueError('в запросе нет слов из двух и больше букв')
+        if phone is not None:
+            phone = normalize_phone(phone)
+            if phone is None:
+                raise ValueError('в номере меньше 7 цифр')
+        ids, text_lists = self.index.candidates(indexed, phone=phone, status=status, service_type=service)
+
+        def matches(lead):
+            if lead is None:
+                return False
+            if status is not None and lead.status != status:
+                return False
+            if service is not None and lead.service_type != service:
+                return False
+            if phone is not None and normalize_phone(lead.phone) != phone:
+                return False
+            if not words:
+                return True
+            # Все триграммы есть, но могли прийти из разных слов — сверяем начала слов
+            lead_words = LeadIndex.lead_words(lead)
+            return all(any(word.startswith(query) for word in lead_words) for query in words)
+
+        # Списки триграмм не длиннее 16 кандидатов пересекаются с куском кандидатов
+        # через set (цена — их срез в том же диапазоне id), длинные проверяются bisect'ом
+        merged = [other for other in text_lists if len(other) <= 16 * len(ids)]
+        probed = [other for other in text_lists if len(other) > 16 * len(ids)]
+
+        def walk(start, step):
+            """Подходящие заявки от позиции start в списке ids по шагу ±1"""
+            position = start
+            while 0 <= position < len(ids):
+                if step > 0:
+                    chunk = ids[position:position + self.SEARCH_CHUNK]
+                else:
+                    chunk = ids[max(0, position - self.SEARCH_CHUNK + 1):position + 1]
+                position += step * len(chunk)
+                found = set(chunk)
+                low, high = chunk[0], chunk[-1]
+                for other in merged:
+                    found.intersection_update(other[bisect.bisect_left(other, low):bisect.bisect_right(other, high)])
+                    if not found:
+                        break
+                for lead_id in sorted(found, reverse=step < 0):
+                    if all(contains_id(other, lead_id) for other in probed):
+                        lead = self.leads.get(lead_id)
+                        if matches(lead):
+                            yield lead
+
+        def exists(start, step):
+            return next(walk(start, step), None) is not None
+
+        if after is not None:
+            page = list(itertools.islice(walk(bisect.bisect_right(ids, after), 1), limit + 1))
+            has_newer = len(page) > limit
+            page = page[:limit][::-1]
+            has_older = bool(page) and exists(bisect.bisect_left(ids, page[-1].id) - 1, -1)
+        else:
+            end = len(ids) if before is None else bisect.bisect_left(ids, before)
+            page = list(itertools.islice(walk(end - 1, -1), limit + 1))
+            has_older = len(page) > limit
+            page = page[:limit]
+            has_newer = bool(page) and before is not None and exists(bisect.bisect_right(ids, page[0].id), 1)
+        return page, has_newer, has_older
+
+    def get_user_count(self):
+        return len(self.users)
+
+    def get_leads_count(self):
+        return len(self.leads)
+
+    def get_new_leads_count(self):
+        return self.status_counts['new']
+
+    def get_stats(self):
+        return {
+            'users': len(self.users),
+            'leads': len(self.leads),
+            'by_status': dict(self.status_counts),
+            'by_service': dict(self.service_counts),
+            'by_budget': dict(self.budget_counts)
+        }
+
+    def get_user_index_size(self):
+        """Примерный объем индекса user_id в байтах (хэш-таблица + ключи)"""
+        return sys.getsizeof(self.users) + len(self.users) * sys.getsizeof(2 ** 40)
+
+    async def update_lead_status(self, lead_id, status, manager_id=None):
+        lead = self.leads.get(lead_id)
+        if lead is None:
+            return False
+        status = intern_value(status)
+        self.status_counts[lead.status] -= 1
+        self.status_counts[status] += 1
+        self.index.move(lead_id, 'status', lead.status, status)
+        with self._lock:
+            lead.status = status
+            if manager_id:
+                lead.manager_id = manager_id
+        await self._commit({'op': 'status', 'id': lead_id, 'status': status, 'manager_id': manager_id})
+        return True
+
+    async def take_lead(self, lead_id, manager_id):
+        """Переводит заявку new -> in_progress; None, если ее уже взяли"""
+        lead = self.leads.get(lead_id)
+        if lead is None or lead.status != 'new':
+            return None
+        # Проверка и смена статуса выполняются до первого await, поэтому
+        # два одновременных нажатия не могут обе пройти проверку
+        await self.update_lead_status(lead_id, 'in_progress', manager_id)
+        return lead
+
+
+# Инициализация базы данных
+db = Database(
+    shard_filename('leads.json'),
+    id_offset=Config.SHARD_INDEX or 0,
+    id_step=Config.WORKER_SHARDS,
+    background=True
+)
+
+
+# ========== УВЕДОМЛЕНИЯ ==========
+class TokenBucket:
+    """Токен-бакет: не больше rate сообщений в секунду с запасом burst"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Notifier:
+    """Фоновая отправка уведомлений.
+
+    Обработчики только кладут сообщение в очередь и сразу отвечают клиенту.
+    Пул воркеров отправляет сообщения с учетом лимитов Telegram (общий и на
+    каждый чат), повторяет отправку после RetryAfter и сетевых ошибок, а то,
+    что так и не удалось доставить, пишет в файл недоставленных сообщений.
+    При всплеске регистраций уведомления о новых пользователях сворачиваются
+    в периодическую сводку.
+
+    Что не успело уйти при остановке, сохраняется в notifications.jsonl и
+    снова ставится в очередь при следующем запуске (без on_sent: карточки
+    заявок после перезапуска и так правятся только по нажатой кнопке).
+    """
+
+    WORKERS = Config.NOTIFIER_WORKERS
+    QUEUE_SIZE = 5000
+    # Лимиты Bot API: ~30 сообщений в секунду всего и ~1 в секунду в один чат
+    GLOBAL_RATE = 30
+    CHAT_RATE = 1
+    CHAT_BURST = 3
+    MAX_CHAT_BUCKETS = 10000
+    MAX_RETRIES = 5
+    # Больше DIGEST_THRESHOLD новых пользователей за DIGEST_INTERVAL секунд —
+    # дальше в этом окне шлем одну сводку вместо отдельных сообщений
+    DIGEST_THRESHOLD = 5
+    DIGEST_INTERVAL = 60
+
+    def __init__(self, bot, dead_letter_filename='dead_letters.jsonl', backlog_filename='notifications.jsonl'):
+        self.bot = bot
+        self.dead_letter_filename = dead_letter_filename
+        self.backlog_filename = backlog_filename
+        self._queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        # Сообщение, которое воркер сейчас отправляет: при остановке его тоже сохраняем
+        self._delivering = [None] * self.WORKERS
+        # Общий лимит бота делится между процессами-шардами; рассылка берет
+        # токены из того же бакета, чтобы вместе не превышать лимит Telegram
+        global_rate = self.GLOBAL_RATE / Config.WORKER_SHARDS
+        self.global_bucket = TokenBucket(global_rate, burst=global_rate)
+        self._chat_buckets = {}
+        self._tasks = []
+        self._window_start = 0.0
+        self._window_count = 0
+        self._digest = []
+        self.sent = 0
+        self.failed = 0
+
+    # ---------- постановка в очередь ----------
+    def send(self, chat_id, text, on_sent=None, **kwargs):
+        """on_sent(message) вызывается после успешной доставки"""
+        try:
+            self._queue.put_nowait((chat_id, text, kwargs, on_sent))
+        except asyncio.QueueFull:
+            self._dead_letter(chat_id, text, 'queue full')
+
+    def send_to_admins(self, text, on_sent=None, **kwargs):
+        for admin_id in Config.ADMIN_IDS:
+            self.send(admin_id, text, on_sent=on_sent, **kwargs)
+
+    def new_user(self, user):
+        now = time.monotonic()
+        if now - self._window_start > self.DIGEST_INTERVAL:
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+
+        if self._window_count <= self.DIGEST_THRESHOLD:
+            self.send_to_admins(ADMIN_TEXTS.NEW_USER_CARD.render(
+                user_id=user.user_id,
+                full_name=user.full_name,
+                username=user.username,
+                date=datetime.datetime.now().strftime('%d.%m.%Y %H:%M')
+            ))
+        else:
+            self._digest.append(user)
+
+    def _flush_digest(self):
+        if not self._digest:
+            return
+        users, self._digest = self._digest, []
+        lines = [
+            ADMIN_TEXTS.NEW_USERS_DIGEST_LINE.render(full_name=user.full_name, username=user.username)
+            for user in users[:20]
+        ]
+        if len(users) > 20:
+            lines.append(f"… и еще {len(users) - 20}")
+        self.send_to_admins(
+            f"👥 <b>Новых пользователей: {len(users)}</b>\n\n" + '\n'.join(lines)
+        )
+
+    # ---------- воркеры ----------
+    def start(self):
+        if self._tasks:
+            return
+        self._load_backlog()
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.WORKERS)]
+        self._tasks.append(asyncio.create_task(self._digest_loop()))
+
+    async def stop(self, timeout=10):
+        """Досылает очередь (не дольше timeout секунд), остаток сохраняет до следующего запуска"""
+        self._flush_digest()
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._save_backlog()
+
+    # ---------- неотправленное при остановке ----------
+    def _save_backlog(self):
+        # Прерванная отправка могла уже дойти до Telegram: лучше редкий дубль, чем потеря
+        items = [item for item in self._delivering if item is not None]
+        self._delivering = [None] * self.WORKERS
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+            self._queue.task_done()
+        if not items:
+            return
+        lines = []
+        for chat_id, text, kwargs, _ in items:
+            kwargs = {
+                key: value.model_dump(exclude_none=True) if isinstance(value, types.InlineKeyboardMarkup) else value
+                for key, value in kwargs.items()
+            }
+            lines.append(json.dumps({'chat_id': chat_id, 'text': text, 'kwargs': kwargs}, ensure_ascii=False) + '\n')
+        try:
+            atomic_write(self.backlog_filename, ''.join(lines))
+            print(f'💾 Не успели отправить уведомлений: {len(lines)}, отправим после перезапуска')
+        except OSError as e:
+            print(f'❌ Не удалось сохранить {self.backlog_filename}: {e}')
+            for chat_id, text, _, _ in items:
+                self._dead_letter(chat_id, text, 'shutdown')
+
+    def _load_backlog(self):
+        try:
+            with open(self.backlog_filename, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        restored = 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            kwargs = record.get('kwargs') or {}
+            if 'reply_markup' in kwargs:
+                kwargs['reply_markup'] = types.InlineKeyboardMarkup.model_validate(kwargs['reply_markup'])
+            self.send(record['chat_id'], record['text'], **kwargs)
+            restored += 1
+        os.remove(self.backlog_filename)
+        print(f'📨 Уведомлений из прошлого запуска в очереди: {restored}')
+
+    def queue_size(self):
+        return self._queue.qsize()
+
+    async def _digest_loop(self):
+        while True:
+            await asyncio.sleep(self.DIGEST_INTERVAL)
+            self._flush_digest()
+
+    async def _worker(self, index):
+        while True:
+            item = self._delivering[index] = await self._queue.get()
+            chat_id, text, kwargs, on_sent = item
+            try:
+                message = await self._deliver(chat_id, text, kwargs)
+                if message is not None and on_sent is not None:
+                    on_sent(message)
+            except Exception as e:
+                self._dead_letter(chat_id, text, repr(e))
+            finally:
+                self._queue.task_done()
+            self._delivering[index] = None
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                # Полные бакеты ничего не ограничивают — их можно выбросить
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.is_full()
+                }
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.CHAT_RATE, burst=self.CHAT_BURST)
+        return bucket
+
+    async def _deliver(self, chat_id, text, kwargs):
+        for attempt in range(self.MAX_RETRIES):
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                message = await self.bot.send_message(chat_id, text, **kwargs)
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError):
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramAPIError as e:
+                # Бот заблокирован, чат не найден и т.п. — повторять бесполезно
+                self._dead_letter(chat_id, text, str(e))
+                return None
+            else:
+                self.sent += 1
+                return message
+        self._dead_letter(chat_id, text, 'retries exhausted')
+        return None
+
+    def _dead_letter(self, chat_id, text, reason):
+        self.failed += 1
+        print(f"Ошибка отправки в чат {chat_id}: {reason}")
+        record = {
+            'chat_id': chat_id,
+            'text': text,
+            'reason': reason,
+            'at': datetime.datetime.now().isoformat()
+        }
+        try:
+            with open(self.dead_letter_filename, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f'❌ Не удалось записать {self.dead_letter_filename}: {e}')
+
+
+notifier = Notifier(bot, backlog_filename=shard_filename('notifications.jsonl'))
+
+
+# ========== СОСТОЯНИЯ ДЛЯ ФОРМЫ ЗАЯВКИ ==========
+class ApplicationForm(StatesGroup):
+    waiting_for_name = State()
+    waiting_for_phone = State()
+    waiting_for_service = State()
+    waiting_for_business = State()
+    waiting_for_budget = State()
+    waiting_for_contact = State()
+
+
+SERVICE_NAMES = {
+    "service_smm": "Продвижение в соцсетях (SMM)",
+    "service_marketplaces": "Маркетплейсы",
+    "service_ads": "Настройка рекламы",
+    "service_complex": "Комплексное продвижение",
+    "service_bot": "Разработка бота"
+}
+
+BUDGET_NAMES = {
+    "budget_10_25": "10-25 тыс. ₽",
+    "budget_25_50": "25-50 тыс. ₽",
+    "budget_50_100": "50-100 тыс. ₽",
+    "budget_100_plus": "100+ тыс. ₽"
+}
+
+
+# ========== АНАЛИТИКА ВОРОНКИ ==========
+class FunnelAnalytics:
+    """Воронка формы заявки: журнал событий и агрегаты по шагам.
+
+    Каждый переход формы пишется в append-only журнал записью фиксированной
+    длины (день, user_id, шаг, код услуги, код бюджета). В памяти держатся
+    только плотные массивы счетчиков шаг × услуга, шаг × бюджет и шаг × день,
+    поэтому /stats не зависит от числа событий. При старте агрегаты
+    пересобираются одним проходом по журналу.
+    """
+
+    STEPS = ('name', 'phone', 'service', 'business', 'budget', 'contact', 'done')
+    STEP_LABELS = ('Имя', 'Телефон', 'Услуга', 'Бизнес', 'Бюджет', 'Способ связи', 'Заявка отправлена')
+    RECORD = struct.Struct('<IqBBB')
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, filename='funnel.bin', background=False):
+        self.filename = filename
+        # Код 0 — услуга/бюджет неизвестны на этом шаге
+        self.services = [None] + list(SERVICE_NAMES.values())
+        self.budgets = [None] + list(BUDGET_NAMES.values())
+        self._service_codes = {name: code for code, name in enumerate(self.services)}
+        self._budget_codes = {name: code for code, name in enumerate(self.budgets)}
+        self._step_codes = {step: code for code, step in enumerate(self.STEPS)}
+
+        steps = len(self.STEPS)
+        self.events = 0
+        self.by_step = array('Q', bytes(8 * steps))
+        self.by_service = array('Q', bytes(8 * steps * len(self.services)))
+        self.by_budget = array('Q', bytes(8 * steps * len(self.budgets)))
+        self.by_day = {}
+        self._file = None
+        self._flushed_at = time.monotonic()
+        self.warmup = Warmup('funnel-load', self._open, background)
+
+    def _open(self):
+        self._load()
+        self._file = open(self.filename, 'ab')
+
+    def _load(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Оборванная последняя запись после падения отбрасывается
+        data = data[:len(data) - len(data) % self.RECORD.size]
+        for day, _, step, service, budget in self.RECORD.iter_unpack(data):
+            self._count(day, step, service, budget)
+
+    def _count(self, day, step, service, budget):
+        steps = len(self.STEPS)
+        self.events += 1
+        self.by_step[step] += 1
+        self.by_service[service * steps + step] += 1
+        self.by_budget[budget * steps + step] += 1
+        counts = self.by_day.get(day)
+        if counts is None:
+            counts = self.by_day[day] = array('Q', bytes(8 * steps))
+        counts[step] += 1
+
+    def track(self, user_id, step, service=None, budget=None):
+        day = int(time.time() // 86400)
+        step = self._step_codes[step]
+        service = self._service_codes.get(service, 0)
+        budget = self._budget_codes.get(budget, 0)
+        self._file.write(self.RECORD.pack(day, user_id, step, service, budget))
+        self._count(day, step, service, budget)
+
+        now = time.monotonic()
+        if now - self._flushed_at > self.FLUSH_INTERVAL:
+            self._file.flush()
+            self._flushed_at = now
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def _step_count(self, table, code, step):
+        return table[code * len(self.STEPS) + self._step_codes[step]]
+
+    def report(self, days=7):
+        steps = list(zip(self.STEP_LABELS, self.by_step))
+        by_service = [
+            (name, self._step_count(self.by_service, code, 'business'),
+             self._step_count(self.by_service, code, 'done'))
+            for code, name in enumerate(self.services) if code
+        ]
+        by_budget = [
+            (name, self._step_count(self.by_budget, code, 'contact'),
+             self._step_count(self.by_budget, code, 'done'))
+            for code, name in enumerate(self.budgets) if code
+        ]
+        today = int(time.time() // 86400)
+        start, done = self._step_codes['name'], self._step_codes['done']
+        by_day = []
+        for day in range(today - days + 1, today + 1):
+            counts = self.by_day.get(day)
+            by_day.append((
+                datetime.date(1970, 1, 1) + datetime.timedelta(days=day),
+                counts[start] if counts else 0,
+                counts[done] if counts else 0
+            ))
+        return {'events': self.events, 'steps': steps, 'by_service': by_service,
+                'by_budget': by_budget, 'by_day': by_day}
+
+
+def percent(part, whole):
+    return f"{part * 100 // whole}%" if whole else "—"
+
+
+funnel = FunnelAnalytics(shard_filename('funnel.bin'), background=True)
+
+
+# ========== ЭКСПОРТ ЗАЯВОК ==========
+EXPORT_FIELDS = (
+    'id', 'created_at', 'status', 'manager_id', 'user_id', 'name', 'phone',
+    'service_type', 'business_type', 'budget', 'contact_preference'
+)
+EXPORT_CHUNK_SIZE = 500
+
+
+def parse_export_filters(params):
+    """Фильтры выгрузки из словаря параметров (команда /export или query string).
+
+    format: csv | jsonl, status: new | in_progress | ..., service: smm | ads | ...
+    (ключ из SERVICE_NAMES без префикса), since/until: YYYY-MM-DD.
+    """
+    export_format = params.get('format', 'csv')
+    if export_format not in ('csv', 'jsonl'):
+        raise ValueError(f'неизвестный формат: {export_format}')
+
+    filters = {'status': params.get('status')}
+    service = params.get('service')
+    if service is not None:
+        filters['service'] = SERVICE_NAMES.get(f'service_{service}')
+        if filters['service'] is None:
+            raise ValueError(f'неизвестная услуга: {service}')
+    for key in ('since', 'until'):
+        value = params.get(key)
+        if value is not None:
+            datetime.date.fromisoformat(value)
+            filters[key] = value
+    return export_format, filters
+
+
+async def export_chunks(export_format, filters):
+    """Выгрузка кусками по EXPORT_CHUNK_SIZE заявок: в памяти не больше одного куска"""
+    buffer = io.StringIO()
+    writer = None
+    if export_format == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+
+    rows = 0
+    for lead in db.iter_leads(**filters):
+        if writer is not None:
+            writer.writerow(lead.to_dict())
+        else:
+            buffer.write(json.dumps(lead.to_dict(), ensure_ascii=False, default=str) + '\n')
+        rows += 1
+        if rows % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            # Отдаем управление другим апдейтам между кусками
+            await asyncio.sleep(0)
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class LeadExportFile(InputFile):
+    """Документ для sendDocument, который читается из хранилища по мере отправки"""
+
+    def __init__(self, export_format, filters):
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M')
+        super().__init__(filename=f'leads_{stamp}.{export_format}')
+        self.export_format = export_format
+        self.filters = filters
+
+    async def read(self, bot):
+        # Excel открывает CSV в UTF-8 корректно только с BOM
+        if self.export_format == 'csv':
+            yield '\ufeff'.encode('utf-8')
+        async for chunk in export_chunks(self.export_format, self.filters):
+            yield chunk
+
+
+async def handle_export(request):
+    """GET /export?token=...&format=csv&status=new&service=smm&since=2024-01-01"""
+    if not Config.EXPORT_TOKEN or not secrets.compare_digest(
+        request.query.get('token', ''), Config.EXPORT_TOKEN
+    ):
+        return web.Response(status=403, text='Forbidden')
+    try:
+        export_format, filters = parse_export_filters(request.query)
+    except ValueError as e:
+        return web.Response(status=400, text=str(e))
+    # HTTP-сервер отвечает раньше, чем база дочитана с диска
+    await db.warmup.wait()
+
+    content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = web.StreamResponse(headers={
+        'Content-Type': f'{content_type}; charset=utf-8',
+        'Content-Disposition': f'attachment; filename="leads.{export_format}"'
+    })
+    await response.prepare(request)
+    async for chunk in export_chunks(export_format, filters):
+        await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
+# ========== РАССЫЛКА ==========
+class Broadcaster:
+    """Рассылка админа всем активным пользователям.
+
+    Пользователи читаются курсором по порядку регистрации страницами по
+    PAGE_SIZE; страница отправляется параллельно, но через общий с Notifier
+    бакет (~30 сообщений в секунду). После каждой страницы курсор
+    сохраняется в broadcast.json, так что после перезапуска рассылка
+    продолжается с последней сохраненной страницы. Кто заблокировал бота,
+    помечается неактивным. Прогресс админ видит в редактируемом сообщении.
+    """
+
+    PAGE_SIZE = 100
+    PROGRESS_INTERVAL = 3.0
+    MAX_RETRIES = 3
+    MAX_TEXT_LENGTH = 4096  # лимит Telegram на текст сообщения
+
+    def __init__(self, filename='broadcast.json'):
+        self.filename = filename
+        self.job = None
+        self._task = None
+        self._progress_at = 0.0
+        self._resumed_from = 0
+        self._resumed_at = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    # ---------- контрольная точка ----------
+    def _save(self):
+        atomic_write(self.filename, seal(self.job))
+
+    def _load(self):
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                return unseal(f.read())
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            print(f'❌ Контрольная точка рассылки {self.filename} повреждена: {e}')
+            return None
+
+    # ---------- управление ----------
+    async def start(self, admin_chat_id, text=None, copy_from=None):
+        status = await bot.send_message(admin_chat_id, f"📣 <b>Рассылка запускается{shard_label()}...</b>")
+        self.job = {
+            'text': text,
+            'copy_from': copy_from,
+            'admin_chat_id': admin_chat_id,
+            'status_message_id': status.message_id,
+            'cursor': 0,
+            'sent': 0,
+            'failed': 0,
+            'blocked': 0,
+            'started_at': time.time(),
+            'finished': False
+        }
+        self._save()
+        self._task = asyncio.create_task(self._run())
+
+    def resume(self):
+        job = self._load()
+        if job and not job.get('finished') and not self.running:
+            self.job = job
+            self._task = asyncio.create_task(self._run())
+            print(f"📣 Продолжаем рассылку с позиции {job['cursor']}")
+
+    async def stop(self):
+        """Останавливает рассылку при выключении бота; прогресс уже сохранен"""
+        if self.running:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def cancel(self):
+        """Отмена рассылки админом — после перезапуска она не продолжится"""
+        await self.stop()
+        if self.job is not None and not self.job['finished']:
+            self.job['finished'] = True
+            self._save()
+            await self._report(force=True, title="⏹ Рассылка остановлена")
+
+    # ---------- отправка ----------
+    async def _run(self):
+        job = self.job
+        self._resumed_from = job['cursor']
+        self._resumed_at = time.monotonic()
+        page = []
+        for position, user in db.iter_users(job['cursor']):
+            if user.active:
+                page.append(user.user_id)
+            if len(page) >= self.PAGE_SIZE:
+                await self._send_page(page, position + 1)
+                page = []
+        await self._send_page(page, len(db.user_ids))
+
+        job['finished'] = True
+        self._save()
+        await self._report(force=True, title="✅ Рассылка завершена")
+
+    async def _send_page(self, user_ids, cursor):
+        results = await asyncio.gather(*(self._send(user_id) for user_id in user_ids))
+        for outcome in results:
+            self.job[outcome] += 1
+        self.job['cursor'] = cursor
+        self._save()
+        await self._report()
+
+    async def _send(self, user_id):
+        job = self.job
+        for attempt in range(self.MAX_RETRIES):
+            await notifier.global_bucket.acquire()
+            try:
+                if job['copy_from']:
+                    await bot.copy_message(user_id, job['copy_from'][0], job['copy_from'][1])
+                else:
+                    await bot.send_message(user_id, job['text'])
+                return 'sent'
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except TelegramForbiddenError:
+                # Бот заблокирован или пользователь удален
+                await db.set_user_active(user_id, False)
+                return 'blocked'
+            except TelegramBadRequest as e:
+                # Неактивным помечаем только пропавший чат: «message is too long»
+                # или удаленный исходник копии пришли бы по всем пользователям сразу
+                if 'chat not found' in e.message.lower():
+                    await db.set_user_active(user_id, False)
+                    return 'blocked'
+                return 'failed'
+            except (TelegramNetworkError, TelegramServerError):
+                await asyncio.sleep(2 ** attempt)
+            except TelegramAPIError:
+                return 'failed'
+        return 'failed'
+
+    async def _report(self, force=False, title="📣 Рассылка идет"):
+        now = time.monotonic()
+        if not force and now - self._progress_at < self.PROGRESS_INTERVAL:
+            return
+        self._progress_at = now
+
+        job = self.job
+        total = len(db.user_ids)
+        elapsed = max(now - self._resumed_at, 0.001)
+        rate = (job['cursor'] - self._resumed_from) / elapsed
+        eta = (total - job['cursor']) / rate if rate else 0
+        text = (
+            f"<b>{title}{shard_label()}</b>\n\n"
+            f"Обработано: {job['cursor']}/{total} ({percent(job['cursor'], total)})\n"
+            f"✅ Доставлено: {job['sent']}\n"
+            f"🚫 Заблокировали бота: {job['blocked']}\n"
+            f"❌ Ошибки: {job['failed']}\n\n"
+            f"⚡ {rate:.1f} польз/с"
+        )
+        if not job['finished']:
+            text += f", осталось ~{int(eta // 60)} мин {int(eta % 60)} с"
+        try:
+            await bot.edit_message_text(
+                text, chat_id=job['admin_chat_id'], message_id=job['status_message_id']
+            )
+        except TelegramAPIError:
+            # Сообщение не изменилось или удалено — прогресс не главное
+            pass
+
+
+broadcaster = Broadcaster(shard_filename('broadcast.json'))
+
+
+# ========== ОТЛОЖЕННЫЕ ЗАДАЧИ ==========
+class Scheduler:
+    """Таймеры: напоминания о невзятых заявках и брошенных формах.
+
+    В памяти таймеры лежат в куче по времени срабатывания (heapq, O(log n)
+    на постановку) и в словаре по ключу. Повторная постановка с тем же
+    ключом заменяет таймер, отмена стоит O(1), а устаревшие записи кучи
+    пропускаются при извлечении. Каждое изменение дописывается строкой с
+    CRC в журнал timers.log. При старте журнал проигрывается, поэтому таймеры
+    переживают перезапуск, а просроченные за время простоя срабатывают
+    сразу. Когда журнал вдвое длиннее списка таймеров, он переписывается.
+    После start() журнал пишет и переписывает поток-писатель (как у
+    Database): event loop только кладет в очередь строки и снимок таймеров.
+
+    Таймер снимается до вызова обработчика: если процесс упадет посреди
+    обработчика, напоминание не повторится.
+    """
+
+    COMPACT_MIN_RECORDS = 1000
+    # Потолок сна: системные часы могли перевести
+    MAX_SLEEP = 60.0
+    _STOP = object()
+
+    def __init__(self, filename='timers.log', background=False):
+        self.filename = filename
+        self._timers = {}  # ключ -> (due, seq, kind, data)
+        self._heap = []  # (due, seq, ключ); seq отличает живую запись от замененной
+        self._seq = itertools.count()
+        self._handlers = {}
+        self._log = None
+        self._log_records = 0
+        self._queue = queue.Queue()
+        self._writer = None
+        self._task = None
+        self._wakeup = asyncio.Event()
+        self.warmup = Warmup('timers-load', self._open, background)
+
+    def __len__(self):
+        return len(self._timers)
+
+    def handler(self, kind):
+        """Декоратор: async-функция data -> None, которая выполняется при срабатывании таймера kind"""
+        def register(func):
+            self._handlers[kind] = func
+            return func
+        return register
+
+    # ---------- журнал ----------
+    def _open(self):
+        self._load()
+        self._log = open(self.filename, 'a', encoding='utf-8')
+
+    def _load(self):
+        try:
+            f = open(self.filename, 'r', encoding='utf-8', errors='replace')
+        except FileNotFoundError:
+            return
+        broken = 0
+        with f:
+            for line in f:
+                record = Database._parse_log_line(line)
+                if record is None:
+                    broken += 1
+                    continue
+                self._log_records += 1
+                if record['op'] == 'set':
+                    self._timers[record['key']] = (record['due'], next(self._seq), record['kind'], record['data'])
+                else:
+                    self._timers.pop(record['key'], None)
+        self._rebuild_heap()
+        if broken:
+            print(f'⚠️ {self.filename}: пропущено поврежденных записей: {broken}')
+
+    def _append(self, record):
+        self._log_records += 1
+        if self._writer is None:
+            # Писатель не запущен (скрипты, бенчмарки) — пишем сразу
+            self._write([record])
+        else:
+            self._queue.put_nowait(record)
+        if self._log_records >= max(self.COMPACT_MIN_RECORDS, 2 * len(self._timers)):
+            self.compact()
+
+    def compact(self):
+        """Переписывает журнал: по строке на каждый живой таймер"""
+        # Снимок — список пар (значения — неизменяемые кортежи); сериализация и запись идут в писателе
+        timers = list(self._timers.items())
+        self._log_records = len(timers)
+        if self._writer is None:
+            self._rewrite(timers)
+        else:
+            self._queue.put_nowait(timers)
+
+    def _write(self, records):
+        if not records:
+            return
+        lines = [json.dumps(record, ensure_ascii=False, default=str) for record in records]
+        # Без fsync: после падения процесса строка уже у ОС, теряется только при сбое машины
+        self._log.write(''.join(f'{checksum(line)} {line}\n' for line in lines))
+        self._log.flush()
+
+    def _rewrite(self, timers):
+        lines = []
+        for key, (due, _, kind, data) in timers:
+            line = json.dumps({'op': 'set', 'key': key, 'kind': kind, 'due': due, 'data': data},
+                              ensure_ascii=False, default=str)
+            lines.append(f'{checksum(line)} {line}\n')
+        atomic_write(self.filename, ''.join(lines))
+        self._log.close()
+        self._log = open(self.filename, 'a', encoding='utf-8')
+
+    def _writer_loop(self):
+        # В очереди записи журнала (dict), снимки для компактизации (list) и _STOP;
+        # порядок сохраняется: снимок включает все записи, стоящие перед ним
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = []
+            for item in batch:
+                if isinstance(item, dict):
+                    records.append(item)
+                    continue
+                self._flush_records(records)
+                records = []
+                if item is self._STOP:
+                    return
+                try:
+                    self._rewrite(item)
+                except OSError as e:
+                    print(f'❌ Ошибка компактизации {self.filename}: {e}')
+            self._flush_records(records)
+
+    def _flush_records(self, records):
+        try:
+            self._write(records)
+        except OSError as e:
+            print(f'❌ Ошибка записи журнала {self.filename}: {e}')
+
+    def _rebuild_heap(self):
+        self._heap = [(due, seq, key) for key, (due, seq, _, _) in self._timers.items()]
+        heapq.heapify(self._heap)
+
+    # ---------- постановка и отмена ----------
+    def schedule(self, key, kind, due, data):
+        """Ставит таймер kind на время due (секунды epoch); таймер с тем же ключом заменяется"""
+        seq = next(self._seq)
+        self._timers[key] = (due, seq, kind, data)
+        heapq.heappush(self._heap, (due, seq, key))
+        if len(self._heap) > 2 * len(self._timers) + self.COMPACT_MIN_RECORDS:
+            # Замененных и отмененных записей в куче больше, чем живых
+            self._rebuild_heap()
+        self._append({'op': 'set', 'key': key, 'kind': kind, 'due': due, 'data': data})
+        if self._heap[0][1] == seq:
+            self._wakeup.set()
+
+    def cancel(self, key):
+        if self._timers.pop(key, None) is None:
+            return False
+        self._append({'op': 'del', 'key': key})
+        return True
+
+    # ---------- срабатывание ----------
+    def start(self):
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._writer_loop, name='timers-writer', daemon=True)
+            self._writer.start()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._writer is not None:
+            # Дописываем все, что стоит в очереди
+            self._queue.put_nowait(self._STOP)
+            await asyncio.to_thread(self._writer.join)
+            self._writer = None
+        if self._log is not None:
+            self._log.close()
+
+    def _pop_due(self, now):
+        heap = self._heap
+        while heap:
+            due, seq, key = heap[0]
+            timer = self._timers.get(key)
+            if timer is None or timer[1] != seq:
+                heapq.heappop(heap)  # отмененный или замененный таймер
+                continue
+            if due > now:
+                return None
+            heapq.heappop(heap)
+            del self._timers[key]
+            self._append({'op': 'del', 'key': key})
+            return key, timer[2], timer[3]
+        return None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            timer = self._pop_due(now)
+            if timer is None:
+                delay = min(self._heap[0][0] - now, self.MAX_SLEEP) if self._heap else self.MAX_SLEEP
+                # Не wait_for: в Python 3.11 он глотает отмену, если событие
+                # выставили в тот же момент, и stop() ждал бы вечно
+                waiter = asyncio.ensure_future(self._wakeup.wait())
+                try:
+                    await asyncio.wait((waiter,), timeout=delay)
+                finally:
+                    waiter.cancel()
+                continue
+            key, kind, data = timer
+            handler = self._handlers.get(kind)
+            if handler is None:
+                print(f'⚠️ Нет обработчика для таймера {key} ({kind})')
+                continue
+            metrics.inc('bot_scheduler_fired_total', (('kind', kind),))
+            try:
+                await handler(data)
+            except Exception as e:
+                print(f'❌ Ошибка таймера {key}: {e!r}')
+            # Просроченные за время простоя таймеры не должны занять event loop целиком
+            await asyncio.sleep(0)
+
+
+scheduler = Scheduler(shard_filename('timers.log'), background=True)
+
+
+# ========== ОБРАБОТЧИКИ КОМАНД ==========
+@dp.message(Command("start"))
+async def cmd_start(message: types.Message):
+    # Повторный /start: пользователь уже в индексе, диск и админов не трогаем
+    t = texts_for(message.from_user)
+    if db.has_user(message.from_user.id):
+        await message.answer(
+            t.WELCOME_MESSAGE,
+            reply_markup=Keyboards.get_main_menu(t.LANGUAGE)
+        )
+        return
+
+    # Сохраняем пользователя в БД
+    user = await db.add_user(
+        user_id=message.from_user.id,
+        username=message.from_user.username,
+        full_name=message.from_user.full_name,
+        language=message.from_user.language_code
+    )
+
+    # Уведомляем админов о новом пользователе (в фоне)
+    notifier.new_user(user)
+
+    await message.answer(
+        t.WELCOME_MESSAGE,
+        reply_markup=Keyboards.get_main_menu(t.LANGUAGE)
+    )
+
+
+STATUS_LABELS = {
+    'new': '🆕 Новые',
+    'in_progress': '🔧 В работе'
+}
+
+
+def format_counts(counts, labels=None):
+    # Значения пришли от пользователей (старые заявки, подделанные кнопки) — экранируем
+    lines = [
+        f"• {escape_html((labels or {}).get(key, key))}: {count}"
+        for key, count in sorted(counts.items(), key=lambda item: -item[1])
+        if count
+    ]
+    return '\n'.join(lines) or '• нет данных'
+
+
+@dp.message(Command("admin"))
+async def cmd_admin(message: types.Message):
+    if message.from_user.id not in Config.ADMIN_IDS:
+        return
+
+    stats = db.get_stats()
+
+    await message.answer(
+        f"📊 <b>Панель администратора{shard_label()}</b>\n\n"
+        f"👥 Пользователей: {stats['users']}\n"
+        f"📥 Заявок всего: {stats['leads']}\n"
+        f"🆕 Новых заявок: {db.get_new_leads_count()}\n\n"
+        f"<b>По статусам:</b>\n{format_counts(stats['by_status'], STATUS_LABELS)}\n\n"
+        f"<b>По услугам:</b>\n{format_counts(stats['by_service'])}\n\n"
+        f"<b>По бюджету:</b>\n{format_counts(stats['by_budget'])}\n\n"
+        f"🧠 Индекс пользователей: ≈{db.get_user_index_size() // 1024} КБ\n"
+        f"🔎 Индекс поиска: ≈{db.index.memory_size() // 1024} КБ (/find)\n"
+        f"⏰ Отложенных напоминаний: {len(scheduler)}\n"
+        f"<i>Файл с данными: {db.filename}</i>"
+    )
+
+
+@dp.message(Command("export"))
+async def cmd_export(message: types.Message, command: CommandObject):
+    if message.from_user.id not in Config.ADMIN_IDS:
+        return
+
+    # /export [csv|jsonl] [status=new] [service=smm] [since=2024-01-01] [until=2024-12-31]
+    params = {}
+    for arg in (command.args or '').split():
+        key, sep, value = arg.partition('=')
+        if sep:
+            params[key] = value
+        else:
+            params['format'] = key
+    try:
+        export_format, filters = parse_export_filters(params)
+    except ValueError as e:
+        await message.answer(
+            f"❌ Ошибка: {e}\n\n"
+            f"Формат: /export [csv|jsonl] [status=new] [service=smm] "
+            f"[since=2024-01-01] [until=2024-12-31]"
+        )
+        return
+
+    await message.answer_document(
+        LeadExportFile(export_format, filters),
+        caption=f"📤 Выгрузка заявок{shard_label()}"
+    )
+
+
+FIND_PAGE_SIZE = 10
+FIND_USAGE = (
+    "Формат: /find [слова] [phone=+79991234567] [status=new|in_progress] [service=smm]\n"
+    "Слова ищутся в начале слов имени и типа бизнеса, номер можно писать без phone=.\n"
+    "Например: /find иван коф status=new"
+)
+PHONE_CHARS = frozenset('+0123456789()-')
+
+
+def parse_find_query(args):
+    """Аргументы /find -> параметры Database.search()"""
+    query = {}
+    words = []
+    phone_parts = []
+    for arg in (args or '').split():
+        key, sep, value = arg.partition('=')
+        if not sep:
+            # Номер часто пишут с пробелами: «+7 999 123-45-67»
+            (phone_parts if set(arg) <= PHONE_CHARS else words).append(arg)
+        elif key == 'phone':
+            query['phone'] = value
+        elif key == 'status':
+            if value not in STATUS_LABELS:
+                raise ValueError(f'неизвестный статус: {value}')
+            query['status'] = value
+        elif key == 'service':
+            query['service'] = SERVICE_NAMES.get(f'service_{value}')
+            if query['service'] is None:
+                raise ValueError(f'неизвестная услуга: {value}')
+        else:
+            raise ValueError(f'неизвестный фильтр: {key}')
+    if phone_parts and normalize_phone(''.join(phone_parts)) is not None:
+        query['phone'] = ''.join(phone_parts)
+    else:
+        words += phone_parts
+    if words:
+        query['text'] = ' '.join(words)
+    return query
+
+
+class SearchQueries:
+    """Запросы /find по короткому ключу: в callback_data (до 64 байт) кладется только ключ"""
+
+    MAX_QUERIES = 1000
+
+    def __init__(self):
+        self._queries = OrderedDict()  # ключ -> (текст запроса, параметры search)
+
+    def add(self, title, query):
+        # Случайный ключ: кнопки из старых сообщений после перезапуска не попадут в чужой запрос
+        search_id = secrets.token_hex(4)
+        self._queries[search_id] = (title, query)
+        if len(self._queries) > self.MAX_QUERIES:
+            self._queries.popitem(last=False)
+        return search_id
+
+    def get(self, search_id):
+        return self._queries.get(search_id)
+
+
+search_queries = SearchQueries()
+
+
+def render_search_page(search_id, title, page):
+    """Текст и кнопки листания для страницы результатов"""
+    leads, has_newer, has_older = page
+    lines = [f"🔎 <b>Поиск заявок{shard_label()}:</b> {escape_html(title) if title else 'все заявки'}"]
+    for lead in leads:
+        # Имя и бизнес — ввод клиента: обрезаем, чтобы страница влезла в одно сообщение
+        lines.append(ADMIN_TEXTS.SEARCH_RESULT.render(
+            id=lead.id,
+            status=lead.status,
+            date=(to_isoformat(lead.created_at) or '')[:10],
+            name=str(lead.name)[:64],
+            phone=lead.phone,
+            service=lead.service_type,
+            business=str(lead.business_type)[:64]
+        ))
+    if not leads:
+        lines.append("Ничего не найдено")
+    keyboard = Keyboards.get_search_keyboard(
+        search_id,
+        newer_than=leads[0].id if has_newer else None,
+        older_than=leads[-1].id if has_older else None
+    )
+    return '\n\n'.join(lines), keyboard
+
+
+@dp.message(Command("find"))
+async def cmd_find(message: types.Message, command: CommandObject):
+    if message.from_user.id not in Config.ADMIN_IDS:
+        return
+
+    if not db.index.ready:
+        await message.answer("⏳ Индекс поиска еще строится после запуска, попробуйте через минуту")
+        return
+
+    title = (command.args or '').strip()
+    try:
+        query = parse_find_query(title)
+        page = db.search(**query, limit=FIND_PAGE_SIZE)
+    except ValueError as e:
+        await message.answer(f"❌ Ошибка: {e}\n\n{FIND_USAGE}")
+        return
+
+    text, keyboard = render_search_page(search_queries.add(title, query), title, page)
+    await message.answer(text, reply_markup=keyboard)
+
+
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: types.Message, command: CommandObject):
+    if message.from_user.id not in Config.ADMIN_IDS:
+        return
+
+    if broadcaster.running:
+        await message.answer(f"⏳ Рассылка уже идет{shard_label()}. Остановить: /broadcast_stop")
+        return
 
-    @staticmethod
-    def get_contact_keyboard():
-        return types.ReplyKeyboardMarkup(
-            keyboard=[
-                [
-                    types.KeyboardButton(text="📱 Отправить номер телефона", request_contact=True)
-                ],
-                [
-                    types.KeyboardButton(text="↩️ Назад")
-                ]
-            ],
-            resize_keyboard=True,
-            one_time_keyboard=True
+    # Ответом на сообщение — копируем его (можно с фото/видео), иначе шлем текст команды
+    if message.reply_to_message is not None:
+        await broadcaster.start(
+            message.chat.id,
+            copy_from=[message.chat.id, message.reply_to_message.message_id]
         )
-
-    @staticmethod
-    def get_budget_keyboard():
-        return types.InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    types.InlineKeyboardButton(text="10-25 тыс. ₽", callback_data="budget_10_25"),
-                    types.InlineKeyboardButton(text="25-50 тыс. ₽", callback_data="budget_25_50")
-                ],
-                [
-                    types.InlineKeyboardButton(text="50-100 тыс. ₽", callback_data="budget_50_100"),
-                    types.InlineKeyboardButton(text="100+ тыс. ₽", callback_data="budget_100_plus")
-                ]
-            ]
+    elif command.args:
+        text = html.escape(command.args)
+        # Считаем в UTF-16, как Telegram, и с запасом — вместе с экранированием
+        length = len(text.encode('utf-16-le')) // 2
+        if length > Broadcaster.MAX_TEXT_LENGTH:
+            await message.answer(
+                f"❌ Текст слишком длинный: {length} символов, можно {Broadcaster.MAX_TEXT_LENGTH}. "
+                "Сократите его или разошлите ответом на сообщение."
+            )
+            return
+        await broadcaster.start(message.chat.id, text=text)
+    else:
+        await message.answer(
+            "📣 <b>Рассылка</b>\n\n"
+            "Напишите /broadcast <i>текст</i> или ответьте командой /broadcast "
+            "на сообщение, которое нужно разослать."
         )
 
-    @staticmethod
-    def get_manager_keyboard(user_id):
-        return types.InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    types.InlineKeyboardButton(
-                        text="📥 Взять заявку в работу",
-                        callback_data=f"take_lead_{user_id}"
-                    )
-                ]
-            ]
-        )
 
+@dp.message(Command("broadcast_stop"))
+async def cmd_broadcast_stop(message: types.Message):
+    if message.from_user.id not in Config.ADMIN_IDS:
+        return
+    await broadcaster.cancel()
 
-# ========== БАЗА ДАННЫХ (JSON вместо SQLite) ==========
-class Database:
-    def __init__(self, filename='leads.json'):
-        self.filename = filename
 
-    def _load_data(self):
-        try:
-            with open(self.filename, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {'users': [], 'leads': []}
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    if message.from_user.id not in Config.ADMIN_IDS:
+        return
 
-    def _save_data(self, data):
-        with open(self.filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+    report = funnel.report()
+    started = report['steps'][0][1]
+    lines = [f"📈 <b>Воронка заявок{shard_label()}</b> (событий: {report['events']})\n"]
+    previous = None
+    for number, (label, count) in enumerate(report['steps'], 1):
+        drop = f", отвал {100 - count * 100 // previous}%" if previous else ""
+        lines.append(f"{number}. {label}: {count} ({percent(count, started)}{drop})")
+        previous = count
 
-    def add_user(self, user_id, username, full_name):
-        data = self._load_data()
+    lines.append("\n<b>По услугам</b> (выбрали → заявка):")
+    for name, selected, done in report['by_service']:
+        lines.append(f"• {name}: {selected} → {done} ({percent(done, selected)})")
 
-        # Проверяем, есть ли уже пользователь
-        for user in data['users']:
-            if user['user_id'] == user_id:
-                return user
+    lines.append("\n<b>По бюджету</b> (выбрали → заявка):")
+    for name, selected, done in report['by_budget']:
+        lines.append(f"• {name}: {selected} → {done} ({percent(done, selected)})")
 
-        # Добавляем нового пользователя
-        user = {
-            'user_id': user_id,
-            'username': username,
-            'full_name': full_name,
-            'created_at': datetime.datetime.now().isoformat()
-        }
-        data['users'].append(user)
-        self._save_data(data)
-        return user
+    lines.append("\n<b>По дням</b> (начали → заявка):")
+    for day, begun, done in report['by_day']:
+        lines.append(f"• {day.strftime('%d.%m')}: {begun} → {done}")
 
-    def add_lead(self, user_id, service_type, business_type, budget, contact_preference, name, phone):
-        data = self._load_data()
+    await message.answer('\n'.join(lines))
 
-        lead = {
-            'id': len(data['leads']) + 1,
-            'user_id': user_id,
-            'service_type': service_type,
-            'business_type': business_type,
-            'budget': budget,
-            'contact_preference': contact_preference,
-            'name': name,
-            'phone': phone,
-            'status': 'new',
-            'created_at': datetime.datetime.now().isoformat()
-        }
-        data['leads'].append(lead)
-        self._save_data(data)
-        return lead
 
-    def get_user_count(self):
-        data = self._load_data()
-        return len(data['users'])
+# ========== МАРШРУТИЗАЦИЯ КНОПОК ==========
+class DispatchTable(Filter):
+    """Таблица маршрутизации: один фильтр и один поиск в dict вместо цепочки F-фильтров.
 
-    def get_leads_count(self):
-        data = self._load_data()
-        return len(data['leads'])
+    aiogram проверяет фильтры хэндлеров по очереди, и каждый F-фильтр
+    выполняется в пуле потоков. Таблица регистрируется в диспетчере одним
+    хэндлером, находит обработчик по ключу события и вызывает его с теми же
+    аргументами (state и т.п.), что передал бы aiogram.
+    """
 
-    def get_new_leads_count(self):
-        data = self._load_data()
-        return sum(1 for lead in data['leads'] if lead['status'] == 'new')
-
-    def update_lead_status(self, lead_id, status, manager_id=None):
-        data = self._load_data()
-        for lead in data['leads']:
-            if lead['id'] == lead_id:
-                lead['status'] = status
-                if manager_id:
-                    lead['manager_id'] = manager_id
-                self._save_data(data)
-                return True
-        return False
+    def __init__(self):
+        self._handlers = {}
 
+    def _add(self, key, callback, prefix=None):
+        self._handlers[key] = (prefix, CallableObject(callback))
+        return callback
 
-# Инициализация базы данных
-db = Database()
+    @staticmethod
+    async def dispatch(event, table_handler, **kwargs):
+        return await table_handler.call(event, **kwargs)
 
 
-# ========== СОСТОЯНИЯ ДЛЯ ФОРМЫ ЗАЯВКИ ==========
-class ApplicationForm(StatesGroup):
-    waiting_for_name = State()
-    waiting_for_phone = State()
-    waiting_for_service = State()
-    waiting_for_business = State()
-    waiting_for_budget = State()
-    waiting_for_contact = State()
+class MenuButtons(DispatchTable):
+    """Кнопки главного меню: точное совпадение текста сообщения"""
 
+    def button(self, *texts):
+        def register(callback):
+            for text in texts:
+                self._add(text, callback)
+            return callback
+        return register
 
-# ========== ОБРАБОТЧИКИ КОМАНД ==========
-@dp.message(Command("start"))
-async def cmd_start(message: types.Message):
-    # Сохраняем пользователя в БД
-    user = db.add_user(
-        user_id=message.from_user.id,
-        username=message.from_user.username,
-        full_name=message.from_user.full_name
-    )
+    async def __call__(self, message: types.Message):
+        entry = self._handlers.get(message.text)
+        return {'table_handler': entry[1]} if entry else False
 
-    # Уведомляем админов о новом пользователе
-    for admin_id in Config.ADMIN_IDS:
-        try:
-            await bot.send_message(
-                admin_id,
-                f"👤 <b>Новый пользователь:</b>\n\n"
-                f"ID: {message.from_user.id}\n"
-                f"Имя: {message.from_user.full_name}\n"
-                f"Юзернейм: @{message.from_user.username}\n"
-                f"Дата: {datetime.datetime.now().strftime('%d.%m.%Y %H:%M')}"
-            )
-        except:
-            pass
 
-    await message.answer(
-        Messages.WELCOME_MESSAGE,
-        reply_markup=Keyboards.get_main_menu()
-    )
+class CallbackPrefixes(DispatchTable):
+    """Inline-кнопки: обработчик выбирается по префиксу callback_data до первого '_'"""
 
+    def prefix(self, prefix):
+        return lambda callback: self._add(prefix.split('_', 1)[0], callback, prefix)
 
-@dp.message(Command("admin"))
-async def cmd_admin(message: types.Message):
-    if message.from_user.id not in Config.ADMIN_IDS:
-        return
+    async def __call__(self, callback: types.CallbackQuery):
+        data = callback.data or ''
+        entry = self._handlers.get(data.split('_', 1)[0])
+        if entry and data.startswith(entry[0]):
+            return {'table_handler': entry[1]}
+        return False
 
-    user_count = db.get_user_count()
-    leads_count = db.get_leads_count()
-    new_leads = db.get_new_leads_count()
 
-    await message.answer(
-        f"📊 <b>Панель администратора</b>\n\n"
-        f"👥 Пользователей: {user_count}\n"
-        f"📥 Заявок всего: {leads_count}\n"
-        f"🆕 Новых заявок: {new_leads}\n\n"
-        f"<i>Файл с данными: leads.json</i>"
-    )
+menu = MenuButtons()
+callbacks = CallbackPrefixes()
+dp.message.register(menu.dispatch, menu)
+dp.callback_query.register(callbacks.dispatch, callbacks)
 
 
 # ========== ОСНОВНОЕ МЕНЮ ==========
-@dp.message(F.text == "🏢 О компании")
+def button_texts(name):
+    """Надписи кнопки на всех языках — по ним маршрутизируется текст сообщения"""
+    return {getattr(texts, name) for texts in TEXTS.values()}
+
+
+@menu.button(*button_texts('BTN_ABOUT'))
 async def about_company(message: types.Message):
-    await message.answer(Messages.ABOUT_COMPANY)
+    await message.answer(texts_for(message.from_user).ABOUT_COMPANY)
 
 
-@dp.message(F.text == "📦 Услуги")
+@menu.button(*button_texts('BTN_SERVICES'))
 async def services(message: types.Message):
+    t = texts_for(message.from_user)
     await message.answer(
-        Messages.SERVICES,
-        reply_markup=Keyboards.get_services_keyboard()
+        t.SERVICES,
+        reply_markup=Keyboards.get_services_keyboard(t.LANGUAGE)
     )
 
 
-@dp.message(F.text == "❓ FAQ")
+@menu.button(*button_texts('BTN_FAQ'))
 async def faq(message: types.Message):
-    await message.answer(Messages.FAQ)
+    await message.answer(texts_for(message.from_user).FAQ)
 
 
-@dp.message(F.text == "📞 Контакты")
+@menu.button(*button_texts('BTN_CONTACTS'))
 async def contacts(message: types.Message):
-    contact_message = Messages.CONTACTS.replace("{manager_username}", Config.MANAGER_USERNAME)
-    await message.answer(contact_message)
+    await message.answer(texts_for(message.from_user).CONTACTS)
 
 
-@dp.message(F.text == "📊 Наши кейсы")
+@menu.button(*button_texts('BTN_CASES'))
 async def cases(message: types.Message):
-    await message.answer(Messages.CASE_STUDIES)
+    await message.answer(texts_for(message.from_user).CASE_STUDIES)
 
 
-@dp.message(F.text == "👨‍💼 Связаться с менеджером")
+@menu.button(*button_texts('BTN_MANAGER'))
 async def contact_manager(message: types.Message):
-    await message.answer(
-        f"📞 <b>Связь с менеджером</b>\n\n"
-        f"Напишите напрямую: {Config.MANAGER_USERNAME}\n\n"
-        f"<i>Ответим в течение 15 минут в рабочее время</i>"
-    )
+    await message.answer(texts_for(message.from_user).MANAGER_CONTACT)
 
 
 # ========== ФОРМА ЗАЯВКИ ==========
-@dp.message(F.text == "📝 Оставить заявку")
+def track_form_step(user, step, **fields):
+    """Шаг формы: событие воронки и перестановка таймера брошенной формы"""
+    funnel.track(user.id, step, **fields)
+    key = f'form:{user.id}'
+    if step == 'done':
+        scheduler.cancel(key)
+        return
+    now = int(time.time())
+    data = {'user_id': user.id, 'language': user.language_code, 'active_at': now}
+    if Config.FORM_REMINDER_MINUTES:
+        scheduler.schedule(key, 'form', now + Config.FORM_REMINDER_MINUTES * 60, dict(data, stage='remind'))
+    elif Config.FSM_STATE_TTL:
+        scheduler.schedule(key, 'form', now + Config.FSM_STATE_TTL, dict(data, stage='expire'))
+
+
+def form_context(user_id):
+    """FSMContext пользователя вне апдейта; бот работает в личных чатах, поэтому chat_id = user_id"""
+    return FSMContext(storage=dp.storage, key=StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id))
+
+
+@scheduler.handler('form')
+async def abandoned_form(data):
+    """Брошенная форма: одно напоминание, а через FSM_STATE_TTL без ответа — сброс формы"""
+    state = form_context(data['user_id'])
+    if await state.get_state() not in ApplicationForm.__all_states_names__:
+        return  # заявку уже отправили или вышли в меню
+    if data['stage'] == 'expire':
+        await state.clear()
+        return
+    if not (await state.get_data()).get('reminded'):
+        await state.update_data(reminded=True)
+        notifier.send(data['user_id'], texts_for_language(data['language']).FORM_REMINDER)
+    if Config.FSM_STATE_TTL:
+        scheduler.schedule(
+            f"form:{data['user_id']}", 'form', data['active_at'] + Config.FSM_STATE_TTL, dict(data, stage='expire')
+        )
+
+
+@menu.button(*button_texts('BTN_APPLY'))
 async def start_application(message: types.Message, state: FSMContext):
-    await message.answer(
-        "📋 <b>Заполните заявку</b>\n\n"
-        "Введите ваше имя и фамилию:"
-    )
+    await message.answer(texts_for(message.from_user).FORM_NAME)
     await state.set_state(ApplicationForm.waiting_for_name)
+    track_form_step(message.from_user, 'name')
 
 
 @dp.message(ApplicationForm.waiting_for_name)
 async def process_name(message: types.Message, state: FSMContext):
+    t = texts_for(message.from_user)
     await state.update_data(name=message.text)
     await message.answer(
-        "📱 <b>Контактные данные</b>\n\n"
-        "Отправьте номер телефона или нажмите кнопку ниже:",
-        reply_markup=Keyboards.get_contact_keyboard()
+        t.FORM_PHONE,
+        reply_markup=Keyboards.get_contact_keyboard(t.LANGUAGE)
     )
     await state.set_state(ApplicationForm.waiting_for_phone)
+    track_form_step(message.from_user, 'phone')
 
 
 @dp.message(ApplicationForm.waiting_for_phone, F.contact)
@@ -465,11 +3681,15 @@ async def process_contact(message: types.Message, state: FSMContext):
     await ask_service_type(message, state)
 
 
+BACK_BUTTONS = button_texts('BTN_BACK')
+
+
 @dp.message(ApplicationForm.waiting_for_phone)
 async def process_phone_text(message: types.Message, state: FSMContext):
-    if message.text == "↩️ Назад":
+    if message.text in BACK_BUTTONS:
+        t = texts_for(message.from_user)
         await state.clear()
-        await message.answer("Главное меню:", reply_markup=Keyboards.get_main_menu())
+        await message.answer(t.MAIN_MENU, reply_markup=Keyboards.get_main_menu(t.LANGUAGE))
         return
 
     await state.update_data(phone=message.text)
@@ -477,158 +3697,731 @@ async def process_phone_text(message: types.Message, state: FSMContext):
 
 
 async def ask_service_type(message: types.Message, state: FSMContext):
+    t = texts_for(message.from_user)
     await message.answer(
-        "🎯 <b>Выберите услугу:</b>",
-        reply_markup=Keyboards.get_services_keyboard()
+        t.FORM_SERVICE,
+        reply_markup=Keyboards.get_services_keyboard(t.LANGUAGE)
     )
     await state.set_state(ApplicationForm.waiting_for_service)
+    track_form_step(message.from_user, 'service')
 
 
-@dp.callback_query(F.data.startswith("service_"))
+@callbacks.prefix("service_")
 async def process_service(callback: types.CallbackQuery, state: FSMContext):
-    service_map = {
-        "service_smm": "Продвижение в соцсетях (SMM)",
-        "service_marketplaces": "Маркетплейсы",
-        "service_ads": "Настройка рекламы",
-        "service_complex": "Комплексное продвижение",
-        "service_bot": "Разработка бота"
-    }
-
-    service = service_map.get(callback.data, callback.data)
+    # callback_data можно подделать: в заявку попадают только услуги из списка
+    service = SERVICE_NAMES.get(callback.data)
+    if service is None:
+        await callback.answer()
+        return
     await state.update_data(service=service)
 
-    await callback.message.answer(
-        "🏢 <b>Опишите ваш бизнес:</b>\n\n"
-        "Например: 'Интернет-магазин одежды', "
-        "'Кофейня', 'Услуги ремонта' и т.д."
-    )
+    await callback.message.answer(texts_for(callback.from_user).FORM_BUSINESS)
     await state.set_state(ApplicationForm.waiting_for_business)
+    track_form_step(callback.from_user, 'business', service=service)
     await callback.answer()
 
 
 @dp.message(ApplicationForm.waiting_for_business)
 async def process_business(message: types.Message, state: FSMContext):
+    t = texts_for(message.from_user)
     await state.update_data(business=message.text)
 
     await message.answer(
-        "💰 <b>Примерный бюджет на продвижение:</b>",
-        reply_markup=Keyboards.get_budget_keyboard()
+        t.FORM_BUDGET,
+        reply_markup=Keyboards.get_budget_keyboard(t.LANGUAGE)
     )
     await state.set_state(ApplicationForm.waiting_for_budget)
+    track_form_step(message.from_user, 'budget')
 
 
-@dp.callback_query(F.data.startswith("budget_"))
+@callbacks.prefix("budget_")
 async def process_budget(callback: types.CallbackQuery, state: FSMContext):
-    budget_map = {
-        "budget_10_25": "10-25 тыс. ₽",
-        "budget_25_50": "25-50 тыс. ₽",
-        "budget_50_100": "50-100 тыс. ₽",
-        "budget_100_plus": "100+ тыс. ₽"
-    }
-
-    budget = budget_map.get(callback.data, callback.data)
+    budget = BUDGET_NAMES.get(callback.data)
+    if budget is None:
+        await callback.answer()
+        return
     await state.update_data(budget=budget)
 
-    await callback.message.answer(
-        "📞 <b>Как с вами удобнее связаться?</b>\n\n"
-        "Напишите предпочтительный способ связи:\n"
-        "• Telegram\n• WhatsApp\n• Телефонный звонок\n• Email"
-    )
+    await callback.message.answer(texts_for(callback.from_user).FORM_CONTACT)
     await state.set_state(ApplicationForm.waiting_for_contact)
+    track_form_step(callback.from_user, 'contact', budget=budget)
     await callback.answer()
 
 
 @dp.message(ApplicationForm.waiting_for_contact)
 async def process_contact_pref(message: types.Message, state: FSMContext):
     data = await state.get_data()
+    t = texts_for(message.from_user)
+    phone = data.get('phone', Messages.NO_PHONE)
 
     # Сохраняем заявку в БД
-    lead = db.add_lead(
+    lead = await db.add_lead(
         user_id=message.from_user.id,
         service_type=data['service'],
         business_type=data['business'],
         budget=data['budget'],
         contact_preference=message.text,
         name=data['name'],
-        phone=data.get('phone', 'Не указан')
+        phone=phone
     )
+    track_form_step(message.from_user, 'done', service=data['service'], budget=data['budget'])
 
-    # Формируем сообщение для клиента
+    # Формируем сообщение для клиента; все, что ввел пользователь, экранирует шаблон
     await message.answer(
-        f"✅ <b>Заявка #{lead['id']} принята!</b>\n\n"
-        f"<b>Ваши данные:</b>\n"
-        f"Имя: {data['name']}\n"
-        f"Телефон: {data.get('phone', 'Не указан')}\n"
-        f"Услуга: {data['service']}\n"
-        f"Бизнес: {data['business']}\n"
-        f"Бюджет: {data['budget']}\n"
-        f"Связь: {message.text}\n\n"
-        f"Менеджер свяжется с вами в течение часа в рабочее время.",
-        reply_markup=Keyboards.get_main_menu()
+        t.LEAD_ACCEPTED.render(
+            id=lead.id,
+            name=data['name'],
+            phone=t.label(phone),
+            service=t.label(data['service']),
+            business=data['business'],
+            budget=t.label(data['budget']),
+            contact=message.text
+        ),
+        reply_markup=Keyboards.get_main_menu(t.LANGUAGE)
     )
 
-    # Отправляем уведомление всем админам
-    for admin_id in Config.ADMIN_IDS:
-        try:
-            await bot.send_message(
-                admin_id,
-                f"🆕 <b>НОВАЯ ЗАЯВКА #{lead['id']}</b>\n\n"
-                f"👤 Клиент: {data['name']}\n"
-                f"ID: {message.from_user.id}\n"
-                f"Юзернейм: @{message.from_user.username}\n"
-                f"📱 Телефон: {data.get('phone', 'Не указан')}\n"
-                f"🎯 Услуга: {data['service']}\n"
-                f"🏢 Бизнес: {data['business']}\n"
-                f"💰 Бюджет: {data['budget']}\n"
-                f"📞 Способ связи: {message.text}",
-                reply_markup=Keyboards.get_manager_keyboard(message.from_user.id)
-            )
-        except Exception as e:
-            print(f"Ошибка отправки админу {admin_id}: {e}")
+    # Отправляем уведомление всем админам (в фоне)
+    card = ADMIN_TEXTS.LEAD_CARD.render(
+        id=lead.id,
+        name=data['name'],
+        user_id=message.from_user.id,
+        username=message.from_user.username,
+        phone=phone,
+        service=data['service'],
+        business=data['business'],
+        budget=data['budget'],
+        contact=message.text
+    )
+    lead_cards.add(lead.id, card)
+    notifier.send_to_admins(
+        card,
+        reply_markup=Keyboards.get_manager_keyboard(lead.id),
+        on_sent=lead_cards.on_sent(lead.id)
+    )
+    schedule_lead_reminder(lead)
 
     await state.clear()
 
 
 # ========== РАССЧЕТ СТОИМОСТИ ==========
-@dp.message(F.text == "💰 Рассчитать стоимость")
+@menu.button(*button_texts('BTN_CALCULATOR'))
 async def calculate_cost(message: types.Message):
-    await message.answer(
-        "🧮 <b>Калькулятор стоимости</b>\n\n"
-        "Примерные цены:\n"
-        "• SMM ведение: 15-30 тыс. ₽/мес\n"
-        "• Маркетплейсы: 12-25 тыс. ₽/мес\n"
-        "• Настройка рекламы: 12-20 тыс. ₽/мес\n"
-        "• Комплекс: от 35 тыс. ₽/мес\n\n"
-        "Для точного расчета оставьте заявку, "
-        "и наш менеджер сделает персональное предложение."
-    )
+    await message.answer(texts_for(message.from_user).CALCULATOR)
 
 
 # ========== ОБРАБОТКА ОТ МЕНЕДЖЕРА ==========
-@dp.callback_query(F.data.startswith("take_lead_"))
+class LeadCards:
+    """Уведомления о заявке у админов: после взятия их правят на месте"""
+
+    MAX_LEADS = 10000
+
+    def __init__(self):
+        self._cards = OrderedDict()  # lead_id -> (текст, [(chat_id, message_id)])
+
+    def add(self, lead_id, text):
+        self._cards[lead_id] = (text, [])
+        if len(self._cards) > self.MAX_LEADS:
+            self._cards.popitem(last=False)
+
+    def on_sent(self, lead_id):
+        def remember(message):
+            card = self._cards.get(lead_id)
+            if card is not None:
+                card[1].append((message.chat.id, message.message_id))
+        return remember
+
+    def pop(self, lead_id):
+        return self._cards.pop(lead_id, None)
+
+
+lead_cards = LeadCards()
+
+
+def schedule_lead_reminder(lead, after=0):
+    """Напоминание админам на первом пороге LEAD_SLA_MINUTES позже after минут от создания заявки"""
+    for minutes in Config.LEAD_SLA_MINUTES:
+        if minutes > after:
+            scheduler.schedule(
+                f'lead:{lead.id}', 'lead_sla', lead.created_at + minutes * 60, {'id': lead.id, 'sla': minutes}
+            )
+            return
+
+
+@scheduler.handler('lead_sla')
+async def remind_untaken_lead(data):
+    lead = db.get_lead(data['id'])
+    if lead is None or lead.status != 'new':
+        return
+    waited = (time.time() - lead.created_at) / 60
+    # Напоминание с той же кнопкой; после взятия оно правится вместе с карточкой
+    notifier.send_to_admins(
+        ADMIN_TEXTS.LEAD_SLA_REMINDER.render(
+            id=lead.id,
+            waited=int(waited),
+            name=str(lead.name)[:64],
+            phone=lead.phone,
+            service=lead.service_type,
+            business=str(lead.business_type)[:64]
+        ),
+        reply_markup=Keyboards.get_manager_keyboard(lead.id),
+        on_sent=lead_cards.on_sent(lead.id)
+    )
+    # Пороги, пройденные, пока бот не работал, пропускаются
+    schedule_lead_reminder(lead, max(data['sla'], waited))
+
+
+@callbacks.prefix("lead_take_")
 async def take_lead(callback: types.CallbackQuery):
-    user_id = int(callback.data.replace("take_lead_", ""))
+    # callback_data можно подделать: брать заявки могут только админы
+    if callback.from_user.id not in Config.ADMIN_IDS:
+        await callback.answer()
+        return
 
-    # В реальном приложении здесь была бы логика обновления статуса заявки в БД
-    # Для упрощения просто отправляем уведомление
+    lead_id = callback.data.replace("lead_take_", "")
+    if not lead_id.isdecimal():
+        await callback.answer("❌ Заявка не найдена", show_alert=True)
+        return
+    lead_id = int(lead_id)
+
+    lead = await db.take_lead(lead_id, callback.from_user.id)
+    if lead is None:
+        if db.get_lead(lead_id) is None:
+            await callback.answer("❌ Заявка не найдена", show_alert=True)
+        else:
+            await callback.answer("⚠️ Заявку уже взял другой менеджер", show_alert=True)
+        return
     await callback.answer("✅ Заявка взята в работу!")
+    scheduler.cancel(f'lead:{lead_id}')
+
+    # Убираем кнопку у всех админов и пишем, кто взял заявку. После
+    # перезапуска список сообщений потерян — правим хотя бы нажатое
+    card = lead_cards.pop(lead_id)
+    if card is None and isinstance(callback.message, types.Message):
+        card = (callback.message.html_text, [(callback.message.chat.id, callback.message.message_id)])
+    if card is not None:
+        text, messages = card
+        text += ADMIN_TEXTS.LEAD_TAKEN_BY.render(manager=callback.from_user.full_name)
+        for chat_id, message_id in messages:
+            try:
+                await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=None)
+            except TelegramAPIError as e:
+                print(f"Не удалось обновить уведомление о заявке #{lead_id} в чате {chat_id}: {e}")
+
+    # Уведомляем клиента на его языке: язык берется у пользователя из базы
+    user = db.users.get(lead.user_id)
+    language = user.language if user is not None else None
+    notifier.send(lead.user_id, texts_for_language(language).LEAD_TAKEN_CLIENT)
+
+
+@callbacks.prefix("take_lead_")
+async def take_lead_legacy(callback: types.CallbackQuery):
+    # Старые кнопки несут user_id клиента, а не номер заявки
+    await callback.answer("⚠️ Кнопка устарела, найдите заявку в /admin или /export", show_alert=True)
+
+
+@callbacks.prefix("find_")
+async def find_page(callback: types.CallbackQuery):
+    if callback.from_user.id not in Config.ADMIN_IDS:
+        await callback.answer()
+        return
+
+    # find_<ключ>_n<id> — страница новее id, find_<ключ>_o<id> — старее
+    _, search_id, cursor = callback.data.split('_', 2)
+    saved = search_queries.get(search_id)
+    if saved is None:
+        await callback.answer("⚠️ Поиск устарел, повторите /find", show_alert=True)
+        return
+    title, query = saved
+    direction = 'after' if cursor[0] == 'n' else 'before'
+    page = db.search(**query, **{direction: int(cursor[1:])}, limit=FIND_PAGE_SIZE)
 
-    # Уведомляем клиента
+    text, keyboard = render_search_page(search_id, title, page)
     try:
-        await bot.send_message(
-            user_id,
-            f"👋 <b>Вашей заявкой занялся менеджер!</b>\n\n"
-            f"Скоро он с вами свяжется.\n"
-            f"Если есть срочные вопросы, пишите: {Config.MANAGER_USERNAME}"
-        )
-    except:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramAPIError as e:
+        print(f"Не удалось показать страницу поиска: {e}")
+    await callback.answer()
+
+
+# ========== КОНВЕЙЕР АПДЕЙТОВ ==========
+def update_chat_key(update):
+    """Чат, к которому относится апдейт: апдейты одного чата обрабатываются по порядку
+    (в одной очереди конвейера и в одном шарде)"""
+    event = update.event
+    chat = getattr(event, 'chat', None) or getattr(getattr(event, 'message', None), 'chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, 'from_user', None)
+    return user.id if user is not None else 0
+
+
+class UpdatePipeline:
+    """Конвейер апдейтов: разные чаты обрабатываются параллельно, один чат — строго по порядку.
+
+    У каждого чата с необработанными апдейтами своя очередь и задача, которая
+    разбирает ее по одному апдейту. Одновременно работают не больше concurrency
+    обработчиков, принятых и еще не обработанных апдейтов — не больше max_pending.
+    Пока лимит исчерпан или переполнены очереди записи на диск и уведомлений
+    (pressure), submit() ждет: перегрузка доходит до источника апдейтов
+    (getUpdates, webhook), а не копится в памяти бота.
+    """
+
+    PRESSURE_POLL = 0.05
+
+    def __init__(self, process, concurrency, max_pending, pressure=None):
+        self.process = process
+        self.max_pending = max_pending
+        # причина -> функция, которая возвращает True, пока принимать апдейты нельзя
+        self.pressure = pressure or {}
+        self.pending = 0
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._chats = {}  # ключ чата -> deque апдейтов, первый сейчас в обработке
+        self._tasks = set()
+        self._room = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def _saturated(self):
+        if self.pending >= self.max_pending:
+            return 'pending'
+        for reason, saturated in self.pressure.items():
+            if saturated():
+                return reason
+        return None
+
+    async def submit(self, update):
+        """Принимает апдейт в обработку; ждет, пока в конвейере есть место"""
+        while True:
+            reason = self._saturated()
+            if reason is None:
+                break
+            started = time.perf_counter()
+            if reason == 'pending':
+                self._room.clear()
+                await self._room.wait()
+            else:
+                await asyncio.sleep(self.PRESSURE_POLL)
+            metrics.inc('bot_pipeline_backpressure_seconds', (('reason', reason),), time.perf_counter() - started)
+
+        self.pending += 1
+        self._idle.clear()
+        key = update_chat_key(update)
+        updates = self._chats.get(key)
+        if updates is not None:
+            # Чат уже обрабатывается — апдейт встанет в его очередь
+            updates.append(update)
+            return
+        updates = self._chats[key] = deque((update,))
+        task = asyncio.create_task(self._drain(key, updates))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key, updates):
+        try:
+            while updates:
+                async with self._slots:
+                    self.in_flight += 1
+                    try:
+                        await self.process(updates[0])
+                    finally:
+                        self.in_flight -= 1
+                updates.popleft()
+                self.pending -= 1
+                if self.pending < self.max_pending:
+                    self._room.set()
+                if not self.pending:
+                    self._idle.set()
+        finally:
+            del self._chats[key]
+
+    async def join(self):
+        """Ждет, пока все принятые апдейты будут обработаны"""
+        await self._idle.wait()
+
+    def status(self):
+        return {'pending': self.pending, 'in_flight': self.in_flight, 'chats': len(self._chats)}
+
+
+async def process_update(update):
+    try:
+        await dp.feed_update(bot, update)
+    except Exception as e:
+        # Ошибка одного апдейта не останавливает конвейер
+        print(f'❌ Ошибка обработки апдейта {update.update_id}: {e!r}')
+
+
+# С какой заполненности очереди записи на диск или уведомлений конвейер
+# перестает принимать новые апдейты
+PIPELINE_PRESSURE = 0.8
+
+pipeline = UpdatePipeline(
+    process_update,
+    concurrency=Config.UPDATE_CONCURRENCY,
+    max_pending=Config.UPDATE_MAX_PENDING,
+    pressure={
+        'storage': lambda: db.write_backlog() >= Database.WRITE_QUEUE_SIZE * PIPELINE_PRESSURE,
+        'notifier': lambda: notifier.queue_size() >= Notifier.QUEUE_SIZE * PIPELINE_PRESSURE
+    }
+)
+
+
+async def poll_updates(submit):
+    """Цикл getUpdates: пачки до POLLING_LIMIT апдейтов, каждый передается в submit.
+
+    submit ждет, пока в конвейере есть место, поэтому при перегрузке бот
+    реже запрашивает апдейты и они копятся на стороне Telegram.
+    """
+    allowed_updates = dp.resolve_used_update_types()
+    # Запрос long polling длится до POLLING_TIMEOUT — общий таймаут должен быть больше
+    request_timeout = int(bot.session.timeout + Config.POLLING_TIMEOUT)
+    offset = None
+    try:
+        while True:
+            try:
+                batch = await bot.get_updates(
+                    offset=offset,
+                    limit=Config.POLLING_LIMIT,
+                    timeout=Config.POLLING_TIMEOUT,
+                    allowed_updates=allowed_updates,
+                    request_timeout=request_timeout
+                )
+            except (TelegramNetworkError, TelegramServerError) as e:
+                print(f'⚠️ Ошибка получения апдейтов: {e}')
+                await asyncio.sleep(1)
+                continue
+            for update in batch:
+                await submit(update)
+                offset = update.update_id + 1
+    finally:
+        if offset is not None:
+            # Подтверждаем принятые апдейты, иначе после перезапуска Telegram пришлет их снова
+            try:
+                await bot.get_updates(offset=offset, limit=1, timeout=0)
+            except TelegramAPIError:
+                pass
+
+
+def webhook_handler(submit):
+    """aiohttp-обработчик webhook: проверяет секрет и передает апдейт в submit"""
+    async def handle_webhook(request):
+        if not secrets.compare_digest(
+            request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), Config.WEBHOOK_SECRET
+        ):
+            return web.Response(status=401, text='Unauthorized')
+        update = types.Update.model_validate(await request.json(), context={'bot': bot})
+        await submit(update)
+        return web.json_response({})
+    return handle_webhook
+
+
+def stop_on_signals(task):
+    """SIGTERM и SIGINT отменяют task — остановка дальше идет штатно, через finally"""
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signum, task.cancel)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: остается KeyboardInterrupt
+
+
+# ========== ШАРДИРОВАННЫЙ РЕЖИМ ==========
+class ShardSupervisor:
+    """Фронт-процесс: раздает апдейты процессам-воркерам и перезапускает упавшие.
+
+    У каждого шарда своя очередь, свой диспетчер и свои файлы данных, а
+    апдейты одного чата всегда попадают в один шард и обрабатываются там по
+    порядку. Очередь переживает падение воркера: перезапущенный процесс
+    продолжит с того же места.
+
+    Команды админа из FANOUT_COMMANDS получает каждый шард: рассылка идет
+    по пользователям всех шардов, а /admin, /stats, /export и /find приходят по
+    данным каждого шарда — каждый шард отвечает своим сообщением.
+    """
+
+    CHECK_INTERVAL = 1.0
+    MAX_RESTART_DELAY = 60
+    FANOUT_COMMANDS = frozenset({'/broadcast', '/broadcast_stop', '/admin', '/stats', '/export', '/find'})
+
+    def __init__(self, shards):
+        self._context = multiprocessing.get_context('spawn')
+        self.shards = shards
+        self.queues = [self._context.Queue() for _ in range(shards)]
+        self.processes = [None] * shards
+        self.restarts = [0] * shards
+        self._stopping = False
+
+    def _spawn(self, index):
+        # SHARD_INDEX читается воркером при импорте app.py
+        os.environ['SHARD_INDEX'] = str(index)
+        try:
+            process = self._context.Process(
+                target=run_shard, args=(index, self.queues[index]), name=f'shard-{index}', daemon=True
+            )
+            process.start()
+        finally:
+            del os.environ['SHARD_INDEX']
+        self.processes[index] = process
+        print(f'🧩 Шард {index} запущен (pid {process.pid})')
+
+    def start(self):
+        for index in range(self.shards):
+            self._spawn(index)
+
+    def route(self, update):
+        raw = update.model_dump_json(exclude_unset=True)
+        if self.is_fanout(update):
+            for q in self.queues:
+                q.put(raw)
+            return
+        index = self.shard_key(update) % self.shards
+        self.queues[index].put(raw)
+
+    @classmethod
+    def is_fanout(cls, update):
+        message = update.message
+        if message is None or not message.text or not message.text.startswith('/'):
+            return False
+        if message.from_user is None or message.from_user.id not in Config.ADMIN_IDS:
+            return False
+        return message.text.split(maxsplit=1)[0].split('@')[0] in cls.FANOUT_COMMANDS
+
+    @staticmethod
+    def shard_key(update):
+        """Кнопки заявок уходят в шард заявки, остальное — в шард чата"""
+        data = getattr(update.event, 'data', None)
+        lead_id = None
+        if data and data.startswith('lead_take_'):
+            lead_id = data.replace('lead_take_', '')
+        elif data and data.startswith('find_'):
+            # Листание /find: курсор — id заявки со страницы шарда, который ее нашел
+            lead_id = data.rsplit('_', 1)[-1][1:]
+        # Заявка живет в шарде, который выдал ее номер: id = shard + 1 + k * N
+        if lead_id is not None and lead_id.isdecimal():
+            return int(lead_id) - 1
+        return update_chat_key(update)
+
+    async def supervise(self):
+        while not self._stopping:
+            await asyncio.sleep(self.CHECK_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if process.is_alive() or self._stopping:
+                    continue
+                self.restarts[index] += 1
+                delay = min(2 ** self.restarts[index], self.MAX_RESTART_DELAY)
+                print(f'♻️ Шард {index} упал (код {process.exitcode}), перезапуск через {delay} с')
+                await asyncio.sleep(delay)
+                self._spawn(index)
+
+    def status(self):
+        return [
+            {
+                'shard': index,
+                'pid': process.pid,
+                'alive': process.is_alive(),
+                'restarts': self.restarts[index],
+                'queue_depth': self._queue_depth(index)
+            }
+            for index, process in enumerate(self.processes)
+        ]
+
+    def _queue_depth(self, index):
+        try:
+            return self.queues[index].qsize()
+        except NotImplementedError:
+            # macOS не умеет qsize у multiprocessing.Queue
+            return None
+
+    async def stop(self, timeout=15):
+        self._stopping = True
+        for q in self.queues:
+            q.put(None)
+        for process in self.processes:
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                process.terminate()
+
+
+def run_shard(index, updates):
+    """Точка входа процесса-воркера"""
+    try:
+        asyncio.run(shard_worker(index, updates))
+    except KeyboardInterrupt:
         pass
 
 
+async def shard_worker(index, updates):
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    await dp.emit_startup(bot=bot)
+    try:
+        while True:
+            raw = await asyncio.to_thread(updates.get)
+            if raw is None:
+                break
+            # Чаты шарда обрабатываются параллельно, как и в обычном режиме
+            await pipeline.submit(types.Update.model_validate_json(raw, context={'bot': bot}))
+    finally:
+        await pipeline.join()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+
+
+async def start_sharded():
+    print(f"🤖 Запуск бота в шардированном режиме: {Config.WORKER_SHARDS} воркеров ({Config.BOT_MODE})...")
+    # Шарды не читают базу обычного режима: новые заявки получили бы id старых
+    # (кнопки старых карточек взяли бы чужую заявку), а пользователи — повторное приветствие
+    leftovers = [
+        filename for filename in (db.filename, db.log_filename, db.backup_filename, db.prev_log_filename)
+        if os.path.exists(filename) and os.path.getsize(filename)
+    ]
+    if leftovers:
+        raise RuntimeError(
+            f"найдена база обычного режима ({', '.join(leftovers)}); шардированный режим "
+            f"начинается с пустой базой — запустите бота с WORKER_SHARDS=1 или перенесите файлы"
+        )
+    supervisor = ShardSupervisor(Config.WORKER_SHARDS)
+    supervisor.start()
+
+    async def handle_shards(request):
+        return web.json_response(supervisor.status())
+
+    async def route(update):
+        supervisor.route(update)
+
+    # Заявки лежат в файлах шардов, а фронт их не читает: HTTP-выгрузки нет,
+    # /export в боте присылает по файлу от каждого шарда
+    app = create_web_app(export=False)
+    app.router.add_get('/shards', handle_shards)
+    if Config.BOT_MODE == 'webhook':
+        app.router.add_post(Config.WEBHOOK_PATH, webhook_handler(route))
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await start_http_site(runner)
+    print(f'✅ HTTP сервер запущен на порту {Config.PORT} (очереди шардов: /shards)')
+
+    supervise_task = asyncio.create_task(supervisor.supervise())
+    serving = asyncio.create_task(serve_updates(route))
+    stop_on_signals(serving)
+    try:
+        await serving
+    except asyncio.CancelledError:
+        print('⏹ Остановка: шарды дорабатывают свои очереди...')
+    finally:
+        supervise_task.cancel()
+        await supervisor.stop()
+        await runner.cleanup()
+        await bot.session.close()
+
+
 # ========== ЗАПУСК БОТА ==========
+async def set_webhook():
+    webhook_url = Config.WEBHOOK_BASE_URL.rstrip('/') + Config.WEBHOOK_PATH
+    await bot.set_webhook(
+        webhook_url,
+        secret_token=Config.WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    print(f'🔗 Webhook установлен: {webhook_url}')
+
+
+async def on_startup():
+    # Индексы заявок и воронки читались в фоне, пока импортировался aiogram
+    await asyncio.gather(db.warmup.wait(), funnel.warmup.wait(), scheduler.warmup.wait())
+    startup.mark('данные загружены')
+    db.start()
+    notifier.start()
+    loop_lag.start()
+    broadcaster.resume()
+    scheduler.start()
+
+
+async def on_shutdown():
+    # Досылаем уведомления и дописываем на диск все, что еще в очереди
+    await broadcaster.stop()
+    await scheduler.stop()
+    await notifier.stop()
+    await db.close()
+    funnel.close()
+    # aiogram закрывает хранилище FSM раньше этого хука, а таймеры форм
+    # могли записать состояние уже после — сбрасываем еще раз
+    await dp.storage.close()
+    print('💾 Данные сохранены')
+
+
+# Пауза перед перезапуском polling растет от 1 с до POLLING_MAX_BACKOFF;
+# если polling проработал POLLING_STABLE_AFTER секунд, отсчет начинается заново
+POLLING_MAX_BACKOFF = 300
+POLLING_STABLE_AFTER = 60
+
+
+async def supervise_polling(submit):
+    """Перезапускает упавший polling с экспоненциальной паузой.
+
+    Перезапускается только цикл getUpdates: база, кэши, очередь уведомлений
+    и HTTP-сессия бота живут весь срок процесса.
+    """
+    delay = 1
+    while True:
+        started = time.monotonic()
+        try:
+            await bot.delete_webhook()
+            await poll_updates(submit)
+        except Exception as e:
+            error = e
+        if time.monotonic() - started > POLLING_STABLE_AFTER:
+            delay = 1
+        metrics.inc('bot_polling_restarts_total')
+        print(f'❌ Polling упал: {error!r}')
+        print(f'♻️ Перезапуск через {delay} с...')
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, POLLING_MAX_BACKOFF)
+
+
+async def serve_updates(submit):
+    """Получает апдейты до остановки: polling или ожидание запросов webhook"""
+    if Config.BOT_MODE == 'webhook':
+        await set_webhook()
+        await asyncio.Event().wait()
+    else:
+        await supervise_polling(submit)
+
+
 async def start_bot():
-    print("🤖 Запуск бота для продвижения бизнеса...")
-    await dp.start_polling(bot)
+    print(f"🤖 Запуск бота для продвижения бизнеса (режим: {Config.BOT_MODE})...")
+
+    app = create_web_app()
+    if Config.BOT_MODE == 'webhook':
+        if not Config.WEBHOOK_BASE_URL:
+            raise RuntimeError('Для режима webhook нужен WEBHOOK_URL или RENDER_EXTERNAL_URL')
+        app.router.add_post(Config.WEBHOOK_PATH, webhook_handler(pipeline.submit))
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    try:
+        # Хуки вызываются один раз, а не на каждый перезапуск polling. До загрузки
+        # данных порт держит ранний health check, и апдейты webhook сюда не попадут
+        await dp.emit_startup(bot=bot)
+        await start_http_site(runner)
+        print(f'✅ HTTP сервер запущен на порту {Config.PORT}')
+        print(f'🌐 Health check: http://0.0.0.0:{Config.PORT}/health')
+
+        serving = asyncio.create_task(serve_updates(pipeline.submit))
+        stop_on_signals(serving)
+        try:
+            await serving
+        except asyncio.CancelledError:
+            print('⏹ Остановка: дорабатываем принятые апдейты...')
+        finally:
+            await pipeline.join()
+            # Вместе с on_shutdown aiogram сбрасывает на диск хранилище FSM
+            await dp.emit_shutdown(bot=bot)
+            await bot.session.close()
+    finally:
+        await runner.cleanup()
 
 
 def main():
@@ -637,23 +4430,22 @@ def main():
     print('🚀 ЗАПУСК БОТА ДЛЯ ПРОДВИЖЕНИЯ БИЗНЕСА')
     print('=' * 50)
 
-    # Запускаем HTTP сервер для health check в отдельном потоке
-    http_thread = Thread(target=run_http_server, daemon=True)
-    http_thread.start()
-
-    # Даем время серверу запуститься
-    import time
-    time.sleep(3)
-
     # Запускаем бота
     try:
-        asyncio.run(start_bot())
+        if Config.WORKER_SHARDS > 1:
+            asyncio.run(start_sharded())
+        else:
+            asyncio.run(start_bot())
     except KeyboardInterrupt:
         print('\n⏹ Бот остановлен')
     except Exception as e:
+        # Сюда доходят только ошибки запуска — polling перезапускается сам.
+        # Ненулевой код выхода, чтобы процесс перезапустила платформа
         print(f'❌ Критическая ошибка: {e}')
-        print('♻️ Перезапуск через 10 секунд...')
-        time.sleep(10)
+        sys.exit(1)
+
+
+startup.mark('модуль загружен')
 
 
 if __name__ == '__main__':
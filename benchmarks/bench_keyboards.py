@@ -0,0 +1,57 @@
+"""Микро-бенчмарк клавиатур: сборка и сериализация на каждый ответ против кэша.
+
+Запуск: python benchmarks/bench_keyboards.py
+"""
+import functools
+import tracemalloc
+
+from common import load_app, measure
+
+app = load_app()
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import SendMessage
+
+NUMBER = 20000
+
+
+def allocated(func, number=1000):
+    """Сколько байт выделяется за один вызов"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep = [func() for _ in range(number)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del keep
+    return (after - before) / number
+
+
+def main():
+    builders = {
+        'get_main_menu': app.Keyboards.get_main_menu,
+        'get_services_keyboard': app.Keyboards.get_services_keyboard,
+        'get_contact_keyboard': app.Keyboards.get_contact_keyboard,
+        'get_budget_keyboard': app.Keyboards.get_budget_keyboard,
+    }
+    # Клавиатуры собираются на язык; меряем русские
+    builders = {name: functools.partial(builder, 'ru') for name, builder in builders.items()}
+
+    print('Сборка клавиатуры (мкс / байт на вызов)')
+    for name, cached in builders.items():
+        uncached = functools.partial(cached.func.__wrapped__, 'ru')
+        print(
+            f'  {name:24} без кэша: {measure(uncached, NUMBER):7.2f} мкс {allocated(uncached):8.0f} Б | '
+            f'с кэшем: {measure(cached, NUMBER):5.2f} мкс {allocated(cached):4.0f} Б'
+        )
+
+    print('Сериализация sendMessage с клавиатурой (мкс на запрос)')
+    default_session = AiohttpSession()
+    for name, cached in builders.items():
+        method = SendMessage(chat_id=1, text='Главное меню:', reply_markup=cached())
+        plain = measure(lambda: default_session.build_form_data(app.bot, method), NUMBER // 4)
+        fast = measure(lambda: app.bot.session.build_form_data(app.bot, method), NUMBER // 4)
+        print(f'  {name:24} aiogram: {plain:7.2f} мкс | готовый JSON: {fast:7.2f} мкс')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,487 @@
+"""Нагрузочный тест: бот в отдельном процессе под синтетическим трафиком.
+
+Бот запускается как в проде (python app.py) в чистом каталоге и ходит в
+локальную заглушку Bot API. Апдейты приходят через getUpdates (--mode polling)
+или POST на webhook (--mode webhook). Виртуальные пользователи проходят сценарии:
+  start — только /start;
+  menu  — /start и одна-три кнопки меню;
+  form  — /start и вся форма заявки;
+а менеджер (ADMIN_ID) берет каждую заявку, карточка которой до него дошла.
+
+Шаг сценария ждет первый ответ бота в этот чат (для менеджера — answerCallbackQuery);
+задержка от отправки апдейта до ответа копится по обработчику. Дополнительно
+снимаются RSS процесса, объем записи из /proc/<pid>/io, размеры файлов данных
+и время внутри обработчиков по /metrics бота. Результат пишется в JSON,
+с --compare печатается разница с прошлым прогоном.
+
+Запуск: python benchmarks/bench_load.py [--mode polling|webhook] [--duration 30]
+        [--users 50] [--rate 0] [--mix start=2,menu=5,form=3] [--think 0.5]
+        [--output load.json] [--compare прошлый.json]
+--rate ограничивает общий поток апдейтов в секунду (0 — сколько успеют пользователи).
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from common import ROOT, free_port, health_status
+from mock_bot_api import MockBotAPI
+
+ADMIN_ID = 123456789  # Config.ADMIN_IDS в app.py
+FIRST_USER_ID = 1000000
+WEBHOOK_SECRET = 'load-test'
+LEAD_BUTTON = re.compile(r'lead_take_(\d+)')
+METRIC_LINE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+
+# Кнопки главного меню и обработчики, которые на них отвечают
+MENU = (
+    ('about_company', '🏢 О компании'),
+    ('services', '📦 Услуги'),
+    ('calculate_cost', '💰 Рассчитать стоимость'),
+    ('cases', '📊 Наши кейсы'),
+    ('faq', '❓ FAQ'),
+    ('contacts', '📞 Контакты'),
+    ('contact_manager', '👨‍💼 Связаться с менеджером'),
+)
+SERVICES = ('service_smm', 'service_marketplaces', 'service_ads', 'service_complex', 'service_bot')
+BUDGETS = ('budget_10_25', 'budget_25_50', 'budget_50_100', 'budget_100_plus')
+BUSINESSES = ('Кофейня', 'Салон красоты', 'Интернет-магазин', 'Автосервис', '<b>Стройка</b> & Co')
+CONTACT_PREFERENCES = ('Telegram', 'WhatsApp', 'Звонок')
+
+
+def scenario_steps(name, rng):
+    """Шаги сценария: (обработчик, 'message' | 'callback', текст или callback_data)"""
+    steps = [('cmd_start', 'message', '/start')]
+    if name == 'menu':
+        for handler, text in rng.sample(MENU, rng.randint(1, 3)):
+            steps.append((handler, 'message', text))
+    elif name == 'form':
+        steps += [
+            ('start_application', 'message', '📝 Оставить заявку'),
+            ('process_name', 'message', f'Клиент {rng.randint(1, 99999)}'),
+            ('process_phone_text', 'message', f'+7999{rng.randint(0, 9999999):07d}'),
+            ('process_service', 'callback', rng.choice(SERVICES)),
+            ('process_business', 'message', rng.choice(BUSINESSES)),
+            ('process_budget', 'callback', rng.choice(BUDGETS)),
+            ('process_contact_pref', 'message', rng.choice(CONTACT_PREFERENCES)),
+        ]
+    return steps
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('start', 'menu', 'form'):
+            raise argparse.ArgumentTypeError(f'неизвестный сценарий {name!r}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentiles(values):
+    """count, p50/p95/p99/max в миллисекундах"""
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+    return {'count': len(values), 'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99), 'max': pick(1.0)}
+
+
+def parse_metrics(text):
+    """Текст Prometheus -> {(имя, метки): значение}"""
+    samples = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            samples[(match[1], match[2] or '')] = float(match[3])
+    return samples
+
+
+def metric_total(samples, name):
+    return sum(value for (metric, _), value in samples.items() if metric == name)
+
+
+def handler_means(before, after):
+    """Среднее время внутри каждого обработчика за прогон, мс"""
+    means = {}
+    for (metric, labels), total in after.items():
+        if metric != 'bot_handler_duration_seconds_sum':
+            continue
+        count = after[('bot_handler_duration_seconds_count', labels)]
+        count -= before.get(('bot_handler_duration_seconds_count', labels), 0)
+        total -= before.get((metric, labels), 0)
+        if count:
+            handler = labels.split('"')[1]
+            means[handler] = round(total / count * 1000, 3)
+    return means
+
+
+# ---------- процесс бота ----------
+def read_proc(pid, name):
+    """Поля /proc/<pid>/<name> как {ключ: число}; вне Linux — пустой словарь"""
+    try:
+        with open(f'/proc/{pid}/{name}') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return {}
+    fields = {}
+    for line in lines:
+        key, _, value = line.partition(':')
+        value = value.split()
+        if value and value[0].isdigit():
+            fields[key] = int(value[0])
+    return fields
+
+
+def rss_bytes(pid):
+    return read_proc(pid, 'status').get('VmRSS', 0) * 1024
+
+
+def data_files(directory):
+    return {
+        name: os.path.getsize(os.path.join(directory, name))
+        for name in sorted(os.listdir(directory))
+        if os.path.isfile(os.path.join(directory, name))
+    }
+
+
+class BotProcess:
+    """app.py в отдельном процессе; вывод копится, чтобы не переполнить pipe"""
+
+    def __init__(self, mode, api_url):
+        self.mode = mode
+        self.port = free_port()
+        self.workdir = tempfile.mkdtemp(prefix='bot-load-')
+        self.output = collections.deque(maxlen=50)
+        self.env = dict(
+            os.environ,
+            BOT_TOKEN='123456:BENCHMARK',
+            BOT_API_URL=api_url,
+            BOT_MODE=mode,
+            PORT=str(self.port),
+            WEBHOOK_URL=f'http://127.0.0.1:{self.port}',
+            WEBHOOK_SECRET=WEBHOOK_SECRET,
+            PYTHONUNBUFFERED='1'
+        )
+        self.process = None
+        self._reader = None
+
+    async def start(self, timeout=120):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, 'app.py'),
+            cwd=self.workdir, env=self.env,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+        )
+        self._reader = asyncio.create_task(self._read_output())
+        deadline = time.perf_counter() + timeout
+        while await health_status(self.port) != 200:
+            if self.process.returncode is not None or time.perf_counter() > deadline:
+                raise RuntimeError('бот не запустился:\n' + '\n'.join(self.output))
+            await asyncio.sleep(0.05)
+
+    async def _read_output(self):
+        async for line in self.process.stdout:
+            self.output.append(line.decode('utf-8', 'replace').rstrip())
+
+    async def metrics(self, session):
+        async with session.get(f'http://127.0.0.1:{self.port}/metrics') as response:
+            return parse_metrics(await response.text())
+
+    async def stop(self, timeout=60):
+        """Штатная остановка по SIGTERM; возвращает ее длительность"""
+        started = time.perf_counter()
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+        await self._reader
+        return time.perf_counter() - started
+
+
+# ---------- доставка апдейтов ----------
+class PollingTransport:
+    def __init__(self, api):
+        self.api = api
+
+    async def deliver(self, update):
+        self.api.push(update)
+
+    async def close(self):
+        pass
+
+
+class WebhookTransport:
+    def __init__(self, port):
+        self.url = f'http://127.0.0.1:{port}/webhook'
+        self.session = aiohttp.ClientSession(headers={'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET})
+
+    async def deliver(self, update):
+        async with self.session.post(self.url, json=update) as response:
+            if response.status != 200:
+                raise RuntimeError(f'webhook ответил {response.status}')
+
+    async def close(self):
+        await self.session.close()
+
+
+# ---------- трафик ----------
+class LoadGenerator:
+    def __init__(self, api, transport, args):
+        self.api = api
+        self.transport = transport
+        self.mix = args.mix
+        self.think = args.think
+        self.rate = args.rate
+        self.timeout = args.step_timeout
+        self.seed = args.seed
+        self.latencies = collections.defaultdict(list)
+        self.timeouts = collections.Counter()
+        self.sessions = collections.Counter()
+        self.sent = 0
+        self.leads = asyncio.Queue()
+        self._user_ids = itertools.count(FIRST_USER_ID)
+        self._pending = {}  # 'c<chat_id>' или 'q<callback_query_id>' -> future
+        self._next_slot = 0.0
+        api.listener = self.on_call
+
+    def on_call(self, method, params, at):
+        if method == 'answerCallbackQuery':
+            key = f"q{params.get('callback_query_id')}"
+        else:
+            key = f"c{params.get('chat_id')}"
+            if method == 'sendMessage' and str(params.get('chat_id')) == str(ADMIN_ID):
+                # Карточка новой заявки: в клавиатуре кнопка lead_take_<id>
+                match = LEAD_BUTTON.search(str(params.get('reply_markup', '')))
+                if match:
+                    self.leads.put_nowait(int(match.group(1)))
+        future = self._pending.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(at)
+
+    async def pace(self):
+        """Не больше --rate апдейтов в секунду на всех пользователей"""
+        if not self.rate:
+            return
+        now = time.perf_counter()
+        slot = max(self._next_slot, now)
+        self._next_slot = slot + 1 / self.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def step(self, handler, update, key):
+        """Отправляет апдейт и ждет ответ бота; False — ответа не было"""
+        await self.pace()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        started = time.perf_counter()
+        self.sent += 1
+        await self.transport.deliver(update)
+        try:
+            answered = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._pending.pop(key, None)
+            self.timeouts[handler] += 1
+            return False
+        self.latencies[handler].append(answered - started)
+        return True
+
+    async def user(self, index, deadline):
+        rng = random.Random(self.seed * 100003 + index)
+        names = list(self.mix)
+        weights = list(self.mix.values())
+        while time.perf_counter() < deadline:
+            scenario = rng.choices(names, weights)[0]
+            user_id = next(self._user_ids)
+            self.sessions[scenario] += 1
+            for handler, kind, payload in scenario_steps(scenario, rng):
+                if kind == 'message':
+                    update = self.api.new_message(user_id, payload)
+                else:
+                    update = self.api.new_callback(user_id, payload)
+                if not await self.step(handler, update, f'c{user_id}'):
+                    break  # бот не ответил — пользователь бросает сессию
+                await asyncio.sleep(rng.uniform(0, 2 * self.think))
+
+    async def manager(self):
+        while True:
+            lead_id = await self.leads.get()
+            update = self.api.new_callback(ADMIN_ID, f'lead_take_{lead_id}')
+            await self.step('take_lead', update, f"q{update['callback_query']['id']}")
+
+    async def run(self, users, duration):
+        deadline = time.perf_counter() + duration
+        manager = asyncio.create_task(self.manager())
+        await asyncio.gather(*(self.user(index, deadline) for index in range(users)))
+        # Даем менеджеру разобрать карточки, которые еще в очереди уведомлений
+        drain_deadline = time.perf_counter() + self.timeout
+        while not self.leads.empty() and time.perf_counter() < drain_deadline:
+            await asyncio.sleep(0.1)
+        manager.cancel()
+        try:
+            await manager
+        except asyncio.CancelledError:
+            pass
+
+
+async def sample_rss(pid, samples, interval=0.25):
+    while True:
+        samples.append(rss_bytes(pid))
+        await asyncio.sleep(interval)
+
+
+# ---------- прогон ----------
+async def run(args):
+    api = MockBotAPI(latency=args.api_latency)
+    api_url = await api.start()
+    bot = BotProcess(args.mode, api_url)
+    await bot.start()
+    pid = bot.process.pid
+    transport = PollingTransport(api) if args.mode == 'polling' else WebhookTransport(bot.port)
+    generator = LoadGenerator(api, transport, args)
+
+    async with aiohttp.ClientSession() as session:
+        metrics_before = await bot.metrics(session)
+        io_before = read_proc(pid, 'io')
+        rss_samples = [rss_bytes(pid)]
+        sampler = asyncio.create_task(sample_rss(pid, rss_samples))
+        started = time.perf_counter()
+        try:
+            await generator.run(args.users, args.duration)
+        finally:
+            elapsed = time.perf_counter() - started
+            sampler.cancel()
+            await transport.close()
+        rss_samples.append(rss_bytes(pid))
+        io_after = read_proc(pid, 'io')
+        metrics_after = await bot.metrics(session)
+
+    shutdown = await bot.stop()
+    await api.stop()
+
+    handlers = {}
+    means = handler_means(metrics_before, metrics_after)
+    for handler, values in sorted(generator.latencies.items()):
+        handlers[handler] = percentiles(values)
+        handlers[handler]['timeouts'] = generator.timeouts[handler]
+        handlers[handler]['server_mean'] = means.get(handler)
+    answered = sum(len(values) for values in generator.latencies.values())
+    files = data_files(bot.workdir)
+
+    return {
+        'mode': args.mode,
+        'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'params': {
+            'duration': args.duration, 'users': args.users, 'rate': args.rate, 'mix': args.mix,
+            'think': args.think, 'api_latency': args.api_latency, 'seed': args.seed
+        },
+        'elapsed_s': round(elapsed, 2),
+        'sessions': dict(generator.sessions),
+        'updates_sent': generator.sent,
+        'updates_answered': answered,
+        'timeouts': sum(generator.timeouts.values()),
+        'updates_per_s': round(answered / elapsed, 1),
+        'latency_ms': percentiles(list(itertools.chain.from_iterable(generator.latencies.values()))),
+        'handlers': handlers,
+        'memory': {
+            'rss_start_mb': round(rss_samples[0] / 2 ** 20, 1),
+            'rss_peak_mb': round(max(rss_samples) / 2 ** 20, 1),
+            'rss_end_mb': round(rss_samples[-1] / 2 ** 20, 1),
+            'rss_growth_mb': round((rss_samples[-1] - rss_samples[0]) / 2 ** 20, 1)
+        },
+        'io': {
+            # wchar — все записи процесса, write_bytes — то, что дошло до диска
+            'wchar_bytes': io_after.get('wchar', 0) - io_before.get('wchar', 0),
+            'write_bytes': io_after.get('write_bytes', 0) - io_before.get('write_bytes', 0),
+            'leads_files_bytes': sum(size for name, size in files.items() if name.startswith('leads')),
+            'files': files,
+            'fsync_batches': int(metric_total(metrics_after, 'bot_storage_fsync_seconds_count')
+                                 - metric_total(metrics_before, 'bot_storage_fsync_seconds_count'))
+        },
+        'bot_api_calls': dict(collections.Counter(name for name, _, _ in api.calls)),
+        'throttled': int(metric_total(metrics_after, 'bot_throttled_total')),
+        'shutdown_s': round(shutdown, 2)
+    }
+
+
+def print_report(result):
+    print(f"Режим {result['mode']}: {result['elapsed_s']} с, сессий {sum(result['sessions'].values())} "
+          f"{result['sessions']}")
+    print(f"  апдейтов: отправлено {result['updates_sent']}, с ответом {result['updates_answered']}, "
+          f"без ответа {result['timeouts']}, отброшено антифлудом {result['throttled']}")
+    latency = result['latency_ms']
+    print(f"  {result['updates_per_s']} апд/с, задержка p50 {latency.get('p50')} мс, "
+          f"p95 {latency.get('p95')} мс, p99 {latency.get('p99')} мс")
+    print(f"  {'обработчик':22} {'кол-во':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'внутри':>8}  мс")
+    for handler, stats in result['handlers'].items():
+        print(f"  {handler:22} {stats['count']:7} {stats['p50']:8} {stats['p95']:8} {stats['p99']:8} "
+              f"{stats['server_mean'] if stats['server_mean'] is not None else '-':>8}")
+    memory, io = result['memory'], result['io']
+    print(f"  RSS {memory['rss_start_mb']} -> {memory['rss_end_mb']} МБ (пик {memory['rss_peak_mb']})")
+    print(f"  запись: {io['wchar_bytes'] / 1024:.0f} КБ, на диск {io['write_bytes'] / 1024:.0f} КБ, "
+          f"пачек fsync {io['fsync_batches']}, файлы leads.* {io['leads_files_bytes'] / 1024:.0f} КБ")
+    print(f"  остановка {result['shutdown_s']} с")
+
+
+def print_comparison(old, new):
+    """Разница ключевых показателей; ⚠️ — ухудшение больше чем на 10%"""
+    rows = [('апд/с', old['updates_per_s'], new['updates_per_s'], True)]
+    for name in ('p50', 'p95', 'p99'):
+        rows.append((f'задержка {name}', old['latency_ms'].get(name), new['latency_ms'].get(name), False))
+    for handler, stats in new['handlers'].items():
+        if handler in old['handlers']:
+            rows.append((f'{handler} p95', old['handlers'][handler].get('p95'), stats.get('p95'), False))
+    rows.append(('рост RSS, МБ', old['memory']['rss_growth_mb'], new['memory']['rss_growth_mb'], False))
+    rows.append(('запись, КБ', old['io']['wchar_bytes'] / 1024, new['io']['wchar_bytes'] / 1024, False))
+
+    print(f"Сравнение с прогоном {old['started_at']} ({old['mode']}):")
+    for name, before, after, higher_is_better in rows:
+        if not before or after is None:
+            continue
+        change = (after - before) / before * 100
+        worse = change < -10 if higher_is_better else change > 10
+        print(f"  {name:30} {before:10.1f} -> {after:10.1f} {change:+6.1f}% {'⚠️' if worse else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default='polling')
+    parser.add_argument('--duration', type=float, default=30, help='секунд подачи новых сессий')
+    parser.add_argument('--users', type=int, default=50, help='одновременных пользователей')
+    parser.add_argument('--rate', type=float, default=0, help='предел апдейтов в секунду, 0 — без предела')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('start=2,menu=5,form=3'))
+    parser.add_argument('--think', type=float, default=0.5, help='средняя пауза пользователя между шагами, с')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа заглушки Bot API, с')
+    parser.add_argument('--step-timeout', type=float, default=10.0, help='сколько ждать ответ на шаг, с')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='куда записать JSON (по умолчанию load-<режим>-<время>.json)')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    output = args.output or f"load-{args.mode}-{datetime.datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f'Результат: {output}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Память на одного пользователя и одну заявку: словари из JSON против записей User/Lead.
+
+Снимок на N пользователей и N заявок (значения как в bench_search, время —
+ISO-строки с микросекундами, как писал datetime.now().isoformat()) читается
+json.loads, и индекс по id собирается двумя способами:
+  - до: словари как есть (так Database хранила записи раньше);
+  - после: User.from_dict / Lead.from_dict — __slots__, общие строки
+    статусов, услуг и бюджетов, время в секундах epoch.
+Память меряется tracemalloc: итог после сборки (что живет весь срок
+процесса) и пик во время чтения. Последние строки — стоимость кодека на
+запись и проверка, что to_dict -> from_dict ничего не теряет.
+
+Запуск: python benchmarks/bench_records.py [--counts 100000 1000000]
+"""
+import argparse
+import datetime
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+from common import load_app
+from bench_search import BUSINESSES, FIRST_NAMES, SERVICES
+
+app = load_app()
+
+BUDGETS = ('до 10 тыс. ₽', '10-25 тыс. ₽', '25-50 тыс. ₽', '50-100 тыс. ₽', 'более 100 тыс. ₽')
+CONTACTS = ('Telegram', 'WhatsApp', 'Звонок')
+
+
+def snapshot_texts(count, rng):
+    """JSON-списки пользователей и заявок, как в leads.json"""
+    started = datetime.datetime(2024, 1, 1)
+    users, leads = [], []
+    for i in range(1, count + 1):
+        created_at = (started + datetime.timedelta(seconds=i * 17, microseconds=rng.randrange(10 ** 6))).isoformat()
+        users.append({
+            'user_id': 10 ** 9 + i, 'username': f'user{i}', 'full_name': f'{rng.choice(FIRST_NAMES)} {i}',
+            'language': rng.choice(('ru', 'ru', 'en', None)), 'created_at': created_at
+        })
+        lead = {
+            'id': i, 'user_id': 10 ** 9 + i, 'service_type': rng.choice(SERVICES),
+            'business_type': rng.choice(BUSINESSES), 'budget': rng.choice(BUDGETS),
+            'contact_preference': rng.choice(CONTACTS), 'name': users[-1]['full_name'],
+            'phone': f'+7999{i:07d}', 'status': 'new' if rng.random() < 0.3 else 'in_progress',
+            'created_at': created_at
+        }
+        if lead['status'] != 'new':
+            lead['manager_id'] = 123456789
+        leads.append(lead)
+    return json.dumps(users, ensure_ascii=False), json.dumps(leads, ensure_ascii=False)
+
+
+def measure_memory(build, text):
+    """(байт после сборки, пиковых байт) для индекса, собранного build из JSON text"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        index = build(text)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del index
+    gc.collect()
+    return current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', type=int, nargs='+', default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    builds = {
+        'user': (
+            lambda text: {user['user_id']: user for user in json.loads(text)},
+            lambda text: {user.user_id: user for user in map(app.User.from_dict, json.loads(text))}
+        ),
+        'lead': (
+            lambda text: {lead['id']: lead for lead in json.loads(text)},
+            lambda text: {lead.id: lead for lead in map(app.Lead.from_dict, json.loads(text))}
+        )
+    }
+    print(f"{'записей':>9} {'тип':5} {'до, Б/зап':>10} {'после':>8} {'экономия':>9} {'пик до, МБ':>11} {'пик после':>10}")
+    for count in args.counts:
+        texts = dict(zip(('user', 'lead'), snapshot_texts(count, random.Random(1))))
+        for kind, (as_dicts, as_records) in builds.items():
+            before, before_peak = measure_memory(as_dicts, texts[kind])
+            after, after_peak = measure_memory(as_records, texts[kind])
+            print(f'{count:9} {kind:5} {before / count:10.0f} {after / count:8.0f} '
+                  f'{1 - after / before:9.0%} {before_peak / 2 ** 20:11.0f} {after_peak / 2 ** 20:10.0f}')
+        del texts
+
+    # Кодек: запись в словарь для журнала/снимка и обратно
+    leads = [app.Lead.from_dict(lead) for lead in json.loads(snapshot_texts(10_000, random.Random(2))[1])]
+    started = time.perf_counter()
+    dicts = [lead.to_dict() for lead in leads]
+    encode = (time.perf_counter() - started) / len(leads) * 1e6
+    started = time.perf_counter()
+    decoded = [app.Lead.from_dict(data) for data in dicts]
+    decode = (time.perf_counter() - started) / len(leads) * 1e6
+    same = all(lead.to_dict() == data for lead, data in zip(decoded, dicts))
+    print(f'кодек Lead: to_dict {encode:.1f} мкс, from_dict {decode:.1f} мкс, без потерь: {same}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Бенчмарк маршрутизации: цепочка F-фильтров против таблицы MenuButtons/CallbackPrefixes.
+
+Оба диспетчера получают один и тот же поток из 100 000 синтетических апдейтов
+(кнопки меню, свободный текст, inline-кнопки). Обработчики пустые, поэтому
+разница во времени — это стоимость выбора обработчика.
+
+Запуск: python benchmarks/bench_routing.py [количество апдейтов]
+"""
+import asyncio
+import datetime
+import random
+import sys
+import time
+
+from common import load_app
+
+app = load_app()
+
+from aiogram import Dispatcher, F, types
+from aiogram.fsm.storage.memory import MemoryStorage
+
+MENU_TEXTS = [
+    "🏢 О компании", "📦 Услуги", "❓ FAQ", "📞 Контакты", "📊 Наши кейсы",
+    "👨‍💼 Связаться с менеджером", "📝 Оставить заявку", "💰 Рассчитать стоимость"
+]
+CALLBACK_PREFIXES = ["service_", "budget_", "take_lead_"]
+CALLBACK_DATA = ["service_smm", "service_ads", "budget_10_25", "budget_100_plus", "take_lead_42"]
+FREE_TEXT = ["Иван Петров", "+79990000000", "Кофейня", "Telegram", "привет"]
+
+
+async def noop(*args, **kwargs):
+    pass
+
+
+def add_form_handlers(dp):
+    for state in (
+        app.ApplicationForm.waiting_for_name,
+        app.ApplicationForm.waiting_for_phone,
+        app.ApplicationForm.waiting_for_business,
+        app.ApplicationForm.waiting_for_contact,
+    ):
+        dp.message.register(noop, state)
+
+
+def chain_dispatcher():
+    dp = Dispatcher(storage=MemoryStorage())
+    for text in MENU_TEXTS:
+        dp.message.register(noop, F.text == text)
+    add_form_handlers(dp)
+    for prefix in CALLBACK_PREFIXES:
+        dp.callback_query.register(noop, F.data.startswith(prefix))
+    return dp
+
+
+def table_dispatcher():
+    dp = Dispatcher(storage=MemoryStorage())
+    menu = app.MenuButtons()
+    callbacks = app.CallbackPrefixes()
+    for text in MENU_TEXTS:
+        menu.button(text)(noop)
+    for prefix in CALLBACK_PREFIXES:
+        callbacks.prefix(prefix)(noop)
+    dp.message.register(menu.dispatch, menu)
+    add_form_handlers(dp)
+    dp.callback_query.register(callbacks.dispatch, callbacks)
+    return dp
+
+
+def synthetic_updates(count):
+    user = types.User(id=1, is_bot=False, first_name='Bench')
+    chat = types.Chat(id=1, type='private')
+    now = datetime.datetime.now()
+    pool = [
+        types.Update(update_id=0, message=types.Message(
+            message_id=1, date=now, chat=chat, from_user=user, text=text
+        ))
+        for text in MENU_TEXTS + FREE_TEXT
+    ] + [
+        types.Update(update_id=0, callback_query=types.CallbackQuery(
+            id='1', from_user=user, chat_instance='1', data=data
+        ))
+        for data in CALLBACK_DATA
+    ]
+    rng = random.Random(42)
+    return [rng.choice(pool) for _ in range(count)]
+
+
+async def run(dp, updates):
+    start = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(app.bot, update)
+    return time.perf_counter() - start
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    updates = synthetic_updates(count)
+    print(f'Апдейтов: {count}')
+    for name, dp in (('цепочка F-фильтров', chain_dispatcher()), ('таблица', table_dispatcher())):
+        elapsed = await run(dp, updates)
+        print(f'  {name:20} {elapsed:6.2f} с, {elapsed / count * 1e6:7.1f} мкс на апдейт')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
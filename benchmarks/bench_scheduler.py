@@ -0,0 +1,102 @@
+"""Таймеры Scheduler: постановка, замена, отмена и перезапуск при десятках тысяч ожидающих.
+
+Для каждого N ставится N таймеров со случайным временем срабатывания
+(как напоминания о заявках и формах), затем N замен (шаг формы
+переставляет таймер с тем же ключом) и N/10 отмен. Замеряется время одной
+операции вместе с записью строки в журнал, чтение журнала новым
+экземпляром (перезапуск бота) и извлечение всех таймеров по порядку.
+Последние столбцы — самая долгая постановка (столько стоит event loop, пока
+журнал переписывается), когда журнал пишется прямо в вызове и когда его пишет
+поток-писатель, как в работающем боте. Сборщик мусора на это время выключен:
+его паузы зависят от всего процесса, а не от журнала.
+
+Запуск: python benchmarks/bench_scheduler.py [--counts 10000 50000 100000]
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import time
+
+from common import load_app
+
+app = load_app()
+
+
+async def worst_schedule(count, rng, writer):
+    """Самая долгая постановка (мс) при count таймерах; writer — запущен ли писатель журнала"""
+    scheduler = app.Scheduler(f'timers-worst-{count}-{writer}.log')
+    if writer:
+        scheduler.start()
+    now = time.time()
+    data = {'user_id': 1, 'language': 'ru', 'active_at': int(now), 'stage': 'remind'}
+    worst = 0.0
+    gc.disable()
+    # Три прохода: журнал успевает несколько раз дорасти до компактизации
+    for _ in range(3):
+        for i in range(count):
+            started = time.perf_counter()
+            scheduler.schedule(f'form:{i}', 'form', now + 3600 + rng.random() * 86400, data)
+            worst = max(worst, time.perf_counter() - started)
+            if i % 1000 == 0:
+                await asyncio.sleep(0)
+    gc.enable()
+    await scheduler.stop()
+    return worst * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', type=int, nargs='+', default=[10_000, 50_000, 100_000])
+    args = parser.parse_args()
+
+    print(f"{'таймеров':>9} {'постановка':>11} {'замена':>8} {'отмена':>8} {'журнал, КБ':>11} "
+          f"{'чтение, мс':>11} {'извлечение':>11} {'худшая, мс':>11} {'с писателем':>12}  мкс на операцию")
+    for count in args.counts:
+        rng = random.Random(1)
+        filename = f'timers-{count}.log'
+        scheduler = app.Scheduler(filename)
+        now = time.time()
+        keys = [f'form:{i}' for i in range(count)]
+
+        def run(operation):
+            started = time.perf_counter()
+            for key in keys:
+                operation(key)
+            return (time.perf_counter() - started) / len(keys) * 1e6
+
+        data = {'user_id': 1, 'language': 'ru', 'active_at': int(now), 'stage': 'remind'}
+        schedule = run(lambda key: scheduler.schedule(key, 'form', now + rng.random() * 86400, data))
+        replace = run(lambda key: scheduler.schedule(key, 'form', now + rng.random() * 86400, data))
+        cancelled = keys[::10]
+        started = time.perf_counter()
+        for key in cancelled:
+            scheduler.cancel(key)
+        cancel = (time.perf_counter() - started) / len(cancelled) * 1e6
+        pending = len(scheduler)
+        scheduler._log.close()
+        size = os.path.getsize(filename) / 1024
+
+        started = time.perf_counter()
+        restarted = app.Scheduler(filename)
+        load = (time.perf_counter() - started) * 1000
+        assert len(restarted) == pending
+
+        # Извлечение в порядке срабатывания — как если бы все таймеры просрочились
+        dues = {key: timer[0] for key, timer in restarted._timers.items()}
+        order = []
+        started = time.perf_counter()
+        while (timer := restarted._pop_due(now + 86400)) is not None:
+            order.append(timer[0])
+        pop = (time.perf_counter() - started) / max(len(order), 1) * 1e6
+        assert len(order) == pending
+        assert all(dues[a] <= dues[b] for a, b in zip(order, order[1:]))
+        restarted._log.close()
+        inline, threaded = (asyncio.run(worst_schedule(count, rng, writer)) for writer in (False, True))
+        print(f'{count:9} {schedule:11.1f} {replace:8.1f} {cancel:8.1f} {size:11.0f} {load:11.0f} {pop:11.1f} '
+              f'{inline:11.1f} {threaded:12.1f}')
+
+
+if __name__ == '__main__':
+    main()
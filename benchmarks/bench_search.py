@@ -0,0 +1,99 @@
+"""Поиск заявок (/find) по индексам Database на большом числе заявок.
+
+Заявки с реалистичным разбросом (30 имен, 20 типов бизнеса, 5 услуг, треть
+новых) кладутся в индексы напрямую, без диска. Для каждого запроса
+меряется время одной страницы из 10 заявок, включая проверку «есть еще».
+Последние строки — поиск без индексов (проход по всем заявкам, как /export)
+и худший случай: частое слово и редкое, страницу не набрать до конца списка.
+
+Перед замерами — проверка смены статусов: взятая последняя новая заявка
+не должна ломать добавление следующей (пустой список статуса в индексе).
+
+Запуск: python benchmarks/bench_search.py [--leads 1000000]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from common import load_app, measure
+
+app = load_app()
+
+FIRST_NAMES = (
+    'Иван', 'Петр', 'Анна', 'Мария', 'Алексей', 'Ольга', 'Сергей', 'Елена', 'Дмитрий', 'Наталья',
+    'Андрей', 'Татьяна', 'Михаил', 'Ирина', 'Николай', 'Светлана', 'Юрий', 'Галина', 'Павел', 'Юлия',
+    'Артем', 'Ксения', 'Роман', 'Дарья', 'Олег', 'Вера', 'Егор', 'Полина', 'Кирилл', 'Алина'
+)
+BUSINESSES = (
+    'Кофейня', 'Салон красоты', 'Интернет-магазин', 'Автосервис', 'Стоматология', 'Пекарня',
+    'Фитнес-клуб', 'Цветочный магазин', 'Барбершоп', 'Ресторан', 'Школа английского', 'Строительство',
+    'Юридические услуги', 'Доставка еды', 'Клининг', 'Отель', 'Ветклиника', 'Фотостудия',
+    'Магазин одежды', 'Турагентство'
+)
+SERVICES = ('Продвижение в соцсетях (SMM)', 'Работа с маркетплейсами', 'Настройка рекламы',
+            'Комплексное продвижение', 'Разработка Telegram бота')
+
+
+def fill(db, count, rng):
+    for lead_id in range(1, count + 1):
+        db._index_lead(app.Lead(
+            lead_id, lead_id, rng.choice(SERVICES), rng.choice(BUSINESSES), '10-25 тыс. ₽', 'Telegram',
+            f'{rng.choice(FIRST_NAMES)} {rng.randint(1, 99999)}', f'+7999{lead_id:07d}',
+            status='new' if rng.random() < 0.3 else 'in_progress', created_at=1704067200
+        ))
+
+
+async def check_status_moves():
+    """Заявка -> взять -> новая заявка: индекс статуса пустеет и наполняется снова"""
+    db = app.Database('moves.json', background=False)
+    first = await db.add_lead(1, SERVICES[0], BUSINESSES[0], '10-25 тыс. ₽', 'Telegram', 'Иван', '+79990000001')
+    assert await db.take_lead(first.id, 123456789) is first
+    assert 'new' not in db.index.exact['status']
+    second = await db.add_lead(2, SERVICES[0], BUSINESSES[0], '10-25 тыс. ₽', 'Telegram', 'Анна', '+79990000002')
+    assert [lead.id for lead in db.search(status='new')[0]] == [second.id]
+    assert [lead.id for lead in db.search(status='in_progress')[0]] == [first.id]
+    assert db.status_counts['new'] == 1 and db.get_lead(second.id) is second
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--leads', type=int, default=200_000)
+    args = parser.parse_args()
+
+    asyncio.run(check_status_moves())
+    db = app.Database('bench.json')
+    started = time.perf_counter()
+    fill(db, args.leads, random.Random(1))
+    build = time.perf_counter() - started
+    print(f'Заявок: {args.leads}, построение индексов {build:.1f} с '
+          f'({build / args.leads * 1e6:.1f} мкс на заявку), объем ≈{db.index.memory_size() / 2 ** 20:.0f} МБ')
+
+    middle = args.leads // 2
+    queries = [
+        ('телефон', dict(phone=f'8 999 {middle:07d}')),
+        ('status=new', dict(status='new')),
+        ('status=new, страница из середины', dict(status='new', before=middle)),
+        ('status=new, назад к новым', dict(status='new', after=middle)),
+        ('«иван» (1/30 заявок)', dict(text='иван')),
+        ('«иван коф»', dict(text='иван коф')),
+        ('«иван коф» status=new service', dict(text='иван коф', status='new', service=SERVICES[0])),
+        ('«алина 4242» (единицы)', dict(text='алина 4242')),
+        ('«юр» — короткий префикс', dict(text='юр')),
+    ]
+    print(f"{'запрос':42} {'мс':>8}  найдено на странице")
+    for title, query in queries:
+        number = 200
+        elapsed = measure(lambda: db.search(**query), number) / 1000
+        print(f'{title:42} {elapsed:8.3f}  {len(db.search(**query)[0])}')
+
+    # Для сравнения: тот же фильтр проходом по всем заявкам
+    scan = measure(lambda: sum(1 for _ in db.iter_leads(status='new')), 3) / 1000
+    print(f"{'полный проход status=new (iter_leads)':42} {scan:8.3f}")
+    # Совпадений меньше страницы: проходится весь самый короткий список кандидатов
+    rare = measure(lambda: db.search(text='иван 7777'), 20) / 1000
+    print(f"{'худший случай: «иван 7777»':42} {rare:8.3f}  {len(db.search(text='иван 7777')[0])}")
+
+
+if __name__ == '__main__':
+    main()
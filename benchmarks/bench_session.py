@@ -0,0 +1,93 @@
+"""Пропускная способность и хвостовые задержки отправки через сессию Bot API.
+
+Бот шлет sendMessage в локальную заглушку Bot API с искусственной задержкой
+ответа (по умолчанию 20 мс — примерно RTT до api.telegram.org). Для каждой
+сессии и уровня параллелизма замеряются сообщения в секунду, p50/p95/p99
+задержки одного запроса и число открытых соединений. Лимиты Telegram
+(30 сообщений/с) здесь не применяются — меряется сама сессия.
+
+Запуск: python benchmarks/bench_session.py [--messages 2000] [--latency 0.02]
+        [--concurrency 1,8,32,128] [--pools 10,100] [--json results.json]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import load_app
+from mock_bot_api import MockBotAPI
+
+app = load_app()
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(session, api, messages, concurrency):
+    bot = Bot('123456:BENCHMARK', session=session)
+    await bot.send_message(1, 'прогрев')
+    api.connections.clear()
+    latencies = []
+    remaining = iter(range(messages))
+
+    async def worker():
+        for i in remaining:
+            started = time.perf_counter()
+            await bot.send_message(i, 'Новая заявка')
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await session.close()
+    return {
+        'messages_per_second': messages / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'connections': len(api.connections)
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--concurrency', default='1,8,32,128')
+    parser.add_argument('--pools', default='10,100', help='размеры пула BotSession')
+    parser.add_argument('--json', help='куда сохранить результаты')
+    args = parser.parse_args()
+
+    api = MockBotAPI(latency=args.latency)
+    server = TelegramAPIServer.from_base(await api.start())
+    sessions = {'aiogram по умолчанию': lambda: AiohttpSession(api=server)}
+    for pool in map(int, args.pools.split(',')):
+        sessions[f'BotSession пул {pool}'] = lambda pool=pool: app.BotSession(
+            api=server, pool_size=pool, keepalive=app.Config.HTTP_KEEPALIVE
+        )
+
+    print(f'Сообщений: {args.messages}, задержка Bot API: {args.latency * 1000:.0f} мс')
+    results = []
+    for concurrency in map(int, args.concurrency.split(',')):
+        print(f'Параллельно: {concurrency}')
+        for name, make_session in sessions.items():
+            result = await run(make_session(), api, args.messages, concurrency)
+            results.append({'session': name, 'concurrency': concurrency, **result})
+            print(f'  {name:22} {result["messages_per_second"]:7.0f} сообщ/с | '
+                  f'p50 {result["p50_ms"]:6.1f} мс, p95 {result["p95_ms"]:6.1f} мс, '
+                  f'p99 {result["p99_ms"]:6.1f} мс | соединений: {result["connections"]}')
+    await api.stop()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
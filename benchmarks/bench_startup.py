@@ -0,0 +1,121 @@
+"""Холодный старт: от запуска процесса до открытого порта и до первого обработанного апдейта.
+
+Бот запускается как на Render (python app.py) в чистом каталоге и получает
+апдейты от локальной заглушки Bot API. Замеряется:
+  - порт: первый ответ по HTTP на /health (пока грузится aiogram — 503 starting);
+  - готов: /health ответил 200;
+  - апдейт: заглушка получила ответ бота на /start.
+Фазы изнутри процесса печатает сам бот (STARTUP_PROFILE=1), они выводятся
+для последнего прогона.
+
+Запуск: python benchmarks/bench_startup.py [--runs 3] [--leads 0] [--max-seconds N]
+С --max-seconds бенчмарк завершается с кодом 1, если медиана времени до
+первого апдейта больше порога — так его можно использовать как регрессионный тест.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from common import free_port, health_status
+from mock_bot_api import MockBotAPI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USER_ID = 42
+
+
+def seed_leads(directory, count):
+    """leads.json на count заявок: сколько стоит прогрев индексов"""
+    leads = [
+        {
+            'id': i, 'user_id': i, 'service_type': 'SMM', 'business_type': 'Кофейня',
+            'budget': '10-25 тыс. ₽', 'contact_preference': 'Telegram', 'name': f'Клиент {i}',
+            'phone': '+79990000000', 'status': 'new', 'created_at': '2024-01-01T00:00:00'
+        }
+        for i in range(1, count + 1)
+    ]
+    users = [{'user_id': i, 'username': None, 'full_name': f'Клиент {i}'} for i in range(1, count + 1)]
+    with open(os.path.join(directory, 'leads.json'), 'w', encoding='utf-8') as f:
+        json.dump({'users': users, 'leads': leads}, f, ensure_ascii=False)
+
+
+async def one_run(leads):
+    api = MockBotAPI()
+    api_url = await api.start()
+    api.add_message(USER_ID, '/start')
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix='bot-startup-')
+    if leads:
+        seed_leads(workdir, leads)
+    env = dict(
+        os.environ,
+        BOT_TOKEN='123456:BENCHMARK',
+        BOT_API_URL=api_url,
+        BOT_MODE='polling',
+        PORT=str(port),
+        STARTUP_PROFILE='1',
+        PYTHONUNBUFFERED='1'
+    )
+
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, 'app.py'),
+        cwd=workdir, env=env,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    port_open = ready = None
+    first_update = asyncio.create_task(api.wait_for('sendMessage', chat_id=USER_ID))
+    try:
+        while ready is None:
+            status = await health_status(port)
+            now = time.perf_counter()
+            if status is not None and port_open is None:
+                port_open = now - started
+            if status == 200:
+                ready = now - started
+            if process.returncode is not None:
+                raise RuntimeError('бот завершился при запуске')
+            await asyncio.sleep(0.01)
+        handled = await first_update - started
+    finally:
+        process.terminate()
+        output, _ = await process.communicate()
+        await api.stop()
+    phases = [line for line in output.decode('utf-8', 'replace').splitlines() if line.startswith('⏱')]
+    return port_open, ready, handled, phases
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--leads', type=int, default=0, help='заявок в leads.json перед стартом')
+    parser.add_argument('--max-seconds', type=float, default=None)
+    args = parser.parse_args()
+
+    results = []
+    phases = []
+    for _ in range(args.runs):
+        *times, phases = await one_run(args.leads)
+        results.append(times)
+
+    print(f'Прогонов: {args.runs}, заявок в базе: {args.leads}')
+    for index, name in enumerate(('порт открыт', '/health 200', 'первый апдейт')):
+        values = [run[index] for run in results]
+        print(f'  {name:14} медиана {statistics.median(values) * 1000:7.0f} мс, '
+              f'мин {min(values) * 1000:7.0f} мс, макс {max(values) * 1000:7.0f} мс')
+    print('Фазы последнего прогона:')
+    for line in phases:
+        print(f'  {line}')
+
+    first_update = statistics.median(run[2] for run in results)
+    if args.max_seconds is not None and first_update > args.max_seconds:
+        print(f'❌ Первый апдейт через {first_update:.2f} с, порог {args.max_seconds:.2f} с')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+"""Тексты ответов: сборка f-строкой на каждый запрос против подготовленных Texts/Template.
+
+Запуск: python benchmarks/bench_templates.py
+"""
+from common import load_app, measure
+
+app = load_app()
+
+from aiogram import types
+
+NUMBER = 100_000
+
+DATA = {
+    'name': 'Иван <Петров>',
+    'phone': '+79990000000',
+    'service': 'Продвижение в соцсетях (SMM)',
+    'business': 'Кофейня & пекарня',
+    'budget': '10-25 тыс. ₽'
+}
+
+
+def lead_accepted_fstring():
+    # Как было: поля пользователя подставляются без экранирования
+    return (
+        f"✅ <b>Заявка #{42} принята!</b>\n\n"
+        f"<b>Ваши данные:</b>\n"
+        f"Имя: {DATA['name']}\n"
+        f"Телефон: {DATA.get('phone', 'Не указан')}\n"
+        f"Услуга: {DATA['service']}\n"
+        f"Бизнес: {DATA['business']}\n"
+        f"Бюджет: {DATA['budget']}\n"
+        f"Связь: {'Telegram'}\n\n"
+        f"Менеджер свяжется с вами в течение часа в рабочее время."
+    )
+
+
+def main():
+    user = types.User(id=1, is_bot=False, first_name='Bench', language_code='ru')
+    user_en = types.User(id=2, is_bot=False, first_name='Bench', language_code='en-GB')
+
+    def lead_accepted_template():
+        t = app.texts_for(user)
+        return t.LEAD_ACCEPTED.render(
+            id=42, name=DATA['name'], phone=t.label(DATA['phone']), service=t.label(DATA['service']),
+            business=DATA['business'], budget=t.label(DATA['budget']), contact='Telegram'
+        )
+
+    cases = {
+        'контакты: replace на каждый запрос': lambda: app.Messages.CONTACTS.replace(
+            '{manager_username}', app.Config.MANAGER_USERNAME
+        ),
+        'контакты: готовая строка (ru)': lambda: app.texts_for(user).CONTACTS,
+        'контакты: готовая строка (en-GB)': lambda: app.texts_for(user_en).CONTACTS,
+        'заявка: f-строка без экранирования': lead_accepted_fstring,
+        'заявка: Template с экранированием': lead_accepted_template,
+    }
+    for name, func in cases.items():
+        print(f'  {name:38} {measure(func, NUMBER):6.2f} мкс')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Накладные расходы антифлуда на один апдейт.
+
+Middleware вызывается напрямую с пустым обработчиком: корутина завершается
+без переключений, поэтому время — это чистая стоимость проверки лимита.
+Пользователи перебираются по кругу (по два вызова на каждого), чтобы
+бакеты не опустели и мерился обычный путь без предупреждений.
+
+Запуск: python benchmarks/bench_throttling.py
+"""
+import datetime
+import tracemalloc
+
+from common import load_app, measure
+
+app = load_app()
+
+from aiogram import types
+
+NUMBER = 200_000
+USERS = 100_000
+
+
+async def noop(event, data):
+    return None
+
+
+def drive(coro):
+    """Выполняет корутину, которая не уходит в ожидание"""
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError('корутина ушла в ожидание')
+
+
+def main():
+    now = datetime.datetime.now()
+    chat = types.Chat(id=1, type='private')
+    users = [types.User(id=i, is_bot=False, first_name='Bench') for i in range(1, USERS + 1)]
+    events = {
+        'команда': types.Message(message_id=1, date=now, chat=chat, text='/start'),
+        'ввод': types.Message(message_id=1, date=now, chat=chat, text='Иван Петров'),
+        'кнопка': types.CallbackQuery(id='1', from_user=users[0], chat_instance='1', data='service_smm'),
+    }
+
+    middleware = app.ThrottlingMiddleware()
+    # Разгоняем LRU до рабочего размера
+    for user in users:
+        drive(middleware(noop, events['ввод'], {'event_from_user': user}))
+    datas = [{'event_from_user': user} for user in users]
+
+    def run(call, event):
+        step = iter(range(NUMBER + 1))
+        return measure(lambda: drive(call(noop, event, datas[next(step) % USERS])), NUMBER)
+
+    def direct(handler, event, data):
+        return handler(event, data)
+
+    baseline = run(direct, events['ввод'])
+    print(f'Пользователей: {USERS}, вызовов: {NUMBER}')
+    print(f'  {"без middleware":16} {baseline:6.2f} мкс')
+    for name, event in events.items():
+        elapsed = run(middleware, event)
+        print(f'  {name:16} {elapsed:6.2f} мкс, накладные {elapsed - baseline:5.2f} мкс')
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fresh = app.ThrottlingMiddleware()
+    for user in users:
+        drive(fresh(noop, events['ввод'], {'event_from_user': user}))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f'Память на пользователя: {(after - before) / USERS:.0f} байт')
+    print(f'Флуд-событий за прогон: {middleware.floods}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Общие помощники для бенчмарков: импорт app.py в изолированном каталоге, порты, /health"""
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app():
+    """Импортирует app.py с тестовым токеном; файлы данных пишутся во временный каталог"""
+    os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+    os.chdir(tempfile.mkdtemp(prefix='bot-bench-'))
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import app
+    return app
+
+
+def measure(func, number):
+    """Среднее время одного вызова в микросекундах"""
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def health_status(port):
+    """HTTP-код ответа /health или None, если порт еще закрыт"""
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    except OSError:
+        return None
+    try:
+        writer.write(b'GET /health HTTP/1.0\r\nHost: localhost\r\n\r\n')
+        await writer.drain()
+        status_line = await reader.readline()
+        return int(status_line.split()[1]) if status_line else None
+    except (OSError, IndexError, ValueError):
+        return None
+    finally:
+        writer.close()
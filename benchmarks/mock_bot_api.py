@@ -0,0 +1,156 @@
+"""Заглушка Bot API для бенчмарков: отдает апдейты через getUpdates и принимает ответы бота.
+
+Бот подключается к ней через BOT_API_URL=http://127.0.0.1:<порт>. Методы
+отправки сообщений возвращают правдоподобный Message, остальные — True.
+Каждый вызов записывается в calls вместе со временем получения, а адрес
+клиента — в connections: по нему видно, сколько соединений открыл бот.
+Если задан listener(method, params, at), он вызывается на каждый запрос бота.
+"""
+import asyncio
+import itertools
+import time
+
+from aiohttp import web
+
+MESSAGE_METHODS = {'sendMessage', 'editMessageText', 'sendDocument', 'copyMessage'}
+
+
+def message_update(update_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'text': text
+        }
+    }
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': '...'
+            }
+        }
+    }
+
+
+class MockBotAPI:
+    def __init__(self, latency=0.0):
+        # Искусственная задержка ответа, как у настоящего api.telegram.org
+        self.latency = latency
+        self.calls = []
+        self.connections = set()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._updates = []
+        self._new_updates = asyncio.Event()
+        self._runner = None
+        self.port = None
+        self.listener = None
+
+    # ---------- апдейты ----------
+    def new_message(self, user_id, text):
+        return message_update(next(self._update_ids), user_id, text)
+
+    def new_callback(self, user_id, data):
+        return callback_update(next(self._update_ids), user_id, data)
+
+    def add_message(self, user_id, text):
+        self.push(self.new_message(user_id, text))
+
+    def add_callback(self, user_id, data):
+        self.push(self.new_callback(user_id, data))
+
+    def push(self, update):
+        """Кладет апдейт в очередь getUpdates"""
+        self._updates.append(update)
+        self._new_updates.set()
+
+    @property
+    def pending(self):
+        return len(self._updates)
+
+    # ---------- ответы бота ----------
+    def count(self, method):
+        return sum(1 for name, _, _ in self.calls if name == method)
+
+    async def wait_for(self, method, chat_id=None, timeout=60):
+        """Ждет первый вызов method (в чат chat_id); возвращает время его получения"""
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            for name, params, at in self.calls:
+                if name == method and (chat_id is None or str(params.get('chat_id')) == str(chat_id)):
+                    return at
+            await asyncio.sleep(0.005)
+        raise TimeoutError(f'{method} не вызван за {timeout} с')
+
+    # ---------- HTTP ----------
+    async def _handle(self, request):
+        method = request.match_info['method']
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == 'application/json':
+                params.update(await request.json())
+            else:
+                params.update((key, value) for key, value in (await request.post()).items()
+                              if isinstance(value, str))
+        at = time.perf_counter()
+        self.calls.append((method, params, at))
+        self.connections.add(request.transport.get_extra_info('peername'))
+        if self.listener is not None:
+            self.listener(method, params, at)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == 'getUpdates':
+            return web.json_response({'ok': True, 'result': await self._get_updates(params)})
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method in MESSAGE_METHODS:
+            result = {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'text': params.get('text', '')
+            }
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _get_updates(self, params):
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), min(float(params.get('timeout', 0)), 1.0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{self.port}'
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()